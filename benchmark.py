@@ -0,0 +1,211 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the password derivation and the key derivation of the crypter. Run it with
+``python3 benchmark.py`` to get a JSON report. Pass a previous report with ``--baseline`` to fail if the
+median latency got worse than the allowed threshold.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+from password_generator import CtSesam, get_strength_template
+from password_setting import PasswordSetting
+from crypter import Crypter
+import crypto_backend
+
+DEFAULT_ITERATIONS = [1, 1024, 4096, 32768, 100000]
+DEFAULT_LENGTHS = [4, 10, 16, 24, 36]
+DEFAULT_COMPLEXITIES = list(range(7))
+
+
+def percentile(values, p):
+    """
+    Returns the p-th percentile of the values using the nearest rank.
+
+    :param values: measured values
+    :type values: [float]
+    :param p: percentile between 0 and 100
+    :type p: float
+    :return: the percentile
+    :rtype: float
+    """
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(math.ceil(p / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def measure(function, repetitions):
+    """
+    Calls the function repeatedly and returns a summary of the durations.
+
+    :param function: function without parameters
+    :type function: function
+    :param repetitions: number of calls
+    :type repetitions: int
+    :return: ops per second, p50 and p99 latency in seconds and the number of repetitions
+    :rtype: dict
+    """
+    durations = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    total = sum(durations)
+    return {
+        "ops_per_second": len(durations) / total if total > 0 else float('inf'),
+        "p50": percentile(durations, 50),
+        "p99": percentile(durations, 99),
+        "repetitions": len(durations)
+    }
+
+
+def machine_info():
+    """
+    Collects information about the machine so reports can be compared.
+
+    :return: machine information
+    :rtype: dict
+    """
+    return {
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation()
+    }
+
+
+def run_benchmarks(iterations_list=DEFAULT_ITERATIONS, lengths=DEFAULT_LENGTHS, complexities=DEFAULT_COMPLEXITIES,
+                   repetitions=5, generate_repetitions=200, backends=None):
+    """
+    Runs all benchmarks. The hash cache is bypassed so every CtSesam measures a full PBKDF2. The key derivations
+    are measured for every crypto backend. The selected backend is restored afterwards.
+
+    :param iterations_list: iteration counts for the key derivations
+    :type iterations_list: [int]
+    :param lengths: template lengths for CtSesam.generate
+    :type lengths: [int]
+    :param complexities: complexities for CtSesam.generate
+    :type complexities: [int]
+    :param repetitions: number of runs for every key derivation
+    :type repetitions: int
+    :param generate_repetitions: number of runs for every template
+    :type generate_repetitions: int
+    :param backends: names of the crypto backends (defaults to all available backends)
+    :type backends: [str]
+    :return: results by benchmark name
+    :rtype: dict
+    """
+    kgk = b'\x42' * 64
+    salt = b'\x17' * 32
+    results = {}
+    if backends is None:
+        backends = [name for name in crypto_backend.get_available_backends()
+                    if crypto_backend.kdf_works(crypto_backend.get_backend_class(name))]
+    selected_kdf, selected_cipher = crypto_backend.kdf_backend, crypto_backend.cipher_backend
+    try:
+        for backend in backends:
+            crypto_backend.set_backend(backend)
+            for iterations in iterations_list:
+                suffix = "/backend=" + backend + "/iterations=" + str(iterations)
+                results["CtSesam.__init__" + suffix] = measure(
+                    lambda: CtSesam('some.domain', 'user', kgk, salt, iterations, use_cache=False), repetitions)
+                results["Crypter.createIvKey" + suffix] = measure(
+                    lambda: Crypter.createIvKey(b'masterpassword', salt, iterations), repetitions)
+                results["Crypter.create_key" + suffix] = measure(
+                    lambda: Crypter.create_key(kgk, salt, iterations), repetitions)
+    finally:
+        crypto_backend.kdf_backend, crypto_backend.cipher_backend = selected_kdf, selected_cipher
+    generator = CtSesam('some.domain', 'user', kgk, salt, 1, use_cache=False)
+    setting = PasswordSetting('some.domain')
+    for length in lengths:
+        for complexity in complexities:
+            setting.set_template(get_strength_template(complexity, length))
+            results["CtSesam.generate/length=" + str(length) + "/complexity=" + str(complexity)] = measure(
+                lambda: generator.generate(setting), generate_repetitions)
+    return results
+
+
+def find_regressions(results, baseline, threshold):
+    """
+    Compares the p50 latencies with a baseline report.
+
+    :param results: current results by benchmark name
+    :type results: dict
+    :param baseline: results of a previous report by benchmark name
+    :type baseline: dict
+    :param threshold: allowed slowdown (0.2 means 20% slower)
+    :type threshold: float
+    :return: names of the regressed benchmarks with baseline and current p50
+    :rtype: [(str, float, float)]
+    """
+    regressions = []
+    for name in sorted(results.keys()):
+        if name in baseline and baseline[name]["p50"] > 0 and \
+           results[name]["p50"] > baseline[name]["p50"] * (1 + threshold):
+            regressions.append((name, baseline[name]["p50"], results[name]["p50"]))
+    return regressions
+
+
+def int_list(value):
+    """
+    Parses a comma separated list of integers.
+
+    :param value: something like "1,1024,4096"
+    :type value: str
+    :return: the integers
+    :rtype: [int]
+    """
+    return [int(part) for part in value.split(',') if part.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the password and key derivation.")
+    parser.add_argument('--iterations', type=int_list, default=DEFAULT_ITERATIONS,
+                        help="Comma separated iteration counts (1 to 100000).")
+    parser.add_argument('--lengths', type=int_list, default=DEFAULT_LENGTHS,
+                        help="Comma separated template lengths (4 to 36).")
+    parser.add_argument('--complexities', type=int_list, default=DEFAULT_COMPLEXITIES,
+                        help="Comma separated complexities (0 to 6).")
+    parser.add_argument('--backends', type=lambda value: [part for part in value.split(',') if part.strip()],
+                        help="Comma separated crypto backends (default: all available).")
+    parser.add_argument('-r', '--repetitions', type=int, default=5, help="Runs per key derivation.")
+    parser.add_argument('-o', '--output', help="Write the JSON report to this file.")
+    parser.add_argument('-b', '--baseline', help="JSON report of a previous run.")
+    parser.add_argument('-t', '--threshold', type=float, default=0.2,
+                        help="Allowed p50 slowdown compared to the baseline (default 0.2 = 20%%).")
+    args = parser.parse_args(argv)
+    report = {
+        "date": datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": machine_info(),
+        "backends": crypto_backend.get_available_backends(),
+        "results": run_benchmarks(args.iterations, args.lengths, args.complexities, args.repetitions,
+                                  backends=args.backends)
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = find_regressions(report["results"], baseline["results"], args.threshold)
+        for name, baseline_p50, p50 in regressions:
+            print("Regression in " + name + ": p50 " + str(baseline_p50) + "s -> " + str(p50) + "s",
+                  file=sys.stderr)
+        if len(regressions) > 0:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
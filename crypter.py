@@ -4,15 +4,17 @@
 Encryption and decryption module.
 """
 
-from Crypto.Cipher import AES
-from hashlib import pbkdf2_hmac
+from crypto_backend import pbkdf2, new_aes_cbc
+from hashlib import sha256
+import hmac
 import os
 
 
 class Crypter(object):
     """
     Encrypt and decrypt with AES in CBC mode with PKCS7 padding. The constructor calculates the key from the given
-    password and salt with PBKDF2 using HMAC with SHA512 and 32768 iterations.
+    password and salt with PBKDF2 using HMAC with SHA512 and 32768 iterations. PBKDF2 and AES are calculated by the
+    backend selected in crypto_backend.
     """
     def __init__(self, key_iv):
         if len(key_iv) == 48:
@@ -35,7 +37,7 @@ class Crypter(object):
         :return: a key
         :rtype: bytes
         """
-        return pbkdf2_hmac('sha256', password, salt, iterations)
+        return pbkdf2('sha256', password, salt, iterations)
 
     @staticmethod
     def createIvKey(password, salt, iterations=32768):
@@ -51,7 +53,7 @@ class Crypter(object):
         :return: a key
         :rtype: bytes
         """
-        return pbkdf2_hmac('sha384', password, salt, iterations)
+        return pbkdf2('sha384', password, salt, iterations)
 
     @staticmethod
     def createSalt():
@@ -73,6 +75,27 @@ class Crypter(object):
         """
         return os.urandom(16)
 
+    def get_key_check_value(self):
+        """
+        Creates a check value for key and iv. It is stored with the kgk block so a wrong password is recognized
+        without decrypting anything. The value is a truncated HMAC which does not reveal the key.
+
+        :return: 16 bytes check value
+        :rtype: bytes
+        """
+        return hmac.new(self.key + self.iv, b"c't SESAM key check", sha256).digest()[:16]
+
+    def check_key(self, key_check_value):
+        """
+        Compares a stored key check value with the check value of this crypter in constant time.
+
+        :param key_check_value: the stored check value
+        :type key_check_value: bytes
+        :return: do they match?
+        :rtype: bool
+        """
+        return hmac.compare_digest(key_check_value, self.get_key_check_value())
+
     @staticmethod
     def add_pkcs7_padding(data):
         """
@@ -94,7 +117,7 @@ class Crypter(object):
         :return: encrypted data
         :rtype: bytes
         """
-        aes_object = AES.new(self.key, AES.MODE_CBC, self.iv)
+        aes_object = new_aes_cbc(self.key, self.iv)
         return aes_object.encrypt(self.add_pkcs7_padding(data))
 
     def encrypt_unpadded(self, data):
@@ -105,7 +128,7 @@ class Crypter(object):
         :return: encrypted data
         :rtype: bytes
         """
-        aes_object = AES.new(self.key, AES.MODE_CBC, self.iv)
+        aes_object = new_aes_cbc(self.key, self.iv)
         return aes_object.encrypt(data)
 
     @staticmethod
@@ -127,7 +150,7 @@ class Crypter(object):
         :return: decrypted data
         :rtype: bytes
         """
-        aes_object = AES.new(self.key, AES.MODE_CBC, self.iv)
+        aes_object = new_aes_cbc(self.key, self.iv)
         return self.remove_pkcs7_padding(aes_object.decrypt(encrypted_data))
 
     def decrypt_unpadded(self, encrypted_data):
@@ -138,5 +161,5 @@ class Crypter(object):
         :return: decrypted data
         :rtype: bytes
         """
-        aes_object = AES.new(self.key, AES.MODE_CBC, self.iv)
+        aes_object = new_aes_cbc(self.key, self.iv)
         return aes_object.decrypt(encrypted_data)
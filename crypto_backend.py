@@ -0,0 +1,322 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Backends for PBKDF2 and AES. hashlib, pycryptodome (or pycrypto) and the cryptography package produce identical
+results so the fastest installed one is used. Set the environment variable CTSESAM_BACKEND or call set_backend to
+choose a backend explicitly.
+"""
+
+import hashlib
+import os
+import time
+from threading import RLock
+
+BACKEND_ENVIRONMENT_VARIABLE = 'CTSESAM_BACKEND'
+
+
+class HashlibBackend(object):
+    """
+    PBKDF2 from hashlib which uses OpenSSL if available. hashlib has no AES.
+    """
+    name = 'hashlib'
+
+    @staticmethod
+    def is_available():
+        return hasattr(hashlib, 'pbkdf2_hmac')
+
+    @staticmethod
+    def pbkdf2(hash_name, password, salt, iterations):
+        return hashlib.pbkdf2_hmac(hash_name, password, salt, iterations)
+
+    new_cipher = None
+
+
+class PycryptodomeBackend(object):
+    """
+    PBKDF2 and AES from pycryptodome. With pycrypto only AES is used because its PBKDF2 can not use SHA2 as fast.
+    """
+    name = 'pycryptodome'
+
+    @staticmethod
+    def is_available():
+        try:
+            from Crypto.Cipher import AES
+            return True
+        except ImportError:
+            return False
+
+    @staticmethod
+    def pbkdf2(hash_name, password, salt, iterations):
+        from Crypto.Protocol.KDF import PBKDF2
+        from Crypto.Hash import SHA256, SHA384, SHA512
+        hash_module = {'sha256': SHA256, 'sha384': SHA384, 'sha512': SHA512}[hash_name]
+        return PBKDF2(password, salt, dkLen=hash_module.digest_size, count=iterations,
+                      hmac_hash_module=hash_module)
+
+    @staticmethod
+    def new_cipher(key, iv):
+        from Crypto.Cipher import AES
+        return AES.new(key, AES.MODE_CBC, iv)
+
+
+class CryptographyCipher(object):
+    """
+    Wraps a cryptography Cipher so it has the same interface as a pycrypto AES object.
+    """
+    def __init__(self, key, iv):
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+        from cryptography.hazmat.backends import default_backend
+        self.cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
+
+    def encrypt(self, data):
+        encryptor = self.cipher.encryptor()
+        return encryptor.update(data) + encryptor.finalize()
+
+    def decrypt(self, data):
+        decryptor = self.cipher.decryptor()
+        return decryptor.update(data) + decryptor.finalize()
+
+
+class CryptographyBackend(object):
+    """
+    PBKDF2 and AES from the cryptography package.
+    """
+    name = 'cryptography'
+
+    @staticmethod
+    def is_available():
+        try:
+            import cryptography.hazmat.primitives.ciphers
+            return True
+        except ImportError:
+            return False
+
+    @staticmethod
+    def pbkdf2(hash_name, password, salt, iterations):
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+        from cryptography.hazmat.backends import default_backend
+        algorithm = {'sha256': hashes.SHA256, 'sha384': hashes.SHA384, 'sha512': hashes.SHA512}[hash_name]()
+        return PBKDF2HMAC(algorithm=algorithm, length=algorithm.digest_size, salt=salt, iterations=iterations,
+                          backend=default_backend()).derive(password)
+
+    new_cipher = CryptographyCipher
+
+
+BACKENDS = [HashlibBackend, PycryptodomeBackend, CryptographyBackend]
+
+kdf_backend = None
+cipher_backend = None
+backend_lock = RLock()
+
+
+def kdf_works(backend):
+    """
+    Checks if the PBKDF2 of the backend works and calculates the same values as hashlib.
+
+    :param backend: a backend class
+    :return: does it work?
+    :rtype: bool
+    """
+    try:
+        if not backend.is_available() or backend.pbkdf2 is None:
+            return False
+        for hash_name in ['sha256', 'sha384', 'sha512']:
+            if backend.pbkdf2(hash_name, b'password', b'salt', 3) != \
+               hashlib.pbkdf2_hmac(hash_name, b'password', b'salt', 3):
+                return False
+        return True
+    except Exception:
+        return False
+
+
+def cipher_works(backend):
+    """
+    Checks if the AES of the backend works. The reference ciphertext is from FIPS-197.
+
+    :param backend: a backend class
+    :return: does it work?
+    :rtype: bool
+    """
+    try:
+        if not backend.is_available() or backend.new_cipher is None:
+            return False
+        key = bytes(range(32))
+        plaintext = bytes.fromhex('00112233445566778899aabbccddeeff')
+        ciphertext = bytes.fromhex('8ea2b7ca516745bfeafc49904b496089')
+        return backend.new_cipher(key, b'\x00'*16).encrypt(plaintext) == ciphertext and \
+            backend.new_cipher(key, b'\x00'*16).decrypt(ciphertext) == plaintext
+    except Exception:
+        return False
+
+
+def get_available_backends():
+    """
+    Returns the names of all installed backends which pass the self tests.
+
+    :return: names of the backends
+    :rtype: [str]
+    """
+    return [backend.name for backend in BACKENDS if kdf_works(backend) or cipher_works(backend)]
+
+
+def get_backend_class(name):
+    """
+    Returns the backend class for a name.
+
+    :param name: hashlib, pycryptodome or cryptography
+    :type name: str
+    :return: backend class
+    """
+    for backend in BACKENDS:
+        if backend.name == name:
+            return backend
+    raise ValueError("Unknown crypto backend: " + str(name))
+
+
+def measure_kdf(backend, iterations=1000, repetitions=3):
+    """
+    Measures how long the backend needs for a short PBKDF2. The fastest of the repetitions counts.
+
+    :param backend: a backend class
+    :param iterations: iteration count of the measurement
+    :type iterations: int
+    :param repetitions: number of measurements
+    :type repetitions: int
+    :return: the duration in seconds
+    :rtype: float
+    """
+    durations = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        backend.pbkdf2('sha512', b'password', b'salt', iterations)
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def measure_cipher(backend, size=65536, repetitions=3):
+    """
+    Measures how long the backend needs to encrypt some data. The fastest of the repetitions counts.
+
+    :param backend: a backend class
+    :param size: number of bytes to encrypt
+    :type size: int
+    :param repetitions: number of measurements
+    :type repetitions: int
+    :return: the duration in seconds
+    :rtype: float
+    """
+    durations = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        backend.new_cipher(b'\x00'*32, b'\x00'*16).encrypt(b'\x00'*size)
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def select_backends():
+    """
+    Selects the fastest working backends for PBKDF2 and for AES with a quick microbenchmark.
+
+    :return: the kdf backend and the cipher backend
+    """
+    kdf_candidates = [backend for backend in BACKENDS if kdf_works(backend)]
+    cipher_candidates = [backend for backend in BACKENDS if cipher_works(backend)]
+    fastest_kdf = min(kdf_candidates, key=measure_kdf) if kdf_candidates else None
+    fastest_cipher = min(cipher_candidates, key=measure_cipher) if cipher_candidates else None
+    return fastest_kdf, fastest_cipher
+
+
+def get_first_working(works):
+    """
+    Returns the first backend which passes a self test. Nothing is measured.
+
+    :param works: kdf_works or cipher_works
+    :return: a backend class or None
+    """
+    for backend in BACKENDS:
+        if works(backend):
+            return backend
+    return None
+
+
+def set_backend(name=None):
+    """
+    Chooses the backend. If name is None the environment variable CTSESAM_BACKEND is used. If that is not set
+    either the fastest backend is selected with a microbenchmark. A named backend without AES (hashlib) or without
+    a usable PBKDF2 (pycrypto) is combined with the first working backend for the missing part.
+
+    :param name: hashlib, pycryptodome, cryptography or None
+    :type name: str
+    """
+    global kdf_backend, cipher_backend
+    if name is None:
+        name = os.environ.get(BACKEND_ENVIRONMENT_VARIABLE)
+    if name:
+        backend = get_backend_class(name)
+        if not kdf_works(backend) and not cipher_works(backend):
+            raise ValueError("The crypto backend " + name + " is not available.")
+        selected_kdf = backend if kdf_works(backend) else get_first_working(kdf_works)
+        selected_cipher = backend if cipher_works(backend) else get_first_working(cipher_works)
+    else:
+        selected_kdf, selected_cipher = select_backends()
+    with backend_lock:
+        cipher_backend = selected_cipher
+        kdf_backend = selected_kdf
+
+
+def ensure_backend():
+    """
+    Selects the backends if this was not done yet. Threads which need a backend at the same time wait for one
+    selection.
+    """
+    if kdf_backend is None:
+        with backend_lock:
+            if kdf_backend is None:
+                set_backend()
+
+
+def get_backend_names():
+    """
+    Returns the names of the selected backends.
+
+    :return: name of the kdf backend and name of the cipher backend
+    :rtype: (str, str)
+    """
+    ensure_backend()
+    return kdf_backend.name, cipher_backend.name if cipher_backend else None
+
+
+def pbkdf2(hash_name, password, salt, iterations):
+    """
+    Calculates PBKDF2 with HMAC. The length of the result is the digest size of the hash.
+
+    :param hash_name: sha256, sha384 or sha512
+    :type hash_name: str
+    :param password: the password
+    :type password: bytes
+    :param salt: the salt
+    :type salt: bytes
+    :param iterations: iteration count
+    :type iterations: int
+    :return: the derived key
+    :rtype: bytes
+    """
+    ensure_backend()
+    return kdf_backend.pbkdf2(hash_name, password, salt, iterations)
+
+
+def new_aes_cbc(key, iv):
+    """
+    Creates an AES object in CBC mode with encrypt and decrypt methods.
+
+    :param key: 32 bytes key
+    :type key: bytes
+    :param iv: 16 bytes iv
+    :type iv: bytes
+    :return: AES object
+    """
+    ensure_backend()
+    if cipher_backend is None:
+        raise ImportError("Please install pycryptodome, pycrypto or cryptography for AES.")
+    return cipher_backend.new_cipher(key, iv)
@@ -2,20 +2,32 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import atexit
 import os
 from PySide.QtGui import QApplication, QWidget, QBoxLayout, QFont, QIcon, QFrame
-from PySide.QtGui import QLabel, QLineEdit, QComboBox, QToolButton
-from PySide.QtCore import Qt, QSize, QPoint, QCoreApplication, QSettings
+from PySide.QtGui import QLabel, QLineEdit, QComboBox, QToolButton, QProgressBar
+from PySide.QtCore import Qt, QSize, QPoint, QCoreApplication, QSettings, QTimer, QThreadPool, QObject, Signal
 from PySide.QtNetwork import QNetworkAccessManager
 from password_strength_selector import PasswordStrengthSelector
 from settings_window import SettingsWindow
 from base64 import b64decode
 
-from password_generator import CtSesam
 from preference_manager import PreferenceManager
+from sqlite_preference_manager import SQLitePreferenceManager
 from kgk_manager import KgkManager
 from password_settings_manager import PasswordSettingsManager
 from decrypt_kgk_task import DecryptKgkTask
+from kdf_service import KdfService
+from persistence_worker import PersistenceWorker
+from settings_container import CONTAINER_VERSION_2
+import crypto_backend
+from iteration_calibrator import recommend_iterations, exceeds_latency_budget, estimate_latency, is_calibrated
+from generate_password_task import GeneratePasswordTask, PrecomputeHashesTask, CalibrateIterationsTask
+from generate_password_task import GeneratePasswordsTask
+
+
+class PersistenceSignals(QObject):
+    write_error = Signal(str)
 
 
 class MainWindow(QWidget, object):
@@ -27,25 +39,60 @@ class MainWindow(QWidget, object):
     username_edit = None
     strength_label = None
     strength_selector = None
+    iterations_warning = None
+    reload_warning = None
+    write_warning = None
     password_label = None
     password = None
     sync_button = None
     clipboard_button = None
     setting = None
     decrypt_kgk_task = None
+    sync_pending = False
     settings_window = None
+    recorded_domain = None
+    migration_progress = None
+    migration_cancel_button = None
+    migration_task = None
+    migration_settings = None
+    migration_kgk_manager = None
 
-    def __init__(self):
+    def __init__(self, preference_manager=None):
         super(MainWindow, self).__init__()
         self.nam = QNetworkAccessManager()
         self.setWindowIcon(QIcon(os.path.join('icons', 'Logo_rendered_edited.png')))
         layout = QBoxLayout(QBoxLayout.TopToBottom)
         layout.setContentsMargins(0, 0, 0, 0)
-        self.preference_manager = PreferenceManager()
+        self.preference_manager = preference_manager if preference_manager else PreferenceManager()
+        self.kdf_service = KdfService()
         self.kgk_manager = KgkManager()
         self.kgk_manager.set_preference_manager(self.preference_manager)
+        self.kgk_manager.set_kdf_service(self.kdf_service)
+        self.persistence_worker = PersistenceWorker()
+        atexit.register(self.persistence_worker.close)
         self.settings_manager = PasswordSettingsManager(self.preference_manager)
+        self.settings_manager.set_persistence_worker(self.persistence_worker)
+        self.persistence_signals = PersistenceSignals()
+        self.persistence_signals.write_error.connect(self.show_write_error)
+        self.settings_manager.set_write_error_callback(
+            lambda error: self.persistence_signals.write_error.emit(str(error) if error else ""))
         self.setting_dirty = True
+        self.generation_request_id = 0
+        self.generate_password_tasks = {}
+        self.generation_timer = QTimer()
+        self.generation_timer.setSingleShot(True)
+        self.generation_timer.setInterval(150)
+        self.generation_timer.timeout.connect(self.start_password_generation)
+        self.speculative_unlock = False
+        self.speculative_future = None
+        self.speculation_timer = QTimer()
+        self.speculation_timer.setSingleShot(True)
+        self.speculation_timer.setInterval(500)
+        self.speculation_timer.timeout.connect(self.start_speculative_unlock)
+        self.calibrate_iterations_task = CalibrateIterationsTask()
+        self.calibrate_iterations_task.setAutoDelete(False)
+        self.calibrate_iterations_task.signals.finished.connect(self.iterations_calibrated)
+        QThreadPool.globalInstance().start(self.calibrate_iterations_task)
         # Header bar
         header_bar = QFrame()
         header_bar.setStyleSheet(
@@ -121,6 +168,8 @@ class MainWindow(QWidget, object):
         self.domain_edit.setEditable(True)
         self.domain_edit.textChanged.connect(self.domain_changed)
         self.domain_edit.currentIndexChanged.connect(self.domain_changed)
+        self.domain_edit.highlighted[str].connect(self.domain_highlighted)
+        self.domain_edit.activated[str].connect(self.domain_activated)
         self.domain_edit.lineEdit().editingFinished.connect(self.domain_entered)
         self.domain_edit.lineEdit().returnPressed.connect(self.move_focus)
         self.domain_edit.setMaximumHeight(28)
@@ -152,6 +201,24 @@ class MainWindow(QWidget, object):
         self.strength_label.setBuddy(self.strength_selector)
         layout.addWidget(self.strength_label)
         layout.addWidget(self.strength_selector)
+        # Iteration warning
+        self.iterations_warning = QLabel()
+        self.iterations_warning.setWordWrap(True)
+        self.iterations_warning.setStyleSheet("QLabel { color: rgb(215, 0, 0); }")
+        self.iterations_warning.setVisible(False)
+        layout.addWidget(self.iterations_warning)
+        # Reload warning
+        self.reload_warning = QLabel()
+        self.reload_warning.setWordWrap(True)
+        self.reload_warning.setStyleSheet("QLabel { color: rgb(215, 0, 0); }")
+        self.reload_warning.setVisible(False)
+        layout.addWidget(self.reload_warning)
+        # Write warning
+        self.write_warning = QLabel()
+        self.write_warning.setWordWrap(True)
+        self.write_warning.setStyleSheet("QLabel { color: rgb(215, 0, 0); }")
+        self.write_warning.setVisible(False)
+        layout.addWidget(self.write_warning)
         # Password
         self.password_label = QLabel("&Passwort:")
         self.password_label.setVisible(False)
@@ -163,6 +230,18 @@ class MainWindow(QWidget, object):
         self.password_label.setBuddy(self.password)
         layout.addWidget(self.password_label)
         layout.addWidget(self.password)
+        # Migration progress
+        migration_layout = QBoxLayout(QBoxLayout.LeftToRight)
+        self.migration_progress = QProgressBar()
+        self.migration_progress.setFormat("Passwörter werden gesichert: %v von %m")
+        self.migration_progress.setVisible(False)
+        migration_layout.addWidget(self.migration_progress)
+        self.migration_cancel_button = QToolButton()
+        self.migration_cancel_button.setText("Abbrechen")
+        self.migration_cancel_button.clicked.connect(self.cancel_migration)
+        self.migration_cancel_button.setVisible(False)
+        migration_layout.addWidget(self.migration_cancel_button)
+        layout.addLayout(migration_layout)
 
     def set_masterpassword(self, masterpassword):
         self.master_password_edit.setText(masterpassword)
@@ -175,17 +254,59 @@ class MainWindow(QWidget, object):
         settings.setValue("MainWindow/size", self.size())
         settings.setValue("MainWindow/pos", self.pos())
         settings.sync()
+        if self.kgk_manager.has_kgk() and not self.is_decrypting_kgk():
+            try:
+                self.settings_manager.flush(self.kgk_manager)
+            except ValueError as e:
+                print(e)
+        self.persistence_worker.close()
+        self.kdf_service.shutdown(wait=False)
 
     def masterpassword_changed(self):
+        self.cancel_password_generation()
         self.kgk_manager.reset()
+        self.kdf_service.clear_cache()
+        self.recorded_domain = None
+        self.cancel_migration()
+        if self.decrypt_kgk_task:
+            self.decrypt_kgk_task.cancel()
         self.decrypt_kgk_task = None
+        self.sync_pending = False
+        self.master_password_edit.setStyleSheet("")
+        self.master_password_edit.setToolTip("")
+        self.cancel_speculative_unlock()
+        if self.speculative_unlock and len(self.master_password_edit.text()) > 0:
+            self.speculation_timer.start()
         self.clipboard_button.setVisible(False)
         if len(self.master_password_edit.text()) > 0:
             self.sync_button.setVisible(True)
         else:
             self.sync_button.setVisible(False)
 
+    def set_speculative_unlock(self, enabled):
+        self.speculative_unlock = enabled
+
+    def enable_record_encryption(self):
+        self.settings_manager.set_container_version(CONTAINER_VERSION_2)
+
+    def enable_settings_log(self):
+        self.settings_manager.enable_log()
+
+    def start_speculative_unlock(self):
+        salt = self.preference_manager.get_salt()
+        if len(self.master_password_edit.text()) > 0 and len(salt) == 32 and not self.decrypt_kgk_task:
+            self.speculative_future = self.kdf_service.create_iv_key(
+                self.master_password_edit.text().encode('utf-8'), salt)
+
+    def cancel_speculative_unlock(self):
+        self.speculation_timer.stop()
+        if self.speculative_future:
+            self.kdf_service.cancel(self.speculative_future)
+        self.speculative_future = None
+
     def masterpassword_entered(self):
+        self.speculation_timer.stop()
+        self.speculative_future = None
         if len(self.master_password_edit.text()) > 0 and not self.decrypt_kgk_task:
             self.kgk_manager.get_kgk_crypter_salt()
             self.decrypt_kgk_task = DecryptKgkTask(
@@ -193,7 +314,36 @@ class MainWindow(QWidget, object):
                 self.preference_manager,
                 self.kgk_manager,
                 self.settings_manager,
-                self.domain_edit)
+                self.domain_edit,
+                self.kdf_service)
+            self.decrypt_kgk_task.finished.connect(self.kgk_decrypted)
+            self.decrypt_kgk_task.wrong_password.connect(self.wrong_masterpassword)
+
+    def is_decrypting_kgk(self):
+        return self.decrypt_kgk_task is not None and self.decrypt_kgk_task.is_running()
+
+    def has_wrong_masterpassword(self):
+        return self.decrypt_kgk_task is not None and self.decrypt_kgk_task.failed
+
+    def wrong_masterpassword(self):
+        self.sync_pending = False
+        self.master_password_edit.setStyleSheet("QLineEdit { border: 2px solid rgb(215, 0, 0); }")
+        self.master_password_edit.setToolTip("Falsches Master-Passwort")
+
+    def kgk_decrypted(self):
+        self.precompute_hashes(self.settings_manager.get_frequently_used_settings(10))
+        if self.sync_pending:
+            self.sync_pending = False
+            self.sync_clicked()
+
+    def precompute_hashes(self, settings):
+        settings = [setting for setting in settings if not setting.get_legacy_password()]
+        if self.kgk_manager.has_kgk() and len(settings) > 0:
+            QThreadPool.globalInstance().start(PrecomputeHashesTask(settings, self.kgk_manager.get_kgk()))
+
+    def domain_highlighted(self, domain):
+        if self.settings_manager.has_setting(domain):
+            self.precompute_hashes([self.settings_manager.get_setting(domain)])
 
     def set_visibilities(self):
         if len(self.domain_edit.lineEdit().text()) > 0:
@@ -211,19 +361,35 @@ class MainWindow(QWidget, object):
             self.password_label.setVisible(False)
             self.password.setVisible(False)
             self.clipboard_button.setVisible(False)
+            self.iterations_warning.setVisible(False)
 
     def domain_changed(self):
+        self.cancel_password_generation()
         self.setting_dirty = True
         self.password.setText("")
         self.clipboard_button.setVisible(False)
         self.set_visibilities()
-        if self.kgk_manager.has_kgk() and (not self.decrypt_kgk_task or not self.decrypt_kgk_task.is_running()) and \
+        if self.domain_edit.lineEdit().text() != self.recorded_domain:
+            self.recorded_domain = None
+        if self.kgk_manager.has_kgk() and not self.is_decrypting_kgk() and \
            len(self.domain_edit.lineEdit().text()) > 0 and \
-           self.domain_edit.lineEdit().text() in self.settings_manager.get_domain_list():
-            self.domain_entered()
+           self.settings_manager.has_setting(self.domain_edit.lineEdit().text()):
+            self.show_setting()
 
     def domain_entered(self):
-        self.setting_dirty = self.domain_edit.lineEdit().text() not in self.settings_manager.get_domain_list()
+        if self.is_decrypting_kgk() or self.has_wrong_masterpassword() or self.is_migrating():
+            return
+        self.show_setting()
+        if self.setting.get_domain() != self.recorded_domain:
+            self.settings_manager.frecency.record(self.setting.get_domain())
+            self.recorded_domain = self.setting.get_domain()
+
+    def domain_activated(self, domain):
+        self.domain_entered()
+
+    def show_setting(self):
+        self.reload_settings_if_changed()
+        self.setting_dirty = not self.settings_manager.has_setting(self.domain_edit.lineEdit().text())
         self.setting = self.settings_manager.get_setting(self.domain_edit.lineEdit().text())
         self.username_edit.blockSignals(True)
         self.username_edit.setText(self.setting.get_username())
@@ -233,8 +399,26 @@ class MainWindow(QWidget, object):
         self.strength_selector.set_complexity(self.setting.get_complexity())
         self.strength_selector.set_extra_count(len(self.setting.get_extra_character_set()))
         self.strength_selector.blockSignals(False)
+        self.check_iterations()
         self.generate_password()
 
+    def iterations_calibrated(self):
+        if self.setting and len(self.domain_edit.lineEdit().text()) > 0:
+            self.check_iterations()
+
+    def check_iterations(self):
+        iterations = self.setting.get_iterations()
+        if not is_calibrated():
+            self.iterations_warning.setVisible(False)
+        elif not self.setting.get_legacy_password() and exceeds_latency_budget(iterations):
+            self.iterations_warning.setText(
+                "Mit " + str(iterations) + " Iterationen dauert die Berechnung auf diesem Rechner etwa " +
+                str(int(round(estimate_latency(iterations)*1000))) + " ms. Empfohlen sind " +
+                str(recommend_iterations()) + " Iterationen.")
+            self.iterations_warning.setVisible(True)
+        else:
+            self.iterations_warning.setVisible(False)
+
     def move_focus(self):
         line_edits = [self.master_password_edit, self.domain_edit, self.username_edit]
         for i, edit in enumerate(line_edits):
@@ -244,6 +428,8 @@ class MainWindow(QWidget, object):
         self.generate_button.setFocus()
 
     def generate_password(self):
+        if self.is_decrypting_kgk() or self.has_wrong_masterpassword() or self.is_migrating():
+            return
         if not self.kgk_manager.has_kgk():
             self.kgk_manager.create_new_kgk()
             self.kgk_manager.create_and_save_new_kgk_block()
@@ -255,19 +441,43 @@ class MainWindow(QWidget, object):
             self.setting.calculate_template()
         self.settings_manager.set_setting(self.setting)
         if not self.setting.get_legacy_password():
-            generator = CtSesam(self.setting.get_domain(),
-                                self.setting.get_username(),
-                                self.kgk_manager.get_kgk(),
-                                self.setting.get_salt(),
-                                self.setting.get_iterations())
-            password = generator.generate(self.setting)
+            self.cancel_password_generation()
+            self.generation_timer.start()
         else:
-            password = self.setting.get_legacy_password()
+            self.cancel_password_generation()
+            self.show_password(self.setting.get_legacy_password())
+        try:
+            self.settings_manager.store_local_settings_if_dirty(self.kgk_manager)
+        except ValueError as e:
+            if not self.settings_conflict_detected(e):
+                raise
+        self.setting_dirty = False
+
+    def start_password_generation(self):
+        self.generation_request_id += 1
+        task = GeneratePasswordTask(self.generation_request_id, self.setting, self.kgk_manager.get_kgk())
+        task.setAutoDelete(False)
+        task.signals.finished.connect(self.password_generated)
+        self.generate_password_tasks[self.generation_request_id] = task
+        QThreadPool.globalInstance().start(task)
+
+    def cancel_password_generation(self):
+        self.generation_timer.stop()
+        self.generation_request_id += 1
+        for task in self.generate_password_tasks.values():
+            task.cancel()
+        self.password.setText("")
+        self.clipboard_button.setVisible(False)
+
+    def password_generated(self, request_id, password):
+        self.generate_password_tasks.pop(request_id, None)
+        if request_id == self.generation_request_id:
+            self.show_password(password)
+
+    def show_password(self, password):
         self.password.setText(password)
         self.password.setTextInteractionFlags(Qt.TextSelectableByMouse | Qt.TextSelectableByKeyboard)
         self.clipboard_button.setVisible(True)
-        self.settings_manager.store_local_settings(self.kgk_manager)
-        self.setting_dirty = False
 
     def copy_to_clipboard(self):
         QApplication.clipboard().setText(self.password.text())
@@ -290,27 +500,97 @@ class MainWindow(QWidget, object):
             self.generate_password()
 
     def migrate_local_domains(self, new_kgk_manager):
-        for domain in self.settings_manager.get_domain_list():
-            setting = self.settings_manager.get_setting(domain)
-            generator = CtSesam(setting.get_domain(),
-                                setting.get_username(),
-                                self.kgk_manager.get_kgk(),
-                                setting.get_salt(),
-                                setting.get_iterations())
-            setting.set_legacy_password(generator.generate(setting))
+        self.migration_settings = [self.settings_manager.get_setting(domain)
+                                   for domain in self.settings_manager.get_domain_list()]
+        self.migration_kgk_manager = new_kgk_manager
+        self.migration_task = GeneratePasswordsTask(self.migration_settings, self.kgk_manager.get_kgk())
+        self.migration_task.setAutoDelete(False)
+        self.migration_task.signals.progress.connect(self.migration_progressed)
+        self.migration_task.signals.finished.connect(self.migration_finished)
+        self.migration_task.signals.cancelled.connect(self.migration_cancelled)
+        self.migration_progress.setRange(0, len(self.migration_settings))
+        self.migration_progress.setValue(0)
+        self.migration_progress.setVisible(True)
+        self.migration_cancel_button.setVisible(True)
+        self.set_settings_editable(False)
+        QThreadPool.globalInstance().start(self.migration_task)
+
+    def is_migrating(self):
+        return self.migration_task is not None
+
+    def is_current_migration(self, signals):
+        return self.migration_task is not None and signals is self.migration_task.signals
+
+    def migration_progressed(self, finished_count, total_count):
+        if self.is_current_migration(self.sender()):
+            self.migration_progress.setValue(finished_count)
+
+    def migration_cancelled(self):
+        if self.is_current_migration(self.sender()):
+            self.hide_migration_progress()
+
+    def migration_finished(self):
+        if not self.is_current_migration(self.sender()):
+            return
+        for setting, password in zip(self.migration_settings, self.migration_task.passwords):
+            setting.set_legacy_password(password)
             self.settings_manager.set_setting(setting)
-        self.kgk_manager = new_kgk_manager
-        self.settings_manager.store_local_settings(self.kgk_manager)
+        self.kgk_manager = self.migration_kgk_manager
+        self.hide_migration_progress()
+        try:
+            self.settings_manager.store_settings(self.kgk_manager)
+        except ValueError as e:
+            if not self.settings_conflict_detected(e):
+                raise
+
+    def cancel_migration(self):
+        if self.migration_task:
+            self.migration_task.cancel()
+        self.hide_migration_progress()
+
+    def hide_migration_progress(self):
+        self.migration_task = None
+        self.migration_settings = None
+        self.migration_kgk_manager = None
+        self.migration_progress.setVisible(False)
+        self.migration_cancel_button.setVisible(False)
+        self.set_settings_editable(True)
+
+    def set_settings_editable(self, editable):
+        self.domain_edit.setEnabled(editable)
+        self.username_edit.setEnabled(editable)
+        self.strength_selector.setEnabled(editable)
+        self.sync_button.setEnabled(editable)
 
     # noinspection PyUnresolvedReferences
     def sync_clicked(self):
+        if self.is_migrating():
+            return
         self.masterpassword_entered()
+        if self.is_decrypting_kgk():
+            self.sync_pending = True
+            return
+        if self.has_wrong_masterpassword():
+            return
+        if self.settings_manager.conflict is not None:
+            self.show_settings_conflict()
+            return
+        try:
+            self.synchronize()
+        except ValueError as e:
+            if not self.settings_conflict_detected(e):
+                raise
+
+    # noinspection PyUnresolvedReferences
+    def synchronize(self):
+        self.settings_manager.flush(self.kgk_manager if self.kgk_manager.has_kgk() else None)
         if not self.settings_manager.sync_manager.has_settings():
             self.show_sync_settings()
         else:
             pull_successful, data = self.settings_manager.sync_manager.pull()
             if pull_successful and len(data) > 0:
                 remote_kgk_manager = KgkManager()
+                remote_kgk_manager.set_kdf_service(self.kdf_service)
                 remote_kgk_manager.update_from_blob(self.master_password_edit.text().encode('utf-8'), b64decode(data))
                 if len(self.preference_manager.get_kgk_block()) == 112 and \
                    remote_kgk_manager.has_kgk() and self.kgk_manager.has_kgk() and \
@@ -318,21 +598,60 @@ class MainWindow(QWidget, object):
                     if len(self.settings_manager.get_domain_list()) > 0:
                         print("Lokal und auf dem Server gibt es unterschiedliche KGKs. Das ist ein Problem!")
                     self.migrate_local_domains(remote_kgk_manager)
+                    return
                 else:
                     if len(self.preference_manager.get_kgk_block()) != 112:
                         self.kgk_manager = remote_kgk_manager
                         self.kgk_manager.set_preference_manager(self.preference_manager)
                         self.kgk_manager.store_local_kgk_block()
                     self.settings_manager.update_from_export_data(remote_kgk_manager, b64decode(data))
-                    self.domain_edit.blockSignals(True)
-                    current_domain = self.domain_edit.lineEdit().text()
-                    for i in reversed(range(self.domain_edit.count())):
-                        self.domain_edit.removeItem(i)
-                    self.domain_edit.insertItems(0, self.settings_manager.get_domain_list())
-                    self.domain_edit.blockSignals(False)
-                    self.domain_edit.setEditText(current_domain)
+                    self.update_domain_list()
             self.settings_manager.store_settings(self.kgk_manager)
 
+    def update_domain_list(self):
+        self.domain_edit.blockSignals(True)
+        current_domain = self.domain_edit.lineEdit().text()
+        for i in reversed(range(self.domain_edit.count())):
+            self.domain_edit.removeItem(i)
+        self.domain_edit.insertItems(0, self.settings_manager.get_domain_list())
+        self.domain_edit.blockSignals(False)
+        self.domain_edit.setEditText(current_domain)
+
+    def reload_settings_if_changed(self):
+        if not self.kgk_manager.has_kgk():
+            return
+        try:
+            reloaded = self.settings_manager.reload_if_changed(self.kgk_manager)
+        except ValueError as e:
+            print(e)
+            self.show_settings_conflict()
+            return
+        self.reload_warning.setVisible(False)
+        if reloaded:
+            self.update_domain_list()
+
+    def settings_conflict_detected(self, error):
+        if self.settings_manager.conflict is None:
+            return False
+        print(error)
+        self.show_settings_conflict()
+        return True
+
+    def show_settings_conflict(self):
+        self.reload_warning.setText("Ein anderes Programm hat die Einstellungen mit einem anderen " +
+                                    "Master-Passwort oder Schlüssel gespeichert. Seine Änderungen wurden nicht " +
+                                    "übernommen. Eigene Änderungen werden erst wieder gespeichert, wenn die " +
+                                    "Einstellungen geladen werden können.")
+        self.reload_warning.setVisible(True)
+
+    def show_write_error(self, message):
+        if len(message) > 0:
+            self.write_warning.setText("Die Einstellungen konnten nicht gespeichert werden (" + message + "). " +
+                                       "Sie werden beim nächsten Speichern erneut geschrieben.")
+            self.write_warning.setVisible(True)
+        else:
+            self.write_warning.setVisible(False)
+
     # noinspection PyUnresolvedReferences
     def show_sync_settings(self, url=None, username=None, password=None):
         self.settings_window = SettingsWindow(
@@ -351,12 +670,32 @@ if __name__ == "__main__":
                         help="Ask for server settings before synchronization.")
     parser.add_argument('--master-password', help="Prefill the masterpassword field.")
     parser.add_argument('-d', '--domain', help="Prefill the domain field.")
+    parser.add_argument('--speculative-unlock', action='store_const', const=True,
+                        help="Start decrypting while the masterpassword is typed.")
+    parser.add_argument('--record-encryption', action='store_const', const=True,
+                        help="Encrypt every setting separately so large settings files load faster. " +
+                             "Older versions can not read the settings file afterwards.")
+    parser.add_argument('--settings-log', action='store_const', const=True,
+                        help="Append changed settings to a log instead of writing the whole settings file. " +
+                             "Implies --record-encryption.")
+    parser.add_argument('--database', action='store_const', const=True,
+                        help="Use the SQLite database instead of the settings file. " +
+                             "Migrate the settings file with settings_migration.py first.")
+    parser.add_argument('--crypto-backend', choices=[backend.name for backend in crypto_backend.BACKENDS],
+                        help="Use this backend for PBKDF2 and AES instead of the fastest one.")
     args = parser.parse_args()
+    crypto_backend.set_backend(args.crypto_backend)
     app = QApplication([])
     QCoreApplication.setOrganizationName("c't")
     QCoreApplication.setOrganizationDomain("ct.de")
     QCoreApplication.setApplicationName("ctSESAM-pyside")
-    window = MainWindow()
+    window = MainWindow(SQLitePreferenceManager() if args.database else None)
+    if args.speculative_unlock:
+        window.set_speculative_unlock(True)
+    if args.record_encryption:
+        window.enable_record_encryption()
+    if args.settings_log:
+        window.enable_settings_log()
     if type(args.master_password) is str and args.master_password:
         window.set_masterpassword(args.master_password)
         window.masterpassword_changed()
@@ -1,37 +1,62 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
-from multiprocessing import Process, Queue
+from PySide.QtCore import QObject, Qt, Signal
 from crypter import Crypter
 
 
-class DecryptKgkTask(object):
-    def __init__(self, password, preference_manager, kgk_manager, settings_manager, domain_edit):
+class DecryptKgkTask(QObject):
+    """
+    Decrypts the kgk without blocking the GUI. The key derivation runs in the KdfService. When the key arrives
+    the kgk is decrypted and the local settings are loaded in the GUI thread. Then finished is emitted. If the key
+    check value shows that the password is wrong or the settings can not be decrypted wrong_password is emitted
+    instead.
+    """
+    key_derived = Signal()
+    finished = Signal()
+    wrong_password = Signal()
+
+    def __init__(self, password, preference_manager, kgk_manager, settings_manager, domain_edit, kdf_service):
+        super(DecryptKgkTask, self).__init__()
         salt = preference_manager.get_salt()
         self.kgk_manager = kgk_manager
         self.preference_manager = preference_manager
         self.settings_manager = settings_manager
         self.domain_edit = domain_edit
-        self.queue = Queue()
-        self.process = Process(
-            target=DecryptKgkTask.create_key_iv,
-            args=(self.queue, password.encode('utf-8'), salt,))
-        self.process.start()
-        self.post_execute()
-
-    @staticmethod
-    def create_key_iv(queue, password, salt):
-        queue.put(Crypter.createIvKey(password, salt))
+        self.cancelled = False
+        self.done = False
+        self.failed = False
+        self.key_derived.connect(self.post_execute, Qt.QueuedConnection)
+        self.future = kdf_service.create_iv_key(password.encode('utf-8'), salt)
+        self.future.add_done_callback(lambda future: self.key_derived.emit())
 
     def post_execute(self):
-        key_iv = self.queue.get()
-        self.process.join()
-        self.kgk_manager.decrypt_kgk(self.preference_manager.get_kgk_block(), Crypter(key_iv))
-        self.settings_manager.load_local_settings(self.kgk_manager)
+        if self.cancelled:
+            return
+        try:
+            key_iv = self.future.result()
+            self.kgk_manager.decrypt_kgk(self.preference_manager.get_kgk_block(), Crypter(key_iv),
+                                         key_check_value=self.preference_manager.get_key_check_value())
+            self.settings_manager.load_local_settings(self.kgk_manager)
+        except Exception:
+            self.kgk_manager.reset()
+            self.failed = True
+            self.done = True
+            self.wrong_password.emit()
+            return
         for i in reversed(range(self.domain_edit.count())):
             self.domain_edit.removeItem(i)
         self.domain_edit.insertItems(0, self.settings_manager.get_domain_list())
+        self.done = True
+        self.finished.emit()
         self.domain_edit.textChanged.emit(self.domain_edit.lineEdit().text())
 
+    def cancel(self):
+        """
+        Drops the result. The derivation itself is not cancelled because the KdfService may share it with other
+        callers.
+        """
+        self.cancelled = True
+
     def is_running(self):
-        return self.process.is_alive()
+        return not self.done and not self.cancelled
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Remembers how often and how recently domains were used.
+"""
+
+import time
+
+
+class FrecencyTracker(object):
+    """
+    Tracks the use of domains. The score of a domain is its use count weighted by the age of its last use: it
+    halves every half_life seconds. This ranks recently and frequently used domains first. The dirty flag is set
+    when the entries change.
+
+    :param half_life: seconds until the weight of a use halves (default two weeks)
+    :type half_life: float
+    """
+    def __init__(self, half_life=14*24*60*60):
+        self.half_life = half_life
+        self.entries = {}
+        self.dirty = False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def record(self, domain, timestamp=None):
+        """
+        Records a use of the domain.
+
+        :param domain: the domain
+        :type domain: str
+        :param timestamp: unix time of the use (defaults to now)
+        :type timestamp: int
+        """
+        if timestamp is None:
+            timestamp = int(time.time())
+        self.dirty = True
+        if domain in self.entries:
+            self.entries[domain]['count'] += 1
+            self.entries[domain]['lastUsed'] = max(self.entries[domain]['lastUsed'], timestamp)
+        else:
+            self.entries[domain] = {'count': 1, 'lastUsed': timestamp}
+
+    def remove(self, domain):
+        """
+        Forgets the domain.
+
+        :param domain: the domain
+        :type domain: str
+        """
+        if self.entries.pop(domain, None) is not None:
+            self.dirty = True
+
+    def get_score(self, domain, now=None):
+        """
+        Returns the score of the domain. Unknown domains have a score of 0.
+
+        :param domain: the domain
+        :type domain: str
+        :param now: unix time used as the present (defaults to now)
+        :type now: int
+        :return: the score
+        :rtype: float
+        """
+        if domain not in self.entries:
+            return 0.0
+        if now is None:
+            now = int(time.time())
+        age = max(0, now - self.entries[domain]['lastUsed'])
+        return self.entries[domain]['count'] * 0.5 ** (age / self.half_life)
+
+    def get_top_domains(self, n, now=None):
+        """
+        Returns the n domains with the highest score.
+
+        :param n: number of domains
+        :type n: int
+        :param now: unix time used as the present (defaults to now)
+        :type now: int
+        :return: domains with the highest score first
+        :rtype: [str]
+        """
+        if now is None:
+            now = int(time.time())
+        return sorted(self.entries.keys(), key=lambda domain: (-self.get_score(domain, now), domain))[:n]
+
+    def to_dict(self):
+        """
+        Returns a dictionary which can be saved with the settings.
+
+        :return: use count and last use by domain
+        :rtype: dict
+        """
+        return {domain: dict(entry) for domain, entry in self.entries.items()}
+
+    def load_from_dict(self, loaded_entries):
+        """
+        Loads saved entries. Entries which are already known are merged.
+
+        :param loaded_entries: use count and last use by domain
+        :type loaded_entries: dict
+        """
+        for domain, entry in loaded_entries.items():
+            if 'count' not in entry or 'lastUsed' not in entry:
+                continue
+            self.dirty = True
+            if domain in self.entries:
+                self.entries[domain]['count'] = max(self.entries[domain]['count'], entry['count'])
+                self.entries[domain]['lastUsed'] = max(self.entries[domain]['lastUsed'], entry['lastUsed'])
+            else:
+                self.entries[domain] = {'count': entry['count'], 'lastUsed': entry['lastUsed']}
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from PySide.QtCore import QObject, QRunnable, Signal
+from concurrent.futures import CancelledError
+from threading import Event
+from password_generator import derive_hash, derive_hashes, render_password, generate_passwords
+from iteration_calibrator import measure_iterations_per_second
+import copy
+
+
+class GeneratePasswordSignals(QObject):
+    finished = Signal(int, str)
+
+
+class GeneratePasswordTask(QRunnable):
+    """
+    Generates a password in a QThreadPool. The inputs are copied when the task is created so later changes of the
+    setting do not affect a running task. The request_id is emitted with the password so the receiver can drop
+    results which were superseded by a newer request.
+    """
+    def __init__(self, request_id, setting, kgk):
+        super(GeneratePasswordTask, self).__init__()
+        self.signals = GeneratePasswordSignals()
+        self.request_id = request_id
+        self.domain = setting.get_domain()
+        self.username = setting.get_username()
+        self.kgk = kgk
+        self.salt = setting.get_salt()
+        self.iterations = setting.get_iterations()
+        self.template = setting.get_template()
+        self.extra_set = setting.get_extra_character_set()
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        Marks the task as superseded. If it did not start yet it skips the hashing.
+        """
+        self.cancelled = True
+
+    def run(self):
+        if self.cancelled:
+            self.signals.finished.emit(self.request_id, "")
+            return
+        hash_value = derive_hash(self.domain, self.username, self.kgk, self.salt, self.iterations)
+        self.signals.finished.emit(self.request_id, render_password(hash_value, self.template, self.extra_set))
+
+
+class PrecomputeHashesTask(QRunnable):
+    """
+    Derives the hashes for some settings in a QThreadPool so they are in the hash cache when the password is
+    needed. The settings are copied when the task is created.
+    """
+    def __init__(self, settings, kgk):
+        super(PrecomputeHashesTask, self).__init__()
+        self.settings = [copy.copy(setting) for setting in settings]
+        self.kgk = kgk
+
+    def run(self):
+        derive_hashes(self.settings, self.kgk)
+
+
+class GeneratePasswordsSignals(QObject):
+    progress = Signal(int, int)
+    finished = Signal()
+    cancelled = Signal()
+
+
+class GeneratePasswordsTask(QRunnable):
+    """
+    Generates the passwords for many settings in a QThreadPool. progress is emitted with the number of finished
+    and the total number of passwords. When all passwords are generated they are stored in passwords and finished
+    is emitted. After cancel the task stops soon and emits cancelled instead. The settings are copied when the task
+    is created.
+    """
+    def __init__(self, settings, kgk):
+        super(GeneratePasswordsTask, self).__init__()
+        self.signals = GeneratePasswordsSignals()
+        self.settings = [copy.copy(setting) for setting in settings]
+        self.kgk = kgk
+        self.cancel_event = Event()
+        self.passwords = None
+
+    def cancel(self):
+        """
+        Stops the generation.
+        """
+        self.cancel_event.set()
+
+    def run(self):
+        try:
+            self.passwords = generate_passwords(self.settings, self.kgk, progress_callback=self.signals.progress.emit,
+                                                cancel_event=self.cancel_event)
+        except CancelledError:
+            self.signals.cancelled.emit()
+            return
+        self.signals.finished.emit()
+
+
+class CalibrateIterationsSignals(QObject):
+    finished = Signal()
+
+
+class CalibrateIterationsTask(QRunnable):
+    """
+    Measures the PBKDF2 speed of this machine in a QThreadPool so the GUI does not wait for the calibration.
+    finished is emitted when the result is available in the iteration_calibrator.
+    """
+    def __init__(self):
+        super(CalibrateIterationsTask, self).__init__()
+        self.signals = CalibrateIterationsSignals()
+
+    def run(self):
+        measure_iterations_per_second()
+        self.signals.finished.emit()
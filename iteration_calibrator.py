@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Measures the PBKDF2 speed of this machine and recommends iteration counts for a target latency. Run it with
+``python3 iteration_calibrator.py`` to see the recommendations.
+"""
+
+import argparse
+import time
+from crypto_backend import pbkdf2
+
+DEFAULT_TARGET_LATENCY = 0.2
+
+measured_speeds = {}
+
+
+def measure_iterations_per_second(hash_name='sha512', min_duration=0.05):
+    """
+    Measures how many PBKDF2 iterations this machine calculates per second. The iteration count is doubled until
+    a run takes at least min_duration. The result is remembered for every hash.
+
+    :param hash_name: sha256, sha384 or sha512
+    :type hash_name: str
+    :param min_duration: minimum duration of the measurement in seconds
+    :type min_duration: float
+    :return: iterations per second
+    :rtype: float
+    """
+    if hash_name in measured_speeds:
+        return measured_speeds[hash_name]
+    iterations = 256
+    while True:
+        start = time.perf_counter()
+        pbkdf2(hash_name, b'calibration', b'\x00'*32, iterations)
+        duration = time.perf_counter() - start
+        if duration >= min_duration:
+            break
+        iterations *= 2
+    measured_speeds[hash_name] = iterations / duration
+    return measured_speeds[hash_name]
+
+
+def is_calibrated(hash_name='sha512'):
+    """
+    Checks if the speed of this machine was already measured for the hash. If it was the other functions of this
+    module return without measuring.
+
+    :param hash_name: sha256, sha384 or sha512
+    :type hash_name: str
+    :return: measured?
+    :rtype: bool
+    """
+    return hash_name in measured_speeds
+
+
+def estimate_latency(iterations, hash_name='sha512'):
+    """
+    Estimates how long a PBKDF2 with the given iteration count takes on this machine.
+
+    :param iterations: iteration count
+    :type iterations: int
+    :param hash_name: sha256, sha384 or sha512
+    :type hash_name: str
+    :return: latency in seconds
+    :rtype: float
+    """
+    return iterations / measure_iterations_per_second(hash_name)
+
+
+def recommend_iterations(target_latency=DEFAULT_TARGET_LATENCY, hash_name='sha512'):
+    """
+    Recommends the highest iteration count which is calculated within the target latency. The result is rounded
+    down to a multiple of 1024 but it is never below 1024.
+
+    :param target_latency: latency in seconds
+    :type target_latency: float
+    :param hash_name: sha256, sha384 or sha512
+    :type hash_name: str
+    :return: iteration count
+    :rtype: int
+    """
+    iterations = int(measure_iterations_per_second(hash_name) * target_latency)
+    return max(1024, iterations - iterations % 1024)
+
+
+def exceeds_latency_budget(iterations, latency_budget=DEFAULT_TARGET_LATENCY, hash_name='sha512'):
+    """
+    Checks if a PBKDF2 with this iteration count takes longer than the budget on this machine.
+
+    :param iterations: iteration count
+    :type iterations: int
+    :param latency_budget: latency in seconds
+    :type latency_budget: float
+    :param hash_name: sha256, sha384 or sha512
+    :type hash_name: str
+    :return: too slow?
+    :rtype: bool
+    """
+    return estimate_latency(iterations, hash_name) > latency_budget
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recommend PBKDF2 iteration counts for this machine.")
+    parser.add_argument('-t', '--target-latency', type=float, default=DEFAULT_TARGET_LATENCY,
+                        help="Target latency in seconds (default 0.2).")
+    args = parser.parse_args()
+    for name, hash_name, current in [("Passwords (SHA-512)", 'sha512', 4096),
+                                     ("Masterpassword (SHA-384)", 'sha384', 32768)]:
+        print(name + ": " + str(int(measure_iterations_per_second(hash_name))) + " iterations/s, " +
+              "recommended: " + str(recommend_iterations(args.target_latency, hash_name)) + ", " +
+              "current default " + str(current) + " takes " +
+              str(int(round(estimate_latency(current, hash_name)*1000))) + " ms")
@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+A long-lived service for expensive key derivations.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, Future
+from threading import Lock
+from hashlib import sha256
+import struct
+import time
+import os
+from crypter import Crypter
+
+
+class DerivedKeyCache(object):
+    """
+    Keeps derived keys for a limited time. Expired and cleared keys are overwritten with zeros.
+
+    :param ttl: seconds a key stays in the cache
+    :type ttl: float
+    """
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        Returns the derived key or None if it is not cached or expired.
+
+        :param key: the derivation key from KdfService.create_key
+        :type key: bytes
+        :return: derived key
+        :rtype: bytes
+        """
+        with self.lock:
+            self.remove_expired()
+            if key in self.entries:
+                return bytes(self.entries[key][1])
+            return None
+
+    def put(self, key, derived_key):
+        """
+        Stores a derived key.
+
+        :param key: the derivation key from KdfService.create_key
+        :type key: bytes
+        :param derived_key: the derived key
+        :type derived_key: bytes
+        """
+        with self.lock:
+            if key in self.entries:
+                self.wipe(self.entries[key][1])
+            self.entries[key] = (time.monotonic() + self.ttl, bytearray(derived_key))
+
+    def remove_expired(self):
+        """
+        Wipes and removes expired keys. The caller has to hold the lock.
+        """
+        now = time.monotonic()
+        for key in [key for key, entry in self.entries.items() if entry[0] <= now]:
+            self.wipe(self.entries.pop(key)[1])
+
+    def clear(self):
+        """
+        Wipes and removes all keys.
+        """
+        with self.lock:
+            while len(self.entries) > 0:
+                self.wipe(self.entries.popitem()[1][1])
+
+    @staticmethod
+    def wipe(value):
+        """
+        Overwrites a cached key with zeros.
+
+        :param value: cached key
+        :type value: bytearray
+        """
+        for i in range(len(value)):
+            value[i] = 0
+
+
+class KdfService(object):
+    """
+    Calculates key derivations in a pool of worker threads which is created once and reused for every derivation.
+    PBKDF2 does not hold the GIL so the threads run in parallel without the cost of starting processes and
+    pickling arguments. If the same derivation is requested while it is still running the running future is
+    returned so nothing is derived twice. Finished derivations are kept in a DerivedKeyCache for cache_ttl
+    seconds. Call clear_cache when the masterpassword changes.
+
+    :param max_workers: number of worker threads (defaults to the number of cores)
+    :type max_workers: int
+    :param cache_ttl: seconds a derived key stays in the cache
+    :type cache_ttl: float
+    """
+    def __init__(self, max_workers=None, cache_ttl=300):
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = Lock()
+        self.running = {}
+        self.cache = DerivedKeyCache(cache_ttl)
+        self.cache_generation = 0
+
+    @staticmethod
+    def create_key(function_name, password, salt, iterations):
+        """
+        Creates a digest of the derivation input which identifies a derivation.
+
+        :param function_name: name of the derivation function
+        :type function_name: str
+        :param password: the password
+        :type password: bytes
+        :param salt: the salt
+        :type salt: bytes
+        :param iterations: iteration count
+        :type iterations: int
+        :return: key
+        :rtype: bytes
+        """
+        return sha256(function_name.encode('utf-8') +
+                      struct.pack('!II', len(password), iterations) + password + salt).digest()
+
+    def submit(self, function, function_name, password, salt, iterations):
+        """
+        Starts a derivation in the worker pool. If an identical derivation is running its future is returned. If
+        the result is in the cache a finished future is returned.
+
+        :param function: derivation function which takes password, salt and iterations
+        :type function: function
+        :param function_name: name of the derivation function
+        :type function_name: str
+        :param password: the password
+        :type password: bytes
+        :param salt: the salt
+        :type salt: bytes
+        :param iterations: iteration count
+        :type iterations: int
+        :return: future of the derived key
+        :rtype: concurrent.futures.Future
+        """
+        key = self.create_key(function_name, password, salt, iterations)
+        cached_key = self.cache.get(key)
+        if cached_key is not None:
+            future = Future()
+            future.set_result(cached_key)
+            return future
+        with self.lock:
+            if key in self.running and not self.running[key].done():
+                return self.running[key]
+            future = self.executor.submit(self.derive, function, key, self.cache_generation, password, salt,
+                                          iterations)
+            self.running[key] = future
+        future.add_done_callback(lambda done_future: self.finished(key, done_future))
+        return future
+
+    def derive(self, function, key, cache_generation, password, salt, iterations):
+        """
+        Runs a derivation in a worker thread and caches the result unless the cache was cleared in the meantime.
+
+        :param function: derivation function which takes password, salt and iterations
+        :type function: function
+        :param key: key of the derivation
+        :type key: bytes
+        :param cache_generation: value of cache_generation when the derivation was submitted
+        :type cache_generation: int
+        :param password: the password
+        :type password: bytes
+        :param salt: the salt
+        :type salt: bytes
+        :param iterations: iteration count
+        :type iterations: int
+        :return: the derived key
+        :rtype: bytes
+        """
+        derived_key = function(password, salt, iterations)
+        with self.lock:
+            if cache_generation == self.cache_generation:
+                self.cache.put(key, derived_key)
+        return derived_key
+
+    def finished(self, key, future):
+        """
+        Removes a finished derivation from the running derivations.
+
+        :param key: key of the derivation
+        :type key: bytes
+        :param future: the finished future
+        :type future: concurrent.futures.Future
+        """
+        with self.lock:
+            if self.running.get(key) is future:
+                del self.running[key]
+
+    def cancel(self, future):
+        """
+        Cancels a derivation if it did not start yet. Running derivations can not be stopped. Only cancel futures
+        which are not shared with other callers.
+
+        :param future: future from submit
+        :type future: concurrent.futures.Future
+        :return: was it cancelled?
+        :rtype: bool
+        """
+        return future.cancel()
+
+    def clear_cache(self):
+        """
+        Wipes all cached keys. Derivations which are still running do not put their result into the cache.
+        """
+        with self.lock:
+            self.cache_generation += 1
+            self.cache.clear()
+
+    def create_iv_key(self, password, salt, iterations=32768):
+        """
+        Derives key and iv for kgk blocks like Crypter.createIvKey.
+
+        :param password: the masterpassword
+        :type password: bytes
+        :param salt: the salt
+        :type salt: bytes
+        :param iterations: an iteration count
+        :type iterations: int
+        :return: future of the key and iv
+        :rtype: concurrent.futures.Future
+        """
+        return self.submit(Crypter.createIvKey, 'createIvKey', password, salt, iterations)
+
+    def shutdown(self, wait=True):
+        """
+        Stops the worker threads.
+
+        :param wait: wait for running derivations
+        :type wait: bool
+        """
+        self.executor.shutdown(wait=wait)
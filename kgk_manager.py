@@ -6,6 +6,7 @@ The KGK manager stores the kgk and manages storage and encryption of kgk blocks.
 
 from preference_manager import PreferenceManager
 from crypter import Crypter
+from password_generator import hash_cache
 from binascii import hexlify
 import os
 
@@ -13,14 +14,26 @@ import os
 class KgkManager(object):
     """
     New KgkManagers are uninitialized and need either a new kgk or get one by decrypting an existing one.
+
+    The settings key is derived from kgk and salt2 and it is cached until one of them changes. Local saves do not
+    create a new salt2 every time: salt2 is replaced on the first save of a session and after
+    salt2_rotation_interval saves. The iv2 is fresh for every save.
+
+    :param salt2_rotation_interval: number of local saves which use the same salt2
+    :type salt2_rotation_interval: int
     """
-    def __init__(self):
+    def __init__(self, salt2_rotation_interval=100):
         self.preference_manager = None
         self.kgk = b''
         self.iv2 = None
         self.salt2 = None
         self.kgk_crypter = None
         self.salt = b''
+        self.kdf_service = None
+        self.salt2_rotation_interval = salt2_rotation_interval
+        self.salt2_uses = None
+        self.settings_key = None
+        self.settings_key_source = None
 
     def __str__(self):
         attr = ["KGK: " + str(hexlify(self.kgk), encoding='utf-8'),
@@ -38,10 +51,20 @@ class KgkManager(object):
         :param preference_manager:
         :type preference_manager: PreferenceManager
         """
-        if type(preference_manager) != PreferenceManager:
+        if not isinstance(preference_manager, PreferenceManager):
             raise TypeError
         self.preference_manager = preference_manager
 
+    def set_kdf_service(self, kdf_service):
+        """
+        Pass a KdfService to run the key derivations in its worker pool. Identical derivations which are running
+        at the same time are then only calculated once.
+
+        :param kdf_service: a kdf service
+        :type kdf_service: KdfService
+        """
+        self.kdf_service = kdf_service
+
     def get_kgk_crypter_salt(self):
         """
         Loads the public salt. If there is none it is created and stored.
@@ -79,7 +102,10 @@ class KgkManager(object):
         :return: a kgk crypter
         :rtype: Crypter
         """
-        self.kgk_crypter = Crypter(Crypter.createIvKey(password=password, salt=salt))
+        if self.kdf_service:
+            self.kgk_crypter = Crypter(self.kdf_service.create_iv_key(password, salt).result())
+        else:
+            self.kgk_crypter = Crypter(Crypter.createIvKey(password=password, salt=salt))
         self.store_salt(salt=salt)
         return self.kgk_crypter
 
@@ -90,16 +116,19 @@ class KgkManager(object):
         :return: the new kgk
         :rtype: bytes
         """
+        if self.kgk:
+            hash_cache.clear()
         self.kgk = os.urandom(64)
         self.iv2 = Crypter.createIv()
         self.salt2 = Crypter.createSalt()
         return self.kgk
 
-    def decrypt_kgk(self, encrypted_kgk, kgk_crypter=None, password=b'', salt=b''):
+    def decrypt_kgk(self, encrypted_kgk, kgk_crypter=None, password=b'', salt=b'', key_check_value=b''):
         """
         Decrypts kgk blobs. If a crypter is passed it is used. If none is passed a new crypter is created with
         the salt and password. This takes relatively long. If the encrypted_kgk has a wrong length a new kgk is
-        created.
+        created. If a key check value is passed a wrong password raises a PermissionError before anything is
+        decrypted.
 
         :param encrypted_kgk:
         :type encrypted_kgk: bytes
@@ -109,6 +138,8 @@ class KgkManager(object):
         :type password: bytes
         :param salt:
         :type salt: bytes
+        :param key_check_value: the check value stored with the kgk block (b'' for files without one)
+        :type key_check_value: bytes
         """
         if kgk_crypter:
             self.kgk_crypter = kgk_crypter
@@ -116,10 +147,16 @@ class KgkManager(object):
             if len(salt) < 32:
                 salt = Crypter.createSalt()
             self.get_kgk_crypter(password, salt)
+        if len(key_check_value) > 0 and not self.kgk_crypter.check_key(key_check_value):
+            self.kgk_crypter = None
+            raise PermissionError("Wrong password: The key check value does not match.")
         if len(encrypted_kgk) == 112:
             kgk_block = self.kgk_crypter.decrypt_unpadded(encrypted_kgk)
             self.salt2 = kgk_block[:32]
+            self.salt2_uses = None
             self.iv2 = kgk_block[32:48]
+            if self.kgk and self.kgk != kgk_block[48:112]:
+                hash_cache.clear()
             self.kgk = kgk_block[48:112]
         else:
             self.create_new_kgk()
@@ -165,6 +202,30 @@ class KgkManager(object):
         Creates a fresh salt for the settings encryption (salt2).
         """
         self.salt2 = Crypter.createSalt()
+        self.salt2_uses = 0
+
+    def prepare_local_encryption(self):
+        """
+        Prepares salt2 and iv2 for a local save. The salt2 is only replaced on the first save of a session and after
+        salt2_rotation_interval saves so the cached settings key can be reused. The iv2 is always fresh.
+        """
+        if self.salt2_uses is None or self.salt2_uses >= self.salt2_rotation_interval:
+            self.fresh_salt2()
+        self.salt2_uses += 1
+        self.fresh_iv2()
+
+    def get_settings_key(self):
+        """
+        Returns the key for the settings encryption. It is derived from kgk and salt2 only if one of them changed
+        since the last call.
+
+        :return: the settings key
+        :rtype: bytes
+        """
+        if self.settings_key is None or self.settings_key_source != (self.kgk, self.salt2):
+            self.settings_key = Crypter.create_key(self.kgk, self.salt2)
+            self.settings_key_source = (self.kgk, self.salt2)
+        return self.settings_key
 
     def fresh_iv2(self):
         """
@@ -202,11 +263,10 @@ class KgkManager(object):
         :rtype: bytes
         """
         self.salt = Crypter.createSalt()
-        self.store_salt(self.salt)
         if kgk_crypter:
             self.kgk_crypter = kgk_crypter
         kgk_block = self.get_fresh_encrypted_kgk()
-        self.preference_manager.store_kgk_block(kgk_block)
+        self.preference_manager.store_kgk(self.salt, kgk_block, self.kgk_crypter.get_key_check_value())
         return kgk_block
 
     def update_from_blob(self, password, blob):
@@ -226,21 +286,24 @@ class KgkManager(object):
 
     def store_local_kgk_block(self):
         """
-        Stores the local kgk block.
+        Stores the salt, the local kgk block and its key check value together.
         """
-        if self.preference_manager:
-            self.preference_manager.store_kgk_block(self.get_encrypted_kgk())
-        if len(self.salt) == 32:
-            self.store_salt(self.salt)
-        else:
+        if len(self.salt) != 32:
             raise ValueError("The salt has to be 32 bytes.")
+        if self.preference_manager:
+            self.preference_manager.store_kgk(self.salt, self.get_encrypted_kgk(),
+                                              self.kgk_crypter.get_key_check_value())
 
     def reset(self):
         """
-        Resets the kgk manager.
+        Resets the kgk manager. This also wipes the cached password hashes and the cached settings key.
         """
+        hash_cache.clear()
         self.salt = b''
         self.iv2 = None
         self.salt2 = None
+        self.salt2_uses = None
+        self.settings_key = None
+        self.settings_key_source = None
         self.kgk = b''
         self.kgk_crypter = None
@@ -5,13 +5,109 @@ Password manager. It's name is CtSesam because it produces passwords which are c
 c't SESAM implementations.
 """
 
-from hashlib import pbkdf2_hmac
+from hashlib import sha256
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, CancelledError, wait, FIRST_COMPLETED
+from threading import Lock
+import struct
+import os
+from crypto_backend import pbkdf2
+from password_setting import DEFAULT_CHARACTER_SET_LOWER_CASE, DEFAULT_CHARACTER_SET_UPPER_CASE
+from password_setting import DEFAULT_CHARACTER_SET_DIGITS, DEFAULT_CHARACTER_SET_EXTRA
 
 
-class CtSesam(object):
+class HashCache(object):
     """
-    Calculates passwords from masterpasswords and domain names. You may set the salt and iteration count to
-    something of your liking. If not set default values will be used.
+    A bounded LRU cache for derived hash values. The keys are digests of the complete derivation input so the cache
+    does not keep copies of the kgk. Evicted or cleared hash values are overwritten with zeros.
+
+    :param max_size: maximum number of cached hash values
+    :type max_size: int
+    """
+    def __init__(self, max_size=64):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def create_key(start_value, salt, iterations):
+        """
+        Creates a cache key from the full derivation input.
+
+        :param start_value: domain, username and kgk concatenated
+        :type start_value: bytes
+        :param salt: the salt
+        :type salt: bytes
+        :param iterations: iteration count
+        :type iterations: int
+        :return: cache key
+        :rtype: bytes
+        """
+        return sha256(struct.pack('!II', len(start_value), iterations) + start_value + salt).digest()
+
+    def get(self, key):
+        """
+        Returns the cached hash value for the key or None if there is none.
+
+        :param key: the cache key
+        :type key: bytes
+        :return: hash value
+        :rtype: bytes
+        """
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return bytes(self.entries[key])
+
+    def put(self, key, hash_value):
+        """
+        Stores a hash value. If the cache is full the least recently used entry is wiped and removed.
+
+        :param key: the cache key
+        :type key: bytes
+        :param hash_value: the derived hash
+        :type hash_value: bytes
+        """
+        with self.lock:
+            if key in self.entries:
+                self.wipe(self.entries.pop(key))
+            self.entries[key] = bytearray(hash_value)
+            while len(self.entries) > self.max_size:
+                self.wipe(self.entries.popitem(last=False)[1])
+
+    def clear(self):
+        """
+        Wipes and removes all cached hash values. Call this if the kgk changes.
+        """
+        with self.lock:
+            while len(self.entries) > 0:
+                self.wipe(self.entries.popitem()[1])
+
+    @staticmethod
+    def wipe(value):
+        """
+        Overwrites a cached value with zeros.
+
+        :param value: cached hash value
+        :type value: bytearray
+        """
+        for i in range(len(value)):
+            value[i] = 0
+
+
+hash_cache = HashCache()
+
+COMPLEXITY_GROUPS = ['n', 'a', 'A', 'na', 'aA', 'naA', 'naAo']
+
+
+def derive_hash(domain, username, kgk, salt="pepper".encode('utf-8'), iterations=4096, use_cache=True):
+    """
+    Derives the hash which is the basis for all passwords of a domain. This is the expensive part of the password
+    generation. The result is looked up in and stored in the hash_cache unless use_cache is False.
 
     :param domain: the domain str
     :type domain: str
@@ -23,45 +119,123 @@ class CtSesam(object):
     :type salt: bytes
     :param iterations: iteration count (should be 1 or higher, default is 4096)
     :type iterations: int
+    :param use_cache: look up and store the hash in the hash cache
+    :type use_cache: bool
+    :return: the derived hash
+    :rtype: bytes
     """
-    def __init__(self, domain, username, kgk, salt="pepper".encode('utf-8'), iterations=4096):
-        start_value = b''
-        for c in domain.encode('utf-8'):
-            start_value += bytes([c])
-        for c in username.encode('utf-8'):
-            start_value += bytes([c])
-        for c in kgk:
-            start_value += bytes([c])
-        if iterations <= 0:
-            print("Iteration count was below 1. Hashing 4096 times instead.")
-            iterations = 4096
-        self.hash_value = pbkdf2_hmac('sha512', start_value, salt, iterations)
+    start_value = domain.encode('utf-8') + username.encode('utf-8') + bytes(kgk)
+    if iterations <= 0:
+        print("Iteration count was below 1. Hashing 4096 times instead.")
+        iterations = 4096
+    cache_key = HashCache.create_key(start_value, salt, iterations)
+    hash_value = hash_cache.get(cache_key) if use_cache else None
+    if hash_value is None:
+        hash_value = pbkdf2('sha512', start_value, salt, iterations)
+        if use_cache:
+            hash_cache.put(cache_key, hash_value)
+    return hash_value
 
-    def generate(self, setting):
-        """
-        Generates a password string.
 
-        :param setting: a setting object
-        :type setting: PasswordSetting
-        :return: password
-        :rtype: str
-        """
-        number = int.from_bytes(self.hash_value, byteorder='big')
+def derive_hashes(settings, kgk, max_workers=None, progress_callback=None, cancel_event=None, use_cache=True):
+    """
+    Derives the hashes for many settings in parallel. hashlib releases the GIL while it calculates PBKDF2 so a
+    thread pool uses all cores without copying the kgk to other processes.
+
+    :param settings: setting objects
+    :type settings: [PasswordSetting]
+    :param kgk: the kgk
+    :type kgk: bytes
+    :param max_workers: number of threads (defaults to the number of cores)
+    :type max_workers: int
+    :param progress_callback: is called with the number of finished and the total number of hashes
+    :type progress_callback: function
+    :param cancel_event: set this event to stop the calculation
+    :type cancel_event: threading.Event
+    :param use_cache: look up and store the hashes in the hash cache
+    :type use_cache: bool
+    :return: hashes in the order of the settings
+    :rtype: [bytes]
+    :raises CancelledError: if the cancel_event was set before all hashes were calculated
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    hashes = [None]*len(settings)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for i, setting in enumerate(settings):
+            futures[executor.submit(derive_hash, setting.get_domain(), setting.get_username(), kgk,
+                                    setting.get_salt(), setting.get_iterations(), use_cache)] = i
+        pending = set(futures.keys())
+        while len(pending) > 0:
+            done, pending = wait(pending, timeout=0.05, return_when=FIRST_COMPLETED)
+            for future in done:
+                hashes[futures[future]] = future.result()
+            if cancel_event is not None and cancel_event.is_set():
+                for future in pending:
+                    future.cancel()
+                raise CancelledError()
+            if progress_callback and len(done) > 0:
+                progress_callback(len(settings) - len(pending), len(settings))
+    return hashes
+
+
+def generate_passwords(settings, kgk, max_workers=None, progress_callback=None, cancel_event=None):
+    """
+    Generates the passwords for many settings. The hashes are derived in parallel with derive_hashes.
+
+    :param settings: setting objects
+    :type settings: [PasswordSetting]
+    :param kgk: the kgk
+    :type kgk: bytes
+    :param max_workers: number of threads (defaults to the number of cores)
+    :type max_workers: int
+    :param progress_callback: is called with the number of finished and the total number of passwords
+    :type progress_callback: function
+    :param cancel_event: set this event to stop the calculation
+    :type cancel_event: threading.Event
+    :return: passwords in the order of the settings
+    :rtype: [str]
+    :raises CancelledError: if the cancel_event was set before all passwords were generated
+    """
+    hashes = derive_hashes(settings, kgk, max_workers, progress_callback, cancel_event)
+    return [render_password(hash_value, setting.get_template(), setting.get_extra_character_set())
+            for hash_value, setting in zip(hashes, settings)]
+
+
+def render_passwords(hash_value, templates):
+    """
+    Renders passwords for many templates from one derived hash. No hashing is done here so this is cheap.
+
+    :param hash_value: a hash from derive_hash
+    :type hash_value: bytes
+    :param templates: list of (template, extra character set) tuples
+    :type templates: [(str, str)]
+    :return: passwords in the order of the templates
+    :rtype: [str]
+    """
+    start_number = int.from_bytes(hash_value, byteorder='big')
+    passwords = []
+    for template, extra_set in templates:
+        number = start_number
+        character_set = ""
+        if 'n' in template:
+            character_set += DEFAULT_CHARACTER_SET_DIGITS
+        if 'a' in template:
+            character_set += DEFAULT_CHARACTER_SET_LOWER_CASE
+        if 'A' in template:
+            character_set += DEFAULT_CHARACTER_SET_UPPER_CASE
+        if 'o' in template:
+            character_set += extra_set
         password = ""
-        character_set = setting.get_character_set()
-        digits_set = setting.get_digits_character_set()
-        lower_set = setting.get_lower_case_character_set()
-        upper_set = setting.get_upper_case_character_set()
-        extra_set = setting.get_extra_character_set()
-        template = setting.get_template()
         for t in template:
             if number > 0:
                 if t == 'a':
-                    current_set = lower_set
+                    current_set = DEFAULT_CHARACTER_SET_LOWER_CASE
                 elif t == 'A':
-                    current_set = upper_set
+                    current_set = DEFAULT_CHARACTER_SET_UPPER_CASE
                 elif t == 'n':
-                    current_set = digits_set
+                    current_set = DEFAULT_CHARACTER_SET_DIGITS
                 elif t == 'o':
                     current_set = extra_set
                 else:
@@ -69,4 +243,105 @@ class CtSesam(object):
                 if len(current_set) > 0:
                     password = password + current_set[number % len(current_set)]
                     number //= len(current_set)
-        return password
+        passwords.append(password)
+    return passwords
+
+
+def render_password(hash_value, template, extra_set=DEFAULT_CHARACTER_SET_EXTRA):
+    """
+    Renders a single password from a derived hash.
+
+    :param hash_value: a hash from derive_hash
+    :type hash_value: bytes
+    :param template: template without digit and semicolon
+    :type template: str
+    :param extra_set: set of special characters
+    :type extra_set: str
+    :return: password
+    :rtype: str
+    """
+    return render_passwords(hash_value, [(template, extra_set)])[0]
+
+
+def get_strength_template(complexity, length):
+    """
+    Returns a template for a cell of the PasswordStrengthSelector. Every character group of the complexity is used
+    once at the beginning. The rest of the template is filled with x.
+
+    :param complexity: a digit from 0 to 6
+    :type complexity: int
+    :param length: password length
+    :type length: int
+    :return: template
+    :rtype: str
+    """
+    groups = COMPLEXITY_GROUPS[complexity][:length]
+    return groups + 'x'*(length - len(groups))
+
+
+class CtSesam(object):
+    """
+    Calculates passwords from masterpasswords and domain names. You may set the salt and iteration count to
+    something of your liking. If not set default values will be used. Derived hashes are kept in the hash_cache
+    of this module unless use_cache is False.
+
+    :param domain: the domain str
+    :type domain: str
+    :param username: the username str
+    :type username: str
+    :param kgk: the kgk
+    :type kgk: bytes
+    :param salt: the salt
+    :type salt: bytes
+    :param iterations: iteration count (should be 1 or higher, default is 4096)
+    :type iterations: int
+    :param use_cache: look up and store the hash in the hash cache
+    :type use_cache: bool
+    """
+    def __init__(self, domain, username, kgk, salt="pepper".encode('utf-8'), iterations=4096, use_cache=True):
+        self.hash_value = derive_hash(domain, username, kgk, salt, iterations, use_cache)
+
+    def generate(self, setting):
+        """
+        Generates a password string.
+
+        :param setting: a setting object
+        :type setting: PasswordSetting
+        :return: password
+        :rtype: str
+        """
+        return render_password(self.hash_value, setting.get_template(), setting.get_extra_character_set())
+
+    def generate_many(self, templates, extra_set=DEFAULT_CHARACTER_SET_EXTRA):
+        """
+        Generates passwords for a list of templates which share the set of special characters.
+
+        :param templates: list of templates without digit and semicolon
+        :type templates: [str]
+        :param extra_set: set of special characters
+        :type extra_set: str
+        :return: passwords in the order of the templates
+        :rtype: [str]
+        """
+        return render_passwords(self.hash_value, [(template, extra_set) for template in templates])
+
+    def generate_strength_matrix(self, min_length, max_length, extra_set=DEFAULT_CHARACTER_SET_EXTRA):
+        """
+        Generates a preview password for every cell of a PasswordStrengthSelector. The matrix is indexed by
+        length - min_length and then by the complexity.
+
+        :param min_length: minimum password length
+        :type min_length: int
+        :param max_length: maximum password length
+        :type max_length: int
+        :param extra_set: set of special characters
+        :type extra_set: str
+        :return: matrix of passwords
+        :rtype: [[str]]
+        """
+        templates = []
+        for length in range(min_length, max_length+1):
+            for complexity in range(len(COMPLEXITY_GROUPS)):
+                templates.append(get_strength_template(complexity, length))
+        passwords = self.generate_many(templates, extra_set)
+        return [passwords[i:i+len(COMPLEXITY_GROUPS)] for i in range(0, len(passwords), len(COMPLEXITY_GROUPS))]
@@ -5,6 +5,7 @@ Sets of password settings for a domain.
 """
 
 from datetime import datetime
+from sys import intern
 import getpass
 import string
 import re
@@ -12,31 +13,101 @@ import binascii
 from base64 import b64encode, b64decode
 from random import shuffle
 from crypter import Crypter
+from iteration_calibrator import recommend_iterations, exceeds_latency_budget, estimate_latency
+from iteration_calibrator import DEFAULT_TARGET_LATENCY
 
 DEFAULT_CHARACTER_SET_LOWER_CASE = string.ascii_lowercase
 DEFAULT_CHARACTER_SET_UPPER_CASE = string.ascii_uppercase
 DEFAULT_CHARACTER_SET_DIGITS = string.digits
 DEFAULT_CHARACTER_SET_EXTRA = '#!"§$%&/()[]{}=-_+*<>;:.'
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+TEMPLATE_PATTERN = re.compile("(([01234567]);)?([aAnox]+)")
+GROUP_DIGITS = 1
+GROUP_LOWER_CASE = 2
+GROUP_UPPER_CASE = 4
+GROUP_EXTRA = 8
+TEMPLATE_GROUPS = [('n', GROUP_DIGITS), ('a', GROUP_LOWER_CASE), ('A', GROUP_UPPER_CASE), ('o', GROUP_EXTRA)]
+COMPLEXITIES = {
+    GROUP_DIGITS: 0,
+    GROUP_LOWER_CASE: 1,
+    GROUP_UPPER_CASE: 2,
+    GROUP_DIGITS | GROUP_LOWER_CASE: 3,
+    GROUP_LOWER_CASE | GROUP_UPPER_CASE: 4,
+    GROUP_DIGITS | GROUP_LOWER_CASE | GROUP_UPPER_CASE: 5,
+    GROUP_DIGITS | GROUP_LOWER_CASE | GROUP_UPPER_CASE | GROUP_EXTRA: 6,
+    GROUP_EXTRA: 7
+}
+
+
+def parse_date_string(date_string, default):
+    """
+    Parses a date string like "2001-01-01T02:14:12". Wrong formats are reported and the default is returned.
+
+    :param date_string: the date
+    :type date_string: str
+    :param default: returned if the date has a wrong format
+    :type default: datetime
+    :return: the date
+    :rtype: datetime
+    """
+    try:
+        return datetime.strptime(date_string, DATE_FORMAT)
+    except ValueError:
+        print("This date has a wrong format: " + date_string)
+        return default
 
 
 class PasswordSetting(object):
     """
     This saves one set of settings for a certain domain. Use a PasswordSettingsManager to save the settings to a file.
+    Every change sets the dirty flag so the PasswordSettingsManager only saves if something changed.
+
+    Pass a loaded dictionary to create the setting like load_from_dict does. A new setting gets a random salt and
+    template. A loaded setting only gets them if the dictionary has none. Its salt and dates are kept as strings
+    until they are needed for the first time.
+
+    The attributes are slots. The character groups and the length of the template are updated whenever the
+    template changes and the character set is cached until the template or the extra characters change. Character
+    sets are interned so settings with the same characters share one string.
+
+    :param domain: the domain
+    :type domain: str
+    :param loaded_setting: a dictionary from to_dict
+    :type loaded_setting: dict
     """
-    def __init__(self, domain):
+    __slots__ = ('domain', 'url', 'username', 'legacy_password', 'notes', 'iterations', 'salt', 'encoded_salt',
+                 'creation_date', 'modification_date', 'encoded_dates', 'extra_characters', 'template',
+                 'template_groups', 'length', 'character_set', 'synced', 'dirty')
+
+    def __init__(self, domain, loaded_setting=None):
         self.domain = domain
         self.url = None
         self.username = None
         self.legacy_password = None
         self.notes = None
         self.iterations = 4096
-        self.salt = Crypter.createSalt()
-        self.creation_date = datetime.now()
-        self.modification_date = self.creation_date
+        self.salt = None
+        self.encoded_salt = None
+        self.creation_date = None
+        self.modification_date = None
+        self.encoded_dates = None
         self.extra_characters = DEFAULT_CHARACTER_SET_EXTRA
-        self.template = 'x'*10
-        self.calculate_template(True, True, True, True)
+        self.template = None
+        self.template_groups = 0
+        self.length = 0
+        self.character_set = None
         self.synced = False
+        if loaded_setting is not None:
+            self.load_encoded(loaded_setting)
+        if self.salt is None and self.encoded_salt is None:
+            self.salt = Crypter.createSalt()
+        if self.creation_date is None and self.encoded_dates is None:
+            self.creation_date = datetime.now()
+            self.modification_date = self.creation_date
+        if self.template is None:
+            self.update_template('x'*10)
+            self.calculate_template(True, True, True, True)
+        self.dirty = True
 
     def __str__(self):
         output = "<" + self.domain + ": ("
@@ -47,7 +118,7 @@ class PasswordSetting(object):
         if self.notes:
             output += "notes: " + str(self.notes) + ", "
         output += "iterations: " + str(self.iterations) + ", "
-        output += "salt: " + str(binascii.hexlify(self.salt)) + ", "
+        output += "salt: " + str(binascii.hexlify(self.get_salt())) + ", "
         output += "template: " + str(self.template) + ", "
         output += "modification date: " + self.get_modification_date() + ", "
         output += "creation date: " + self.get_creation_date() + ", "
@@ -78,6 +149,7 @@ class PasswordSetting(object):
         """
         self.domain = domain
         self.synced = False
+        self.dirty = True
 
     def has_username(self):
         """
@@ -109,6 +181,7 @@ class PasswordSetting(object):
         """
         if username != self.username:
             self.synced = False
+            self.dirty = True
         self.username = username
 
     def has_legacy_password(self):
@@ -141,6 +214,7 @@ class PasswordSetting(object):
         """
         if legacy_password != self.legacy_password:
             self.synced = False
+            self.dirty = True
         self.legacy_password = legacy_password
 
     @staticmethod
@@ -191,16 +265,18 @@ class PasswordSetting(object):
         :return: character set
         :rtype: str
         """
-        used_characters = ""
-        if 'n' in self.get_template():
-            used_characters += DEFAULT_CHARACTER_SET_DIGITS
-        if 'a' in self.get_template():
-            used_characters += DEFAULT_CHARACTER_SET_LOWER_CASE
-        if 'A' in self.get_template():
-            used_characters += DEFAULT_CHARACTER_SET_UPPER_CASE
-        if 'o' in self.get_template():
-            used_characters += self.get_extra_character_set()
-        return used_characters
+        if self.character_set is None:
+            used_characters = ""
+            if self.template_groups & GROUP_DIGITS:
+                used_characters += DEFAULT_CHARACTER_SET_DIGITS
+            if self.template_groups & GROUP_LOWER_CASE:
+                used_characters += DEFAULT_CHARACTER_SET_LOWER_CASE
+            if self.template_groups & GROUP_UPPER_CASE:
+                used_characters += DEFAULT_CHARACTER_SET_UPPER_CASE
+            if self.template_groups & GROUP_EXTRA:
+                used_characters += self.get_extra_character_set()
+            self.character_set = intern(used_characters)
+        return self.character_set
 
     def get_extra_character_set(self):
         """
@@ -220,9 +296,11 @@ class PasswordSetting(object):
         :type extra_set: str
         """
         if extra_set is None or len(extra_set) <= 0:
-            self.extra_characters = DEFAULT_CHARACTER_SET_EXTRA
-        else:
-            self.extra_characters = extra_set
+            extra_set = DEFAULT_CHARACTER_SET_EXTRA
+        if extra_set != self.extra_characters:
+            self.dirty = True
+            self.character_set = None
+        self.extra_characters = intern(extra_set)
 
     def get_salt(self):
         """
@@ -231,6 +309,9 @@ class PasswordSetting(object):
         :return: the salt
         :rtype: bytes
         """
+        if self.encoded_salt is not None:
+            self.salt = b64decode(self.encoded_salt)
+            self.encoded_salt = None
         return self.salt
 
     def set_salt(self, salt):
@@ -242,12 +323,14 @@ class PasswordSetting(object):
         :type salt: bytes or str
         """
         if type(salt) == bytes:
-            if self.salt != salt:
+            if self.get_salt() != salt:
                 self.synced = False
+                self.dirty = True
             self.salt = salt
         elif type(salt) == str:
-            if self.salt != salt.encode('utf-8'):
+            if self.get_salt() != salt.encode('utf-8'):
                 self.synced = False
+                self.dirty = True
             self.salt = salt.encode('utf-8')
         else:
             raise TypeError("The salt should be bytes.")
@@ -256,7 +339,9 @@ class PasswordSetting(object):
         """
         Creates a new salt for the setting.
         """
+        self.encoded_salt = None
         self.salt = Crypter.createSalt()
+        self.dirty = True
 
     def get_length(self):
         """
@@ -265,7 +350,7 @@ class PasswordSetting(object):
         :return: length
         :rtype: int
         """
-        return len(self.get_template())
+        return self.length
 
     def get_iterations(self):
         """
@@ -285,6 +370,7 @@ class PasswordSetting(object):
         """
         if self.iterations != iterations:
             self.synced = False
+            self.dirty = True
         self.iterations = iterations
 
     def get_c_date(self):
@@ -294,6 +380,7 @@ class PasswordSetting(object):
         :return: the creation date
         :rtype: datetime
         """
+        self.decode_dates()
         return self.creation_date
 
     def get_creation_date(self):
@@ -303,7 +390,7 @@ class PasswordSetting(object):
         :return: the creation date
         :rtype: str
         """
-        return self.creation_date.strftime("%Y-%m-%dT%H:%M:%S")
+        return self.get_c_date().strftime(DATE_FORMAT)
 
     def set_creation_date(self, creation_date):
         """
@@ -312,12 +399,11 @@ class PasswordSetting(object):
         :param creation_date:
         :type creation_date: str
         """
+        self.decode_dates()
         if self.creation_date != creation_date:
             self.synced = False
-        try:
-            self.creation_date = datetime.strptime(creation_date, "%Y-%m-%dT%H:%M:%S")
-        except ValueError:
-            print("This date has a wrong format: " + creation_date)
+            self.dirty = True
+        self.creation_date = parse_date_string(creation_date, self.creation_date)
         if self.modification_date < self.creation_date:
             self.modification_date = self.creation_date
 
@@ -328,6 +414,7 @@ class PasswordSetting(object):
         :return: the modification date
         :rtype: datetime
         """
+        self.decode_dates()
         return self.modification_date
 
     def get_modification_date(self):
@@ -337,7 +424,7 @@ class PasswordSetting(object):
         :return: the modification date
         :rtype: str
         """
-        return self.modification_date.strftime("%Y-%m-%dT%H:%M:%S")
+        return self.get_m_date().strftime(DATE_FORMAT)
 
     def set_modification_date(self, modification_date=None):
         """
@@ -346,13 +433,12 @@ class PasswordSetting(object):
         :param modification_date:
         :type modification_date: str
         """
+        self.decode_dates()
         if modification_date and self.modification_date != modification_date:
             self.synced = False
+        self.dirty = True
         if type(modification_date) == str:
-            try:
-                self.modification_date = datetime.strptime(modification_date, "%Y-%m-%dT%H:%M:%S")
-            except ValueError:
-                print("This date has a wrong format: " + modification_date)
+            self.modification_date = parse_date_string(modification_date, self.modification_date)
         else:
             self.modification_date = datetime.now()
         if self.modification_date < self.creation_date:
@@ -360,6 +446,28 @@ class PasswordSetting(object):
                   "Setting the creation date to the earlier date.")
             self.creation_date = self.modification_date
 
+    def decode_dates(self):
+        """
+        Parses the dates of a loaded setting when they are needed for the first time. The result is the same as if
+        load_from_dict had set them.
+        """
+        if self.encoded_dates is None:
+            return
+        creation_date, modification_date = self.encoded_dates
+        self.encoded_dates = None
+        self.creation_date = datetime.now()
+        self.modification_date = self.creation_date
+        if creation_date is not None:
+            self.creation_date = parse_date_string(creation_date, self.creation_date)
+            if self.modification_date < self.creation_date:
+                self.modification_date = self.creation_date
+        if modification_date is not None:
+            self.modification_date = parse_date_string(modification_date, self.modification_date)
+            if self.modification_date < self.creation_date:
+                print("The modification date was before the creation Date. " +
+                      "Setting the creation date to the earlier date.")
+                self.creation_date = self.modification_date
+
     def get_notes(self):
         """
         Returns the notes.
@@ -381,6 +489,7 @@ class PasswordSetting(object):
         """
         if notes != self.notes:
             self.synced = False
+            self.dirty = True
         self.notes = notes
 
     def get_url(self):
@@ -404,6 +513,7 @@ class PasswordSetting(object):
         """
         if url != self.url:
             self.synced = False
+            self.dirty = True
         else:
             return self.url
 
@@ -434,13 +544,13 @@ class PasswordSetting(object):
         :type use_lower_case: bool
         """
         if use_lower_case is None:
-            use_lower_case = 'a' in self.get_template()
+            use_lower_case = bool(self.template_groups & GROUP_LOWER_CASE)
         if use_upper_case is None:
-            use_upper_case = 'A' in self.get_template()
+            use_upper_case = bool(self.template_groups & GROUP_UPPER_CASE)
         if use_digits is None:
-            use_digits = 'n' in self.get_template()
+            use_digits = bool(self.template_groups & GROUP_DIGITS)
         if use_extra is None:
-            use_extra = 'o' in self.get_template()
+            use_extra = bool(self.template_groups & GROUP_EXTRA)
         l = []
         inserted_lower = False
         inserted_upper = False
@@ -462,7 +572,8 @@ class PasswordSetting(object):
             else:
                 l.append('x')
         shuffle(l)
-        self.template = ''.join(l)
+        self.update_template(''.join(l))
+        self.dirty = True
 
     def get_template(self):
         """
@@ -473,6 +584,22 @@ class PasswordSetting(object):
         """
         return self.template
 
+    def update_template(self, template):
+        """
+        Stores a template without digit and semicolon and updates its character groups and length. The cached
+        character set is dropped. This does not set the dirty flag.
+
+        :param template: template
+        :type template: str
+        """
+        self.template = template
+        self.template_groups = 0
+        for group, bit in TEMPLATE_GROUPS:
+            if group in template:
+                self.template_groups |= bit
+        self.length = len(template)
+        self.character_set = None
+
     def set_template(self, full_template):
         """
         Sets a template from a complete template string with digit and semicolon. This also preferences the template
@@ -481,11 +608,13 @@ class PasswordSetting(object):
         :param full_template: complete template string
         :type full_template: str
         """
-        matches = re.compile("(([01234567]);)?([aAnox]+)").match(full_template)
+        matches = TEMPLATE_PATTERN.match(full_template)
         if matches and len(matches.groups()) >= 3:
             if matches.group(2):
                 self.set_complexity(int(matches.group(2)))
-            self.template = matches.group(3)
+            if self.template != matches.group(3):
+                self.dirty = True
+                self.update_template(matches.group(3))
 
     def set_complexity(self, complexity):
         """
@@ -505,32 +634,7 @@ class PasswordSetting(object):
         :return: a digit from 0 to 6 or -1
         :rtype: int
         """
-        if 'n' in self.get_template() and 'a' not in self.get_template() and \
-                'A' not in self.get_template() and 'o' not in self.get_template():
-            return 0
-        elif 'n' not in self.get_template() and 'a' in self.get_template() and \
-                'A' not in self.get_template() and 'o' not in self.get_template():
-            return 1
-        elif 'n' not in self.get_template() and 'a' not in self.get_template() and \
-                'A' in self.get_template() and 'o' not in self.get_template():
-            return 2
-        elif 'n' in self.get_template() and 'a' in self.get_template() and \
-                'A' not in self.get_template() and 'o' not in self.get_template():
-            return 3
-        elif 'n' not in self.get_template() and 'a' in self.get_template() and \
-                'A' in self.get_template() and 'o' not in self.get_template():
-            return 4
-        elif 'n' in self.get_template() and 'a' in self.get_template() and \
-                'A' in self.get_template() and 'o' not in self.get_template():
-            return 5
-        elif 'n' in self.get_template() and 'a' in self.get_template() and \
-                'A' in self.get_template() and 'o' in self.get_template():
-            return 6
-        elif 'n' not in self.get_template() and 'a' not in self.get_template() and \
-                'A' not in self.get_template() and 'o' in self.get_template():
-            return 7
-        else:
-            return -1
+        return COMPLEXITIES.get(self.template_groups, -1)
 
     def is_synced(self):
         """
@@ -548,8 +652,28 @@ class PasswordSetting(object):
         :param is_synced:
         :type is_synced: bool
         """
+        if self.synced != is_synced:
+            self.dirty = True
         self.synced = is_synced
 
+    def is_dirty(self):
+        """
+        Query if the setting changed since it was loaded or saved.
+
+        :return: is dirty?
+        :rtype: bool
+        """
+        return self.dirty
+
+    def set_dirty(self, is_dirty=True):
+        """
+        Sets the dirty flag. The PasswordSettingsManager clears it after loading and saving.
+
+        :param is_dirty:
+        :type is_dirty: bool
+        """
+        self.dirty = is_dirty
+
     def to_dict(self):
         """
         Returns a dictionary with settings to be saved.
@@ -567,7 +691,7 @@ class PasswordSetting(object):
         if self.notes:
             domain_object["notes"] = self.get_notes()
         domain_object["iterations"] = self.get_iterations()
-        if self.salt:
+        if self.get_salt():
             domain_object["salt"] = str(b64encode(self.get_salt()), encoding='utf-8')
         domain_object["cDate"] = self.get_creation_date()
         domain_object["mDate"] = self.get_modification_date()
@@ -579,6 +703,35 @@ class PasswordSetting(object):
         """
         Loads the setting from a dictionary.
 
+        :param loaded_setting:
+        :type loaded_setting: dict
+        """
+        if "salt" in loaded_setting:
+            self.set_salt(b64decode(loaded_setting["salt"]))
+        if "cDate" in loaded_setting:
+            self.set_creation_date(loaded_setting["cDate"])
+        if "mDate" in loaded_setting:
+            self.set_modification_date(loaded_setting["mDate"])
+        self.load_properties(loaded_setting)
+
+    def load_encoded(self, loaded_setting):
+        """
+        Loads a dictionary into a setting which is being created. The salt and the dates are kept as they are and
+        decoded by get_salt and decode_dates.
+
+        :param loaded_setting:
+        :type loaded_setting: dict
+        """
+        if "salt" in loaded_setting:
+            self.encoded_salt = loaded_setting["salt"]
+        if "cDate" in loaded_setting or "mDate" in loaded_setting:
+            self.encoded_dates = (loaded_setting.get("cDate"), loaded_setting.get("mDate"))
+        self.load_properties(loaded_setting)
+
+    def load_properties(self, loaded_setting):
+        """
+        Loads everything but the salt and the dates from a dictionary.
+
         :param loaded_setting:
         :type loaded_setting: dict
         """
@@ -592,19 +745,13 @@ class PasswordSetting(object):
             self.set_notes(loaded_setting["notes"])
         if "iterations" in loaded_setting:
             self.set_iterations(loaded_setting["iterations"])
-        if "salt" in loaded_setting:
-            self.set_salt(b64decode(loaded_setting["salt"]))
-        if "cDate" in loaded_setting:
-            self.set_creation_date(loaded_setting["cDate"])
-        if "mDate" in loaded_setting:
-            self.set_modification_date(loaded_setting["mDate"])
         if "extras" in loaded_setting:
             self.set_extra_character_set(loaded_setting["extras"])
         if "passwordTemplate" in loaded_setting:
             self.set_template(loaded_setting["passwordTemplate"])
         if "length" in loaded_setting and "usedCharacters" in loaded_setting and \
            "passwordTemplate" not in loaded_setting:
-            self.template = "o"*int(loaded_setting["length"])
+            self.update_template("o"*int(loaded_setting["length"]))
             self.set_extra_character_set(loaded_setting["usedCharacters"])
             self.calculate_template(False, False, False, True)
 
@@ -626,11 +773,17 @@ class PasswordSetting(object):
                 length = self.get_length()
             self.set_template("6;" + "x"*length)
             self.calculate_template(True, True, True, True)
-            iterations_str = input('Iterationszahl [' + str(self.get_iterations()) + ']: ')
+            recommended_iterations = recommend_iterations()
+            iterations_str = input('Iterationszahl [' + str(self.get_iterations()) + '] (empfohlen für ' +
+                                   str(int(DEFAULT_TARGET_LATENCY*1000)) + ' ms: ' +
+                                   str(recommended_iterations) + '): ')
             try:
                 iterations = int(iterations_str)
                 if iterations <= 0:
                     iterations = self.get_iterations()
             except ValueError:
                 iterations = self.get_iterations()
+            if exceeds_latency_budget(iterations):
+                print('Warnung: Mit ' + str(iterations) + ' Iterationen dauert die Berechnung auf diesem ' +
+                      'Rechner etwa ' + str(int(round(estimate_latency(iterations)*1000))) + ' ms.')
             self.set_iterations(iterations)
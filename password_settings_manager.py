@@ -5,7 +5,8 @@ The PasswordSettingsManager handles the settings and manages storage and synchro
 """
 
 import json
-import struct
+from collections import OrderedDict
+from threading import RLock
 from datetime import datetime
 from password_setting import PasswordSetting
 from crypter import Crypter
@@ -13,12 +14,35 @@ from packer import Packer
 from sync_manager import SyncManager
 from base64 import b64decode, b64encode
 from kgk_manager import KgkManager
+from frecency_tracker import FrecencyTracker
+from settings_merger import merge, create_export_data, parse_date, datetime_to_timestamp, DATE_FORMAT
+from settings_container import decrypt_record, create_records_key, create_blind_index, \
+    CONTAINER_VERSION_1, CONTAINER_VERSION_2, CONTAINER_VERSION_3
+from settings_log import SettingsLog, COMPACTION_SIZE, COMPACTION_RATIO
+from settings_storage import DictStorage, ContainerStorage, RowStorage
 
 
 class PasswordSettingsManager(object):
     """
     Use this class to manage password settings. It can save the settings locally to the settings file and it can
-    export them to be sent to a sync server.
+    export them to be sent to a sync server. The manager and every setting have a dirty flag. Use is_dirty to skip
+    saves when nothing changed. If a PersistenceWorker is set the settings are encrypted and written in its
+    background thread. A failed write marks the settings as dirty again and is reported to the write error callback.
+
+    The settings are stored in an OrderedDict by domain so lookups do not depend on the number of settings. Do not
+    call set_domain on managed settings: delete the setting and set it with the new domain instead.
+
+    Loaded settings are kept in lazy_records until get_setting needs them. domain_order holds every domain of
+    settings and lazy_records in the order they were added so creating a setting from its record does not move the
+    domain in the domain list. Every container version (see
+    settings_container) has a storage in settings_storage which loads and writes its format: the parsed
+    dictionaries of version 1, the encrypted records and the settings log of version 2 (see enable_log) and the
+    database rows of version 3 which a SQLitePreferenceManager uses. Once a file with version 2 was loaded the
+    manager keeps version 2.
+
+    The writes of the PersistenceWorker change the dirty flags, the preference manager and the settings log while
+    the GUI thread uses them. Every method which touches this state holds lock. flush waits for the worker without
+    holding it.
 
     :param preference_manager: a PreferenceManager object
     :type preference_manager: PreferenceManager
@@ -26,21 +50,142 @@ class PasswordSettingsManager(object):
     def __init__(self, preference_manager):
         self.preference_manager = preference_manager
         self.remote_data = None
-        self.settings = []
+        self.last_merge = None
+        self.tombstones = {}
+        self.settings = OrderedDict()
+        self.domain_list = None
         self.sync_manager = SyncManager()
         self.update_remote = False
+        self.frecency = FrecencyTracker()
+        self.dirty = False
+        self.stored_sync_settings = b''
+        self.persistence_worker = None
+        self.write_error = None
+        self.write_error_callback = None
+        self.conflict = None
+        self.lock = RLock()
+        self.container_version = CONTAINER_VERSION_1
+        if preference_manager.get_container_version() == CONTAINER_VERSION_3:
+            self.container_version = CONTAINER_VERSION_3
+        self.records_key = None
+        self.index_key = None
+        self.lazy_records = OrderedDict()
+        self.domain_order = OrderedDict()
+        self.record_cache = {}
+        self.settings_log = SettingsLog(preference_manager.log_file)
+        self.log_enabled = False
+        self.pending_deletions = {}
+        self.unwritten_log_entries = []
+        self.unwritten_rows = OrderedDict()
+        self.unwritten_deleted_rows = OrderedDict()
+        self.pending_full_write = None
+        self.needs_compaction = False
+        self.compaction_size = COMPACTION_SIZE
+        self.compaction_ratio = COMPACTION_RATIO
+        self.storages = {
+            CONTAINER_VERSION_1: DictStorage(self),
+            CONTAINER_VERSION_2: ContainerStorage(self),
+            CONTAINER_VERSION_3: RowStorage(self)
+        }
+
+    def set_persistence_worker(self, persistence_worker):
+        """
+        Pass a PersistenceWorker to write the settings in the background. Bursts of saves are coalesced into one
+        write.
+
+        :param persistence_worker: a persistence worker
+        :type persistence_worker: PersistenceWorker
+        """
+        self.persistence_worker = persistence_worker
+
+    def set_write_error_callback(self, callback):
+        """
+        The callback is called with the exception if a write fails and with None once a write succeeds again.
+        With a PersistenceWorker it is called in the thread of the worker.
+
+        :param callback: function with the exception or None as parameter
+        :type callback: function
+        """
+        self.write_error_callback = callback
+
+    def write_failed(self, error):
+        """
+        Marks the settings as dirty after a failed write so the next save writes all settings again.
+
+        :param error: the exception of the write
+        :type error: Exception
+        """
+        with self.lock:
+            self.dirty = True
+            self.needs_compaction = True
+            self.write_error = error
+        if self.write_error_callback:
+            self.write_error_callback(error)
+
+    def write_succeeded(self):
+        """
+        Clears the error of an earlier failed write.
+        """
+        with self.lock:
+            had_error = self.write_error is not None
+            self.write_error = None
+        if had_error and self.write_error_callback:
+            self.write_error_callback(None)
+
+    def set_container_version(self, container_version):
+        """
+        Selects the format of the settings data for the next save. Version 2 encrypts every record separately so it
+        can be loaded lazily.
+
+        :param container_version: CONTAINER_VERSION_1 or CONTAINER_VERSION_2 (CONTAINER_VERSION_3 for databases)
+        :type container_version: int
+        """
+        with self.lock:
+            if container_version not in (CONTAINER_VERSION_1, CONTAINER_VERSION_2, CONTAINER_VERSION_3):
+                raise ValueError("Unknown container version: " + str(container_version))
+            if (container_version == CONTAINER_VERSION_3) != \
+               (self.preference_manager.get_container_version() == CONTAINER_VERSION_3):
+                raise ValueError("Container version 3 is only used by databases.")
+            if container_version == CONTAINER_VERSION_2 and self.records_key is None:
+                self.records_key = create_records_key()
+            if container_version != self.container_version:
+                self.container_version = container_version
+                self.dirty = True
+                self.needs_compaction = True
+
+    def enable_log(self):
+        """
+        Saves append the changed settings to the settings log instead of writing the whole settings file. The log
+        needs container version 2. The log is used automatically if the settings file has one.
+        """
+        self.set_container_version(CONTAINER_VERSION_2)
+        self.log_enabled = True
+
+    def get_storage(self, container_version=None):
+        """
+        Returns the storage which reads and writes settings data of a container version (see settings_storage).
+        Unknown versions are read like version 1.
+
+        :param container_version: the version (the version for the next save if None)
+        :type container_version: int
+        :return: the storage
+        :rtype: SettingsStorage
+        """
+        if container_version is None:
+            container_version = self.container_version
+        return self.storages.get(container_version, self.storages[CONTAINER_VERSION_1])
 
     @staticmethod
     def get_settings_crypter(kgk_manager):
         """
-        Creates a settings crypter
+        Creates a settings crypter. The key is cached by the kgk manager.
 
         :param kgk_manager: a kgk manager
         :type kgk_manager: KgkManager
         :return: Crypter for settings
         :rtype: Crypter
         """
-        return Crypter(Crypter.create_key(kgk_manager.get_kgk(), kgk_manager.get_salt2()) + kgk_manager.get_iv2())
+        return Crypter(kgk_manager.get_settings_key() + kgk_manager.get_iv2())
 
     def load_local_settings(self, kgk_manager):
         """
@@ -49,54 +194,233 @@ class PasswordSettingsManager(object):
         :param kgk_manager: kgk manager
         :type kgk_manager: KgkManager
         """
-        encrypted_settings = self.preference_manager.get_settings_data()
-        if len(encrypted_settings) < 40:
-            return
-        settings_crypter = PasswordSettingsManager.get_settings_crypter(kgk_manager)
-        decrypted_settings = settings_crypter.decrypt(encrypted_settings)
-        sync_settings_len = struct.unpack('!I', decrypted_settings[0:4])[0]
-        if sync_settings_len > 0:
-            self.sync_manager.load_binary_sync_settings(decrypted_settings[4:4+sync_settings_len])
-        if len(decrypted_settings) < sync_settings_len+44:
-            raise ValueError("The decrypted settings are too short.")
-        decompressed_settings = Packer.decompress(decrypted_settings[4+sync_settings_len:])
-        if len(decompressed_settings) <= 0:
-            raise PermissionError("Wrong password: The settings could not decompress.")
-        saved_settings = json.loads(str(decompressed_settings, encoding='utf-8'))
-        for domain_name in saved_settings['settings'].keys():
-            data_set = saved_settings['settings'][domain_name]
-            found = False
-            i = 0
-            while i < len(self.settings):
-                setting = self.settings[i]
-                if setting.get_domain() == domain_name:
-                    found = True
-                    if datetime.strptime(data_set['mDate'], "%Y-%m-%dT%H:%M:%S") > setting.get_m_date():
-                        setting.load_from_dict(data_set)
-                        setting.set_synced(setting.get_domain() in saved_settings['synced'])
-                i += 1
-            if not found:
-                new_setting = PasswordSetting(domain_name)
-                new_setting.load_from_dict(data_set)
-                new_setting.set_synced(new_setting.get_domain() in saved_settings['synced'])
-                self.settings.append(new_setting)
+        with self.lock:
+            encrypted_settings = self.preference_manager.get_settings_data()
+            if len(encrypted_settings) < 40:
+                return
+            settings_crypter = PasswordSettingsManager.get_settings_crypter(kgk_manager)
+            self.get_storage(self.preference_manager.get_container_version()).load(
+                kgk_manager, settings_crypter, encrypted_settings)
+            self.apply_tombstones()
+
+    def load_extras(self, sync_settings, saved_settings):
+        """
+        Loads the sync settings, the frecency and the tombstones.
+
+        :param sync_settings: packed sync settings
+        :type sync_settings: bytes
+        :param saved_settings: the settings dictionary or the index
+        :type saved_settings: dict
+        """
+        if len(sync_settings) > 0:
+            self.sync_manager.load_binary_sync_settings(sync_settings)
+            self.stored_sync_settings = sync_settings
+        if 'frecency' in saved_settings:
+            self.frecency.load_from_dict(saved_settings['frecency'])
+            self.frecency.dirty = False
+        for domain_name, m_date in saved_settings.get('tombstones', {}).items():
+            if domain_name not in self.tombstones or parse_date(m_date) > parse_date(self.tombstones[domain_name]):
+                self.tombstones[domain_name] = m_date
+
+    def apply_tombstones(self):
+        """
+        Removes the settings which were deleted by another process after their last modification. Call this after
+        tombstones were loaded.
+        """
+        for domain_name, m_date in self.tombstones.items():
+            if self.has_setting(domain_name) and self.get_record_timestamp(domain_name) <= parse_date(m_date):
+                self.settings.pop(domain_name, None)
+                self.lazy_records.pop(domain_name, None)
+                self.domain_order.pop(domain_name, None)
+                self.record_cache.pop(domain_name, None)
+                self.domain_list = None
+
+    def get_record_timestamp(self, domain):
+        """
+        Returns the modification date of a managed setting without decrypting its record.
+
+        :param domain: the domain
+        :type domain: str
+        :return: seconds since the epoch
+        :rtype: int
+        """
+        if domain in self.settings:
+            return datetime_to_timestamp(self.settings[domain].get_m_date())
+        return parse_date(self.lazy_records[domain][1])
+
+    def materialize(self, domain):
+        """
+        Creates the setting of a domain from its record in lazy_records. Encrypted records are decrypted. Rows of
+        a database are read by their blind index first.
+
+        :param domain: the domain
+        :type domain: str
+        :return: the setting or None if another process deleted the row
+        :rtype: PasswordSetting
+        """
+        record, m_date, synced = self.lazy_records.pop(domain)
+        if record is None:
+            row = self.preference_manager.get_record(create_blind_index(self.index_key, domain))
+            if row is None:
+                self.domain_order.pop(domain, None)
+                self.domain_list = None
+                return None
+            record = row[1]
+        if isinstance(record, dict):
+            setting = PasswordSetting(domain, record)
+        else:
+            setting = PasswordSetting(domain, decrypt_record(self.records_key, record))
+            self.record_cache[domain] = record
+        setting.set_synced(synced)
+        setting.set_dirty(False)
+        self.settings[domain] = setting
+        return setting
+
+    def materialize_all(self):
+        """
+        Creates the settings of all records in lazy_records.
+        """
+        for domain in list(self.lazy_records.keys()):
+            self.materialize(domain)
+
+    def reload_if_changed(self, kgk_manager):
+        """
+        Checks with a single stat if another process changed the settings file. If it did the file is read again
+        and the records which are newer in the file are merged. A changed settings log is replayed. If the file
+        can not be merged it stays marked as changed so the next call tries again.
+
+        :param kgk_manager: kgk manager
+        :type kgk_manager: KgkManager
+        :return: were settings merged?
+        :rtype: bool
+        :raises ValueError: if another process saved the file with another masterpassword or kgk
+        """
+        with self.lock:
+            file_stat = self.preference_manager.file_stat
+            if not self.preference_manager.reload_if_changed():
+                return self.get_storage().reload_log()
+            try:
+                kgk_block = self.preference_manager.get_kgk_block()
+                if len(kgk_block) != 112 or not kgk_manager.kgk_crypter:
+                    self.preference_manager.file_stat = file_stat
+                    return False
+                self.check_stored_kgk(kgk_manager.kgk_crypter, kgk_manager.get_kgk(), kgk_manager.salt)
+                kgk_manager.decrypt_kgk(kgk_block, kgk_manager.kgk_crypter)
+                self.load_local_settings(kgk_manager)
+            except Exception:
+                self.preference_manager.file_stat = file_stat
+                raise
+            self.conflict = None
+            return True
+
+    def check_stored_kgk(self, kgk_crypter, kgk, salt):
+        """
+        Checks if the settings file which was read by the preference manager was saved with the same salt and kgk.
+        Otherwise the conflict is remembered in conflict: store_local_settings refuses to overwrite the file and the
+        settings stay dirty until reload_if_changed succeeds.
+
+        :param kgk_crypter: the kgk crypter
+        :type kgk_crypter: Crypter
+        :param kgk: the kgk
+        :type kgk: bytes
+        :param salt: the salt
+        :type salt: bytes
+        :return: the decrypted kgk block
+        :rtype: bytes
+        :raises ValueError: if the file was saved with another masterpassword or kgk
+        """
+        with self.lock:
+            if self.preference_manager.get_salt() != salt:
+                self.conflict = "The settings file was saved with another masterpassword."
+            else:
+                decrypted_kgk_block = kgk_crypter.decrypt_unpadded(self.preference_manager.get_kgk_block())
+                if decrypted_kgk_block[48:112] == kgk:
+                    return decrypted_kgk_block
+                self.conflict = "KGK mismatch! Another process saved different settings."
+            self.dirty = True
+            self.preference_manager.file_stat = None
+            raise ValueError(self.conflict)
 
     def store_local_settings(self, kgk_manager):
         """
         This actually saves the settings to a file on the disk. The file is encrypted so you need to supply the
-        password.
+        password. With a PersistenceWorker a snapshot of the settings is taken and the write happens in the
+        background.
 
         :param kgk_manager: kgk manager
         :type kgk_manager: KgkManager
+        :return: future of the write if there is a persistence worker
+        :rtype: concurrent.futures.Future
+        :raises ValueError: if another process saved the file with another masterpassword or kgk (see
+                            check_stored_kgk)
+        """
+        with self.lock:
+            if self.conflict is not None:
+                raise ValueError(self.conflict)
+            write = self.get_storage().create_write(kgk_manager)
+            if self.persistence_worker:
+                return self.persistence_worker.submit(write)
+            write()
+
+    def flush(self, kgk_manager=None):
+        """
+        Waits until all saves are written if there is a persistence worker. With a kgk manager the settings are
+        saved first if they or the frecency changed. Call it like this before the program exits so the frecency
+        which store_local_settings_if_dirty skips is not lost.
+
+        :param kgk_manager: kgk manager
+        :type kgk_manager: KgkManager
+        """
+        if kgk_manager is not None:
+            with self.lock:
+                if self.is_dirty() or self.frecency.dirty:
+                    self.store_local_settings(kgk_manager)
+        if self.persistence_worker:
+            self.persistence_worker.flush()
+
+    def store_local_settings_if_dirty(self, kgk_manager):
+        """
+        Saves the settings only if something changed since they were loaded or saved. Frecency changes alone do
+        not trigger a save. They are written with the next save or by flush.
+
+        :param kgk_manager: kgk manager
+        :type kgk_manager: KgkManager
+        :return: were the settings saved?
+        :rtype: bool
+        """
+        with self.lock:
+            if not self.is_dirty():
+                return False
+            self.store_local_settings(kgk_manager)
+            return True
+
+    def is_dirty(self):
+        """
+        Checks if settings were added, changed or deleted or if the sync settings changed since the last load or
+        save. Changes of the frecency are not considered.
+
+        :return: is dirty?
+        :rtype: bool
+        """
+        with self.lock:
+            return self.dirty or any(setting.is_dirty() for setting in self.settings.values()) or \
+                self.sync_manager.get_binary_sync_settings() != self.stored_sync_settings
+
+    def mark_clean(self, sync_settings):
+        """
+        Clears all dirty flags. Call this after the settings were saved.
+
+        :param sync_settings: the packed sync settings which were saved
+        :type sync_settings: bytes
         """
-        kgk_manager.fresh_salt2()
-        kgk_manager.fresh_iv2()
-        settings_crypter = PasswordSettingsManager.get_settings_crypter(kgk_manager)
-        sync_settings = self.sync_manager.get_binary_sync_settings()
-        self.preference_manager.store_settings_data(settings_crypter.encrypt(
-            struct.pack('!I', len(sync_settings)) + sync_settings +
-            Packer.compress(json.dumps(self.get_settings_as_dict()))))
-        kgk_manager.store_local_kgk_block()
+        self.dirty = False
+        self.needs_compaction = False
+        self.pending_deletions = {}
+        self.unwritten_log_entries = []
+        for setting in self.settings.values():
+            setting.set_dirty(False)
+        self.frecency.dirty = False
+        self.stored_sync_settings = sync_settings
 
     def load_settings(self, kgk_manager, password, no_sync=False):
         """
@@ -115,6 +439,7 @@ class PasswordSettingsManager(object):
                 pull_successful, data = self.sync_manager.pull()
                 if pull_successful and len(data) > 0:
                     remote_kgk_manager = KgkManager()
+                    remote_kgk_manager.set_kdf_service(kgk_manager.kdf_service)
                     remote_kgk_manager.update_from_blob(password.encode('utf-8'), b64decode(data))
                     if remote_kgk_manager.has_kgk() and kgk_manager.get_kgk() != remote_kgk_manager.get_kgk():
                         raise ValueError("KGK mismatch! This are not your settings!")
@@ -132,66 +457,133 @@ class PasswordSettingsManager(object):
         :return: a setting object
         :rtype: PasswordSetting
         """
-        for setting in self.settings:
-            if setting.get_domain() == domain:
-                return setting
-        setting = PasswordSetting(domain)
-        self.settings.append(setting)
-        return setting
+        with self.lock:
+            if domain in self.settings:
+                return self.settings[domain]
+            if domain in self.lazy_records:
+                setting = self.materialize(domain)
+                if setting is not None:
+                    return setting
+            setting = PasswordSetting(domain)
+            self.settings[domain] = setting
+            self.domain_order[domain] = None
+            self.tombstones.pop(domain, None)
+            self.pending_deletions.pop(domain, None)
+            self.domain_list = None
+            self.dirty = True
+            return setting
+
+    def has_setting(self, domain):
+        """
+        Checks if there is a setting for the domain.
+
+        :param domain: the domain
+        :type domain: str
+        :return: is there a setting?
+        :rtype: bool
+        """
+        return domain in self.settings or domain in self.lazy_records
 
     def set_setting(self, setting):
         """
         This saves the supplied setting only in memory. Call save_settings_to_file if you want to have it saved to
-        disk.
+        disk. Setting an unchanged setting which is already managed does nothing.
 
         :param PasswordSetting setting: the setting which should be saved
         """
-        for i, existing_setting in enumerate(self.settings):
-            if existing_setting.get_domain() == setting.get_domain():
-                self.settings.pop(i)
-        self.settings.append(setting)
-        self.update_remote = True
+        with self.lock:
+            if self.settings.get(setting.get_domain()) is setting and not setting.is_dirty():
+                return
+            if not setting.is_dirty():
+                self.needs_compaction = True
+            self.settings.pop(setting.get_domain(), None)
+            self.lazy_records.pop(setting.get_domain(), None)
+            self.domain_order.pop(setting.get_domain(), None)
+            self.record_cache.pop(setting.get_domain(), None)
+            self.settings[setting.get_domain()] = setting
+            self.domain_order[setting.get_domain()] = None
+            self.tombstones.pop(setting.get_domain(), None)
+            self.pending_deletions.pop(setting.get_domain(), None)
+            self.domain_list = None
+            self.dirty = True
+            self.update_remote = True
 
     def delete_setting(self, setting):
         """
         This removes the setting from the internal list. Call save_settings_to_file if you want to have the change
-        saved to disk.
+        saved to disk. A tombstone remembers the deletion until it was pushed to the sync server.
 
         :param setting: PasswordSetting object
         :type setting: PasswordSetting
         """
-        i = 0
-        while i < len(self.settings):
-            existing_setting = self.settings[i]
-            if existing_setting.get_domain() == setting.get_domain():
-                self.settings.pop(i)
-            else:
-                i += 1
+        with self.lock:
+            self.record_cache.pop(setting.get_domain(), None)
+            if self.settings.pop(setting.get_domain(), None) is not None or \
+               self.lazy_records.pop(setting.get_domain(), None) is not None:
+                self.domain_order.pop(setting.get_domain(), None)
+                self.tombstones[setting.get_domain()] = datetime.now().strftime(DATE_FORMAT)
+                self.pending_deletions[setting.get_domain()] = self.tombstones[setting.get_domain()]
+                self.domain_list = None
+                self.dirty = True
+                self.update_remote = True
+            self.frecency.remove(setting.get_domain())
 
     def get_domain_list(self):
         """
-        This gives you a list of saved domains.
+        This gives you a list of saved domains in the order they were added. The list is cached until settings are
+        added or deleted so do not modify it. Use has_setting to check for a single domain.
 
         :return: a list of domain names
         :rtype: [str]
         """
-        return [setting.get_domain() for setting in self.settings]
+        if self.domain_list is None:
+            self.domain_list = list(self.domain_order.keys())
+        return self.domain_list
+
+    def get_frequently_used_settings(self, n):
+        """
+        Returns the settings of the n domains which were used most frequently and most recently.
+
+        :param n: maximum number of settings
+        :type n: int
+        :return: settings with the most used first
+        :rtype: [PasswordSetting]
+        """
+        return [self.get_setting(domain) for domain in [domain for domain in
+                self.frecency.get_top_domains(len(self.frecency)) if self.has_setting(domain)][:n]]
 
     def get_settings_as_dict(self):
         """
         Constructs a dictionary with a list of settings (no PasswordSetting objects but dicts) and a list of
-        domain names of synced domains.
+        domain names of synced domains. If domains were used their use statistics are stored in frecency. Deletions
+        which were not pushed yet are stored in tombstones.
 
         :return: a dictionary
         :rtype: dict
         """
+        self.materialize_all()
         settings_dict = {'settings': {}, 'synced': []}
-        for setting in self.settings:
+        for setting in self.settings.values():
             settings_dict['settings'][setting.get_domain()] = setting.to_dict()
             if setting.is_synced():
                 settings_dict['synced'].append(setting.get_domain())
+        settings_dict.update(self.get_extras())
         return settings_dict
 
+    def get_extras(self):
+        """
+        Returns the frecency and the tombstones if there are any.
+
+        :return: a dictionary
+        :rtype: dict
+        """
+        extras = {}
+        if len(self.frecency) > 0:
+            extras['frecency'] = self.frecency.to_dict()
+        if len(self.tombstones) > 0:
+            extras['tombstones'] = dict(self.tombstones)
+        return extras
+
     def get_export_data(self, kgk_manager):
         """
         This gives you a base64 encoded string of encrypted settings data (the blob).
@@ -202,84 +594,58 @@ class PasswordSettingsManager(object):
         :rtype: str
         """
         kgk_block = kgk_manager.get_fresh_encrypted_kgk()
-        settings_list = self.get_settings_as_dict()['settings']
-        if self.remote_data:
-            for domain_name in self.remote_data.keys():
-                data_set = self.remote_data[domain_name]
-                if 'deleted' in data_set and data_set['deleted']:
-                    for i, setting_dict in enumerate(settings_list):
-                        if setting_dict['domain'] == domain_name and datetime.strptime(
-                                data_set['mDate'], "%Y-%m-%dT%H:%M:%S") > datetime.strptime(
-                                setting_dict['mDate'], "%Y-%m-%dT%H:%M:%S"):
-                            settings_list[i] = data_set
-                if domain_name not in settings_list.keys():
-                    m_date = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
-                    if 'mDate' in self.remote_data[domain_name]:
-                        m_date = self.remote_data[domain_name]['mDate']
-                    settings_list[domain_name] = {
-                        'mDate': m_date,
-                        'deleted': True
-                    }
+        settings_list = create_export_data(self.get_settings_as_dict()['settings'], self.remote_data or {},
+                                           self.tombstones)
         settings_crypter = self.get_settings_crypter(kgk_manager)
         return b64encode(b'\x01' + kgk_manager.get_kgk_crypter_salt() + kgk_block + settings_crypter.encrypt(
             Packer.compress(json.dumps(settings_list))))
 
     def update_from_export_data(self, kgk_manager, blob):
         """
-        Call this method to pull settings from the sync server.
+        Call this method to pull settings from the sync server. The result of the merge is kept in last_merge.
+        The settings are only saved if something changed.
 
         :param kgk_manager: the kgk manager used for the decryption
         :type kgk_manager: KgkManager
         :param blob: the export data
         :type blob: bytes
         """
-        if not blob[0] == 1:
-            print("Version error: Wrong data format. Could not import anything.")
-            return True
-        settings_crypter = self.get_settings_crypter(kgk_manager)
-        decrypted_settings = settings_crypter.decrypt(blob[145:])
-        if len(decrypted_settings) <= 0:
-            print("Wrong password.")
-            return False
-        self.remote_data = json.loads(str(Packer.decompress(decrypted_settings), encoding='utf-8'))
-        self.update_remote = False
-        for domain_name in self.remote_data.keys():
-            data_set = self.remote_data[domain_name]
-            found = False
-            i = 0
-            while i < len(self.settings):
-                setting = self.settings[i]
-                if setting.get_domain() == domain_name:
-                    found = True
-                    if datetime.strptime(data_set['mDate'], "%Y-%m-%dT%H:%M:%S") > setting.get_m_date():
-                        if 'deleted' in data_set and data_set['deleted']:
-                            self.settings.pop(i)
-                        else:
-                            setting.load_from_dict(data_set)
-                            setting.set_synced(True)
-                            self.update_remote = True
-                            i += 1
-                    else:
-                        i += 1
-                else:
-                    i += 1
-            if not found:
-                new_setting = PasswordSetting(domain_name)
-                new_setting.load_from_dict(data_set)
+        with self.lock:
+            if not blob[0] == 1:
+                print("Version error: Wrong data format. Could not import anything.")
+                return True
+            settings_crypter = self.get_settings_crypter(kgk_manager)
+            decrypted_settings = settings_crypter.decrypt(blob[145:])
+            if len(decrypted_settings) <= 0:
+                print("Wrong password.")
+                return False
+            self.remote_data = json.loads(str(Packer.decompress(decrypted_settings), encoding='utf-8'))
+            self.materialize_all()
+            delta = merge({domain_name: datetime_to_timestamp(setting.get_m_date())
+                           for domain_name, setting in self.settings.items()},
+                          self.remote_data,
+                          [domain_name for domain_name, setting in self.settings.items() if not setting.is_synced()],
+                          self.tombstones)
+            for domain_name in delta.added:
+                new_setting = PasswordSetting(domain_name, self.remote_data[domain_name])
                 new_setting.set_synced(True)
-                self.settings.append(new_setting)
-        for setting in self.settings:
-            found = False
-            for domain_name in self.remote_data.keys():
-                data_set = self.remote_data[domain_name]
-                if setting.get_domain() == domain_name:
-                    found = True
-                    if setting.get_m_date() > datetime.strptime(data_set['mDate'], "%Y-%m-%dT%H:%M:%S"):
-                        self.update_remote = True
-            if not found:
-                self.update_remote = True
-        self.store_local_settings(kgk_manager)
-        return self.update_remote
+                self.settings[domain_name] = new_setting
+                self.domain_order[domain_name] = None
+                self.tombstones.pop(domain_name, None)
+            for domain_name in delta.updated:
+                self.settings[domain_name].load_from_dict(self.remote_data[domain_name])
+                self.settings[domain_name].set_synced(True)
+            for domain_name in delta.deleted:
+                del self.settings[domain_name]
+                del self.domain_order[domain_name]
+                self.needs_compaction = True
+            if len(delta.added) > 0 or len(delta.deleted) > 0:
+                self.domain_list = None
+                self.dirty = True
+            self.last_merge = delta
+            self.update_remote = delta.needs_push
+            self.store_local_settings_if_dirty(kgk_manager)
+            return self.update_remote
 
     def store_settings(self, kgk_manager):
         """
@@ -307,5 +673,15 @@ class PasswordSettingsManager(object):
         Convenience function for marking all saved settings as synced. Call this after a successful update at the
         sync server.
         """
-        for setting in self.settings:
-            setting.set_synced(True)
+        with self.lock:
+            for setting in self.settings.values():
+                setting.set_synced(True)
+            for domain_name, (encrypted_record, m_date, synced) in self.lazy_records.items():
+                if not synced:
+                    self.lazy_records[domain_name] = (encrypted_record, m_date, True)
+                    self.dirty = True
+                    self.needs_compaction = True
+            if len(self.tombstones) > 0:
+                self.tombstones = {}
+                self.dirty = True
+                self.needs_compaction = True
@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Writes the settings file in a background thread.
+"""
+
+from concurrent.futures import Future
+from threading import Condition, Thread
+import time
+
+
+class PersistenceWorker(object):
+    """
+    Runs write functions in a background thread. Writes which are submitted within coalescing_window seconds of
+    each other are coalesced: only the last one is executed and the futures of all of them get its result. Call
+    flush to wait for all submitted writes and close before the program exits.
+
+    :param coalescing_window: seconds to wait for another write before writing
+    :type coalescing_window: float
+    """
+    def __init__(self, coalescing_window=0.25):
+        self.coalescing_window = coalescing_window
+        self.condition = Condition()
+        self.pending_write = None
+        self.pending_futures = []
+        self.last_submit = 0.0
+        self.flush_requested = False
+        self.writing = False
+        self.closed = False
+        self.thread = Thread(target=self.run, name="PersistenceWorker", daemon=True)
+        self.thread.start()
+
+    def submit(self, write):
+        """
+        Schedules a write. A write which is still pending is replaced.
+
+        :param write: function without parameters which does the write
+        :type write: function
+        :return: future which is resolved when the write (or a later write replacing it) is done
+        :rtype: concurrent.futures.Future
+        """
+        future = Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("The persistence worker is closed.")
+            self.pending_write = write
+            self.pending_futures.append(future)
+            self.last_submit = time.monotonic()
+            self.condition.notify_all()
+        return future
+
+    def run(self):
+        """
+        The loop of the worker thread.
+        """
+        while True:
+            with self.condition:
+                while self.pending_write is None and not self.closed:
+                    self.condition.wait()
+                if self.pending_write is None:
+                    return
+                while not self.flush_requested and not self.closed:
+                    remaining = self.last_submit + self.coalescing_window - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                write = self.pending_write
+                futures = self.pending_futures
+                self.pending_write = None
+                self.pending_futures = []
+                self.flush_requested = False
+                self.writing = True
+            try:
+                result = write()
+                for future in futures:
+                    future.set_result(result)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+            finally:
+                with self.condition:
+                    self.writing = False
+                    self.condition.notify_all()
+
+    def has_pending_write(self):
+        """
+        Checks if a write is waiting or running.
+
+        :return: is there a pending write?
+        :rtype: bool
+        """
+        with self.condition:
+            return self.pending_write is not None or self.writing
+
+    def flush(self):
+        """
+        Starts a pending write immediately and waits until all submitted writes are done.
+        """
+        with self.condition:
+            if self.pending_write is not None:
+                self.flush_requested = True
+                self.condition.notify_all()
+            while (self.pending_write is not None or self.writing) and self.thread.is_alive():
+                self.condition.wait()
+
+    def close(self):
+        """
+        Flushes and stops the worker thread. Calling it again does nothing.
+        """
+        self.flush()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
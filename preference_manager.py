@@ -4,13 +4,51 @@
 The preference manager handles the access to the settings file.
 """
 import os
+import tempfile
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 PASSWORD_SETTINGS_FILE = os.path.expanduser('~/.ctSESAM.pws')
+FOOTER_MAGIC = b'CTSK'
+FOOTER_VERSION = 1
+FOOTER_LENGTH = 21
+
+win32_modules = None
+
+
+# noinspection PyUnresolvedReferences
+def get_win32_modules():
+    """
+    Imports win32api and win32con once. On other platforms the failed import is remembered too.
+
+    :return: win32api and win32con or None
+    :rtype: (module, module)
+    """
+    global win32_modules
+    if win32_modules is None:
+        try:
+            import win32con
+            import win32api
+            win32_modules = (win32api, win32con)
+        except ImportError:
+            win32_modules = ()
+    return win32_modules or None
 
 
 class PreferenceManager(object):
     """
+    The file starts with 32 bytes salt followed by the 112 bytes kgk block and the encrypted settings. Newer files
+    end with a footer of 21 bytes: the magic CTSK, a version byte and a 16 bytes key check value. The encrypted
+    settings always have a multiple of 16 bytes so the footer can not be mistaken for settings data. Files without
+    footer can still be read. The version byte is the version of the settings container (see settings_container).
 
+    Several processes can use the same file. Writers hold an advisory lock on the file settings_file + '.lock'
+    while they read, merge and write. The settings log (see settings_log) is stored in settings_file + '.log'.
+    has_changed_on_disk compares the stat of the file with the stat of the last read or write so the file is only
+    read again if another process changed it.
 
     :param settings_file: Filename of the settings file. Defaults to PASSWORD_SETTINGS_FILE as defined in the source
     :type settings_file: str
@@ -18,6 +56,9 @@ class PreferenceManager(object):
     def __init__(self, settings_file=PASSWORD_SETTINGS_FILE):
         self.data = b''
         self.settings_file = settings_file
+        self.lock_file = settings_file + '.lock'
+        self.log_file = settings_file + '.log'
+        self.file_stat = None
         self.read_file()
 
     def read_file(self):
@@ -27,6 +68,70 @@ class PreferenceManager(object):
         if os.path.isfile(self.settings_file):
             with open(self.settings_file, 'rb') as f:
                 self.data = f.read()
+                self.file_stat = self.get_file_stat(os.fstat(f.fileno()))
+        else:
+            self.file_stat = None
+
+    @staticmethod
+    def get_file_stat(stat_result):
+        """
+        Extracts the values which change when a file is written or replaced.
+
+        :param stat_result: result of os.stat
+        :type stat_result: os.stat_result
+        :return: modification time, size and inode
+        :rtype: (int, int, int)
+        """
+        return stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino
+
+    def update_file_stat(self):
+        """
+        Remembers the stat of the file after this process wrote it.
+        """
+        try:
+            self.file_stat = self.get_file_stat(os.stat(self.settings_file))
+        except OSError:
+            self.file_stat = None
+
+    def has_changed_on_disk(self):
+        """
+        Checks with a single stat if the file was changed since this process read or wrote it.
+
+        :return: changed?
+        :rtype: bool
+        """
+        try:
+            return self.get_file_stat(os.stat(self.settings_file)) != self.file_stat
+        except OSError:
+            return self.file_stat is not None
+
+    def reload_if_changed(self):
+        """
+        Reads the file again if another process changed it.
+
+        :return: was it reloaded?
+        :rtype: bool
+        """
+        if not self.has_changed_on_disk():
+            return False
+        self.read_file()
+        return True
+
+    @contextmanager
+    def locked(self):
+        """
+        Holds an exclusive advisory lock on the lock file while the with block runs. Without fcntl (Windows) no
+        lock is taken.
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_file, 'a') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
 
     def get_salt(self):
         """
@@ -57,6 +162,7 @@ class PreferenceManager(object):
                 f.write(salt)
         self.data = salt + self.data[32:]
         self.set_hidden()
+        self.update_file_stat()
 
     def get_kgk_block(self):
         """
@@ -88,6 +194,85 @@ class PreferenceManager(object):
                 f.write(kgk_block)
         self.data = self.data[:32] + kgk_block + self.data[144:]
         self.set_hidden()
+        self.update_file_stat()
+
+    def has_footer(self):
+        """
+        Checks if the data ends with a footer.
+
+        :return: is there a footer?
+        :rtype: bool
+        """
+        return len(self.data) >= 144 + FOOTER_LENGTH and (len(self.data) - 144 - FOOTER_LENGTH) % 16 == 0 and \
+            self.data[-FOOTER_LENGTH:-FOOTER_LENGTH+4] == FOOTER_MAGIC
+
+    def get_footer(self):
+        """
+        Returns the footer or an empty bytes object if there is none.
+
+        :return: the footer
+        :rtype: bytes
+        """
+        if self.has_footer():
+            return self.data[-FOOTER_LENGTH:]
+        return b''
+
+    def get_key_check_value(self):
+        """
+        Reads the key check value from the footer.
+
+        :return: 16 bytes key check value or b'' for files without footer
+        :rtype: bytes
+        """
+        return self.get_footer()[5:]
+
+    def get_container_version(self):
+        """
+        Reads the version of the settings container from the footer.
+
+        :return: the version (1 for files without footer)
+        :rtype: int
+        """
+        footer = self.get_footer()
+        if len(footer) > 0:
+            return footer[4]
+        return FOOTER_VERSION
+
+    def store_key_check_value(self, key_check_value):
+        """
+        Writes the footer with the key check value at the end of the file. The container version is kept. The file
+        is written with commit so it is never left half written.
+
+        :param key_check_value: 16 bytes key check value
+        :type key_check_value: bytes
+        """
+        if type(key_check_value) != bytes:
+            raise TypeError("The key check value must be bytes.")
+        if len(key_check_value) != 16:
+            raise ValueError("The key check value has to be 16 bytes.")
+        header = self.data[:144]
+        if len(header) < 144:
+            header += b'\x00'*(144-len(header))
+        self.commit(header[:32], header[32:], self.get_settings_data(), key_check_value,
+                    self.get_container_version())
+
+    def store_kgk(self, salt, kgk_block, key_check_value):
+        """
+        Writes the salt, the kgk_block and the key check value in one commit. The settings data and the container
+        version are kept.
+
+        :param salt: 32 bytes salt
+        :type salt: bytes
+        :param kgk_block: 112 bytes encrypted kgk data
+        :type kgk_block: bytes
+        :param key_check_value: 16 bytes key check value
+        :type key_check_value: bytes
+        """
+        if type(key_check_value) != bytes:
+            raise TypeError("The key check value must be bytes.")
+        if len(key_check_value) != 16:
+            raise ValueError("The key check value has to be 16 bytes.")
+        self.commit(salt, kgk_block, self.get_settings_data(), key_check_value, self.get_container_version())
 
     def get_settings_data(self):
         """
@@ -96,37 +281,116 @@ class PreferenceManager(object):
         :return: encrypted settings
         :rtype: bytes
         """
+        if self.has_footer():
+            return self.data[144:-FOOTER_LENGTH]
         return self.data[144:]
 
     def store_settings_data(self, settings_data):
         """
-        Writes the settings data after byte 144.
+        Writes the settings data after byte 144. An existing footer is kept.
 
         :param settings_data: encrypted settings data
         :type settings_data: bytes
         """
         if type(settings_data) != bytes:
             raise TypeError("The kgk_block must be bytes.")
+        footer = self.get_footer()
         if os.path.isfile(self.settings_file):
             with open(self.settings_file, 'rb+') as f:
                 f.seek(144)
                 f.write(settings_data)
+                f.write(footer)
                 f.truncate()
         else:
             with open(self.settings_file, 'wb') as f:
                 f.write(b'\x00'*144)
                 f.write(settings_data)
-        self.data = self.data[:144] + settings_data
+                f.write(footer)
+        self.data = self.data[:144] + settings_data + footer
         self.set_hidden()
+        self.update_file_stat()
 
-    # noinspection PyUnresolvedReferences
-    def set_hidden(self):
+    def commit(self, salt, kgk_block, settings_data, key_check_value=None, container_version=FOOTER_VERSION):
         """
-        Hides the settings file if possible.
+        Writes the whole file at once. The data is written to a temporary file in the same directory which is
+        synced to the disk and then renamed over the settings file. The settings file is therefore always either
+        complete and old or complete and new.
+
+        :param salt: 32 bytes salt
+        :type salt: bytes
+        :param kgk_block: 112 bytes encrypted kgk data
+        :type kgk_block: bytes
+        :param settings_data: encrypted settings data
+        :type settings_data: bytes
+        :param key_check_value: 16 bytes key check value (None writes no footer)
+        :type key_check_value: bytes
+        :param container_version: version of the settings container which is written into the footer
+        :type container_version: int
         """
+        if type(salt) != bytes or type(kgk_block) != bytes or type(settings_data) != bytes:
+            raise TypeError("Salt, kgk_block and settings data must be bytes.")
+        if len(salt) != 32:
+            raise ValueError("The salt has to be 32 bytes.")
+        if len(kgk_block) != 112:
+            raise ValueError("The kgk_block has to be 112 bytes.")
+        data = salt + kgk_block + settings_data
+        if key_check_value is not None:
+            if len(key_check_value) != 16:
+                raise ValueError("The key check value has to be 16 bytes.")
+            data += FOOTER_MAGIC + bytes([container_version]) + key_check_value
+        elif container_version != FOOTER_VERSION:
+            raise ValueError("The container version needs a footer.")
+        directory = os.path.dirname(os.path.abspath(self.settings_file))
+        file_descriptor, temporary_file = tempfile.mkstemp(prefix='.ctSESAM', suffix='.tmp', dir=directory)
         try:
-            import win32con
-            import win32api
-            win32api.SetFileAttributes(self.settings_file, win32con.FILE_ATTRIBUTE_HIDDEN)
-        except ImportError:
+            with os.fdopen(file_descriptor, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self.set_normal()
+            os.replace(temporary_file, self.settings_file)
+        except BaseException:
+            if os.path.isfile(temporary_file):
+                os.remove(temporary_file)
+            raise
+        self.sync_directory(directory)
+        self.data = data
+        self.set_hidden()
+        self.update_file_stat()
+
+    @staticmethod
+    def sync_directory(directory):
+        """
+        Syncs the directory entry after a rename if the platform supports it.
+
+        :param directory: the directory
+        :type directory: str
+        """
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+        try:
+            file_descriptor = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        except OSError:
+            return
+        try:
+            os.fsync(file_descriptor)
+        except OSError:
             pass
+        finally:
+            os.close(file_descriptor)
+
+    def set_hidden(self):
+        """
+        Hides the settings file if possible.
+        """
+        win32 = get_win32_modules()
+        if win32:
+            win32[0].SetFileAttributes(self.settings_file, win32[1].FILE_ATTRIBUTE_HIDDEN)
+
+    def set_normal(self):
+        """
+        Removes the hidden attribute so the file can be replaced.
+        """
+        win32 = get_win32_modules()
+        if win32 and os.path.isfile(self.settings_file):
+            win32[0].SetFileAttributes(self.settings_file, win32[1].FILE_ATTRIBUTE_NORMAL)
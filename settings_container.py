@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Formats of the encrypted settings data in the settings file.
+
+Version 1 encrypts everything at once: the packed sync settings followed by the compressed settings JSON.
+
+Version 2 starts with a block of 16 bytes which contains the length of the encrypted index. The index is
+encrypted like version 1 but it contains only the domains with the positions of their records, the frecency and
+the tombstones. The records follow the index. Each record is encrypted separately with a random records key and
+its own iv. The records key is stored in the index. Therefore the domain list is available after decrypting the
+index and a record is only decrypted when it is needed.
+
+Version 3 is stored in a database (see sqlite_preference_manager). The settings data has the format of version 1
+but its settings are empty. It only contains the sync settings, the frecency and the tombstones. Every setting is
+a row with an encrypted record and encrypted metadata (domain, modification date and synced flag). The rows are
+found by a blind index: an HMAC of the domain. The keys for the records and the blind index are derived from the
+kgk.
+"""
+
+from collections import OrderedDict
+from base64 import b64encode, b64decode
+from hashlib import sha256
+import hmac
+import json
+import struct
+import os
+from crypter import Crypter
+from packer import Packer
+
+CONTAINER_VERSION_1 = 1
+CONTAINER_VERSION_2 = 2
+CONTAINER_VERSION_3 = 3
+INDEX_HEADER_LENGTH = 16
+
+
+def encode_settings(settings_crypter, sync_settings, data):
+    """
+    Encrypts the packed sync settings and a dictionary like version 1 does.
+
+    :param settings_crypter: the settings crypter
+    :type settings_crypter: Crypter
+    :param sync_settings: packed sync settings
+    :type sync_settings: bytes
+    :param data: the settings or the index
+    :type data: dict
+    :return: encrypted data
+    :rtype: bytes
+    """
+    return settings_crypter.encrypt(struct.pack('!I', len(sync_settings)) + sync_settings +
+                                    Packer.compress(json.dumps(data)))
+
+
+def decode_settings(settings_crypter, encrypted_settings):
+    """
+    Decrypts data which was encrypted with encode_settings.
+
+    :param settings_crypter: the settings crypter
+    :type settings_crypter: Crypter
+    :param encrypted_settings: encrypted data
+    :type encrypted_settings: bytes
+    :return: packed sync settings and the dictionary
+    :rtype: (bytes, dict)
+    """
+    decrypted_settings = settings_crypter.decrypt(encrypted_settings)
+    sync_settings_len = struct.unpack('!I', decrypted_settings[0:4])[0]
+    if len(decrypted_settings) < sync_settings_len+44:
+        raise ValueError("The decrypted settings are too short.")
+    decompressed_settings = Packer.decompress(decrypted_settings[4+sync_settings_len:])
+    if len(decompressed_settings) <= 0:
+        raise PermissionError("Wrong password: The settings could not decompress.")
+    return decrypted_settings[4:4+sync_settings_len], json.loads(str(decompressed_settings, encoding='utf-8'))
+
+
+def create_records_key():
+    """
+    Creates a random key for the records.
+
+    :return: 32 bytes key
+    :rtype: bytes
+    """
+    return os.urandom(32)
+
+
+def encrypt_record(records_key, data_set):
+    """
+    Encrypts a single record with a fresh iv.
+
+    :param records_key: the records key
+    :type records_key: bytes
+    :param data_set: the record
+    :type data_set: dict
+    :return: iv and ciphertext
+    :rtype: bytes
+    """
+    iv = Crypter.createIv()
+    return iv + Crypter(records_key + iv).encrypt(Packer.compress(json.dumps(data_set)))
+
+
+def decrypt_record(records_key, encrypted_record):
+    """
+    Decrypts a single record.
+
+    :param records_key: the records key
+    :type records_key: bytes
+    :param encrypted_record: iv and ciphertext
+    :type encrypted_record: bytes
+    :return: the record
+    :rtype: dict
+    """
+    decrypted_record = Crypter(records_key + encrypted_record[:16]).decrypt(encrypted_record[16:])
+    return json.loads(str(Packer.decompress(decrypted_record), encoding='utf-8'))
+
+
+def encode_container(settings_crypter, sync_settings, records_key, records, extras):
+    """
+    Creates version 2 settings data.
+
+    :param settings_crypter: the settings crypter for the index
+    :type settings_crypter: Crypter
+    :param sync_settings: packed sync settings
+    :type sync_settings: bytes
+    :param records_key: the records key
+    :type records_key: bytes
+    :param records: encrypted record, modification date and synced flag by domain
+    :type records: OrderedDict
+    :param extras: other entries of the index (frecency, tombstones)
+    :type extras: dict
+    :return: settings data
+    :rtype: bytes
+    """
+    index_records = []
+    encrypted_records = []
+    offset = 0
+    for domain, (encrypted_record, m_date, synced) in records.items():
+        index_records.append([domain, offset, len(encrypted_record), m_date, synced])
+        encrypted_records.append(encrypted_record)
+        offset += len(encrypted_record)
+    index = dict(extras)
+    index['recordsKey'] = str(b64encode(records_key), encoding='utf-8')
+    index['records'] = index_records
+    encrypted_index = encode_settings(settings_crypter, sync_settings, index)
+    return struct.pack('!I', len(encrypted_index)) + b'\x00'*(INDEX_HEADER_LENGTH-4) + encrypted_index + \
+        b''.join(encrypted_records)
+
+
+def decode_container(settings_crypter, settings_data):
+    """
+    Decrypts the index of version 2 settings data. The records stay encrypted.
+
+    :param settings_crypter: the settings crypter for the index
+    :type settings_crypter: Crypter
+    :param settings_data: settings data
+    :type settings_data: bytes
+    :return: packed sync settings, records key, encrypted record with modification date and synced flag by domain
+             and the other entries of the index
+    :rtype: (bytes, bytes, OrderedDict, dict)
+    """
+    index_length = struct.unpack('!I', settings_data[0:4])[0]
+    records_start = INDEX_HEADER_LENGTH + index_length
+    if len(settings_data) < records_start:
+        raise ValueError("The settings data is too short.")
+    sync_settings, index = decode_settings(settings_crypter, settings_data[INDEX_HEADER_LENGTH:records_start])
+    records = OrderedDict()
+    for domain, offset, length, m_date, synced in index.pop('records'):
+        records[domain] = (settings_data[records_start+offset:records_start+offset+length], m_date, synced)
+    records_key = b64decode(index.pop('recordsKey'))
+    return sync_settings, records_key, records, index
+
+
+def derive_row_keys(kgk):
+    """
+    Derives the records key and the blind index key of version 3 from the kgk.
+
+    :param kgk: the kgk
+    :type kgk: bytes
+    :return: records key and blind index key
+    :rtype: (bytes, bytes)
+    """
+    return hmac.new(kgk, b"c't SESAM records", sha256).digest(), \
+        hmac.new(kgk, b"c't SESAM blind index", sha256).digest()
+
+
+def create_blind_index(index_key, domain):
+    """
+    Creates the blind index of a domain.
+
+    :param index_key: the blind index key
+    :type index_key: bytes
+    :param domain: the domain
+    :type domain: str
+    :return: 32 bytes blind index
+    :rtype: bytes
+    """
+    return hmac.new(index_key, domain.encode('utf-8'), sha256).digest()
@@ -0,0 +1,212 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+An append-only log of changed settings next to the settings file. Two keys are derived from the records key of the
+version 2 container: every entry is encrypted with the encryption key and followed by an HMAC with the MAC key of the
+previous HMAC and the encrypted entry. The chain starts with a seed which is derived from the settings data of the
+settings file. A log which was written for an
+older settings file or which ends with a torn write is therefore only read up to the last valid entry.
+"""
+
+from hashlib import sha256
+from threading import Lock
+import hmac
+import struct
+import os
+from settings_container import encrypt_record, decrypt_record
+
+COMPACTION_SIZE = 256*1024
+COMPACTION_RATIO = 1.0
+
+
+def derive_log_keys(records_key):
+    """
+    Derives the encryption key and the MAC key of the log from the records key so no key is used for both.
+
+    :param records_key: the records key
+    :type records_key: bytes
+    :return: encryption key and MAC key
+    :rtype: (bytes, bytes)
+    """
+    return hmac.new(records_key, b"c't SESAM log encryption", sha256).digest(), \
+        hmac.new(records_key, b"c't SESAM log mac", sha256).digest()
+
+
+class SettingsLog(object):
+    """
+    Reads and appends entries of the log. The end of the chain is remembered so appending does not read the log
+    again unless another process changed it.
+
+    :param log_file: filename of the log
+    :type log_file: str
+    """
+    def __init__(self, log_file):
+        self.log_file = log_file
+        self.lock = Lock()
+        self.seed = None
+        self.size = 0
+        self.last_mac = None
+        self.file_stat = None
+
+    @staticmethod
+    def create_seed(records_key, settings_data):
+        """
+        Creates the start of the chain for the settings data of a settings file.
+
+        :param records_key: the records key
+        :type records_key: bytes
+        :param settings_data: the settings data of the settings file
+        :type settings_data: bytes
+        :return: 32 bytes seed
+        :rtype: bytes
+        """
+        mac_key = derive_log_keys(records_key)[1]
+        return hmac.new(mac_key, sha256(settings_data).digest(), sha256).digest()
+
+    @staticmethod
+    def get_file_stat(stat_result):
+        """
+        Extracts the values which change when the log is written.
+
+        :param stat_result: result of os.stat
+        :type stat_result: os.stat_result
+        :return: modification time, size and inode
+        :rtype: (int, int, int)
+        """
+        return stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino
+
+    def exists(self):
+        """
+        Checks if there is a log file.
+
+        :return: exists?
+        :rtype: bool
+        """
+        return os.path.isfile(self.log_file)
+
+    def get_size(self):
+        """
+        Returns the size of the log file.
+
+        :return: size in bytes
+        :rtype: int
+        """
+        try:
+            return os.path.getsize(self.log_file)
+        except OSError:
+            return 0
+
+    def has_changed_on_disk(self):
+        """
+        Checks if the log was changed since it was read or written by this object.
+
+        :return: changed?
+        :rtype: bool
+        """
+        try:
+            return self.get_file_stat(os.stat(self.log_file)) != self.file_stat
+        except OSError:
+            return self.file_stat is not None
+
+    def read(self, records_key, seed):
+        """
+        Reads all entries of the chain which starts with the seed.
+
+        :param records_key: the records key
+        :type records_key: bytes
+        :param seed: the seed from create_seed
+        :type seed: bytes
+        :return: the entries
+        :rtype: [dict]
+        """
+        with self.lock:
+            return self.read_entries(records_key, seed)
+
+    def read_entries(self, records_key, seed):
+        """
+        Reads the entries without taking the lock. Reading stops at the first entry which does not continue the
+        chain.
+
+        :param records_key: the records key
+        :type records_key: bytes
+        :param seed: the seed from create_seed
+        :type seed: bytes
+        :return: the entries
+        :rtype: [dict]
+        """
+        encryption_key, mac_key = derive_log_keys(records_key)
+        data = b''
+        self.file_stat = None
+        if os.path.isfile(self.log_file):
+            with open(self.log_file, 'rb') as f:
+                data = f.read()
+                self.file_stat = self.get_file_stat(os.fstat(f.fileno()))
+        entries = []
+        last_mac = seed
+        position = 0
+        while position + 4 <= len(data):
+            length = struct.unpack('!I', data[position:position+4])[0]
+            end = position + 4 + length + 32
+            if length < 32 or length % 16 != 0 or end > len(data):
+                break
+            encrypted_entry = data[position+4:position+4+length]
+            mac = hmac.new(mac_key, last_mac + encrypted_entry, sha256).digest()
+            if not hmac.compare_digest(mac, data[end-32:end]):
+                break
+            entries.append(decrypt_record(encryption_key, encrypted_entry))
+            last_mac = mac
+            position = end
+        self.seed = seed
+        self.size = position
+        self.last_mac = last_mac
+        return entries
+
+    def append(self, records_key, seed, entries):
+        """
+        Appends entries to the chain which starts with the seed. Invalid data at the end of the log is overwritten.
+        The log is synced to the disk.
+
+        :param records_key: the records key
+        :type records_key: bytes
+        :param seed: the seed from create_seed
+        :type seed: bytes
+        :param entries: the entries
+        :type entries: [dict]
+        """
+        with self.lock:
+            if self.seed != seed or self.has_changed_on_disk():
+                self.read_entries(records_key, seed)
+            encryption_key, mac_key = derive_log_keys(records_key)
+            data = b''
+            last_mac = self.last_mac
+            for entry in entries:
+                encrypted_entry = encrypt_record(encryption_key, entry)
+                last_mac = hmac.new(mac_key, last_mac + encrypted_entry, sha256).digest()
+                data += struct.pack('!I', len(encrypted_entry)) + encrypted_entry + last_mac
+            with open(self.log_file, 'r+b' if os.path.isfile(self.log_file) else 'wb') as f:
+                f.seek(self.size)
+                f.write(data)
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+                self.file_stat = self.get_file_stat(os.fstat(f.fileno()))
+            self.size += len(data)
+            self.last_mac = last_mac
+
+    def reset(self, seed):
+        """
+        Empties the log after the settings file was written. The file is kept if it exists.
+
+        :param seed: the seed of the new settings file
+        :type seed: bytes
+        """
+        with self.lock:
+            self.file_stat = None
+            if os.path.isfile(self.log_file):
+                with open(self.log_file, 'wb') as f:
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self.file_stat = self.get_file_stat(os.fstat(f.fileno()))
+            self.seed = seed
+            self.size = 0
+            self.last_mac = seed
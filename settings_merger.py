@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Merges local settings with settings from the sync server. Every modification date is parsed only once and the
+records are joined by domain in a single pass.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+import calendar
+import time
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def parse_date(date_string):
+    """
+    Parses a date like 2015-07-12T14:46:11 into seconds since the epoch. The dates have no time zone so they are
+    compared as if they were UTC.
+
+    :param date_string: the date
+    :type date_string: str
+    :return: seconds since the epoch
+    :rtype: int
+    """
+    if len(date_string) == 19 and date_string[4] == '-' and date_string[7] == '-' and date_string[10] == 'T' and \
+       date_string[13] == ':' and date_string[16] == ':':
+        return calendar.timegm((int(date_string[0:4]), int(date_string[5:7]), int(date_string[8:10]),
+                                int(date_string[11:13]), int(date_string[14:16]), int(date_string[17:19])))
+    return calendar.timegm(time.strptime(date_string, DATE_FORMAT))
+
+
+def datetime_to_timestamp(date):
+    """
+    Converts a datetime from a PasswordSetting into seconds since the epoch like parse_date.
+
+    :param date: the date
+    :type date: datetime
+    :return: seconds since the epoch
+    :rtype: int
+    """
+    return calendar.timegm(date.timetuple())
+
+
+def get_record_date(data_set):
+    """
+    Returns the modification date of a record. Records without a date are older than all others.
+
+    :param data_set: a record
+    :type data_set: dict
+    :return: seconds since the epoch
+    :rtype: int
+    """
+    if 'mDate' in data_set:
+        return parse_date(data_set['mDate'])
+    return 0
+
+
+def is_tombstone(data_set):
+    """
+    Checks if a record marks a deleted domain.
+
+    :param data_set: a record
+    :type data_set: dict
+    :return: is it a tombstone?
+    :rtype: bool
+    """
+    return bool(data_set.get('deleted'))
+
+
+class MergeDelta(namedtuple('MergeDelta', ['added', 'updated', 'deleted', 'needs_push'])):
+    """
+    The result of a merge: the domains which have to be added, updated or deleted locally and whether the sync
+    server needs the local settings.
+    """
+    __slots__ = ()
+
+    def has_local_changes(self):
+        """
+        Checks if the local settings change.
+
+        :return: are there local changes?
+        :rtype: bool
+        """
+        return len(self.added) > 0 or len(self.updated) > 0 or len(self.deleted) > 0
+
+
+def merge(local_dates, remote_data, unsynced_domains=(), tombstones=None):
+    """
+    Joins the local settings and the remote records by domain. The newer record wins. A remote tombstone deletes
+    an older local setting and remote tombstones of unknown domains are ignored. A local tombstone keeps an older
+    remote record from being added again. The server needs a push if a local setting or tombstone is newer, missing
+    on the server or not synced.
+
+    :param local_dates: modification dates of the local settings in seconds since the epoch by domain
+    :type local_dates: dict
+    :param remote_data: records from the sync server by domain
+    :type remote_data: dict
+    :param unsynced_domains: domains with local changes which were not pushed yet
+    :type unsynced_domains: list
+    :param tombstones: modification dates of locally deleted domains
+    :type tombstones: dict
+    :return: the delta
+    :rtype: MergeDelta
+    """
+    if tombstones is None:
+        tombstones = {}
+    added = []
+    updated = []
+    deleted = []
+    needs_push = len(unsynced_domains) > 0
+    for domain, data_set in remote_data.items():
+        local_date = local_dates.get(domain)
+        if local_date is None:
+            if is_tombstone(data_set):
+                continue
+            if domain in tombstones and parse_date(tombstones[domain]) >= get_record_date(data_set):
+                needs_push = True
+            else:
+                added.append(domain)
+            continue
+        remote_date = get_record_date(data_set)
+        if remote_date > local_date:
+            if is_tombstone(data_set):
+                deleted.append(domain)
+            else:
+                updated.append(domain)
+        elif local_date > remote_date:
+            needs_push = True
+    if not needs_push:
+        needs_push = any(domain not in remote_data for domain in local_dates)
+    return MergeDelta(added, updated, deleted, needs_push)
+
+
+def create_export_data(local_data, remote_data, tombstones=None):
+    """
+    Creates the records for the sync server: the local records and tombstones for deleted domains. Remote
+    tombstones which are newer than the local record replace it. Remote records of domains which were deleted
+    locally are replaced by a tombstone with the deletion date (or the remote date if it is unknown).
+
+    :param local_data: local records by domain
+    :type local_data: dict
+    :param remote_data: records from the sync server by domain
+    :type remote_data: dict
+    :param tombstones: modification dates of locally deleted domains
+    :type tombstones: dict
+    :return: records by domain
+    :rtype: dict
+    """
+    if tombstones is None:
+        tombstones = {}
+    export_data = dict(local_data)
+    for domain, data_set in remote_data.items():
+        if domain in export_data:
+            if is_tombstone(data_set) and get_record_date(data_set) > get_record_date(export_data[domain]):
+                export_data[domain] = data_set
+        elif is_tombstone(data_set):
+            export_data[domain] = data_set
+        else:
+            m_date = tombstones.get(domain, data_set.get('mDate', datetime.now().strftime(DATE_FORMAT)))
+            export_data[domain] = {
+                'mDate': m_date,
+                'deleted': True
+            }
+    for domain, m_date in tombstones.items():
+        if domain not in export_data:
+            export_data[domain] = {
+                'mDate': m_date,
+                'deleted': True
+            }
+    return export_data
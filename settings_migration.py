@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Migrates the settings file to a SQLite database. Run it with ``python3 settings_migration.py``. The settings file
+is not changed.
+"""
+
+import argparse
+import getpass
+from crypter import Crypter
+from kgk_manager import KgkManager
+from preference_manager import PreferenceManager, PASSWORD_SETTINGS_FILE
+from sqlite_preference_manager import SQLitePreferenceManager, PASSWORD_SETTINGS_DATABASE
+from password_settings_manager import PasswordSettingsManager
+
+
+def migrate_to_database(password, settings_file=PASSWORD_SETTINGS_FILE, database_file=PASSWORD_SETTINGS_DATABASE):
+    """
+    Copies the kgk block, the settings, the sync settings, the frecency and the tombstones from the settings file
+    to a new database. The kgk and the masterpassword stay the same.
+
+    :param password: the masterpassword
+    :type password: bytes
+    :param settings_file: the settings file
+    :type settings_file: str
+    :param database_file: the database
+    :type database_file: str
+    :return: number of migrated settings
+    :rtype: int
+    """
+    preference_manager = PreferenceManager(settings_file)
+    if len(preference_manager.get_kgk_block()) != 112:
+        raise ValueError("There are no settings in " + settings_file + ".")
+    kgk_manager = KgkManager()
+    kgk_manager.decrypt_kgk(preference_manager.get_kgk_block(),
+                            Crypter(Crypter.createIvKey(password, preference_manager.get_salt())),
+                            key_check_value=preference_manager.get_key_check_value())
+    kgk_manager.salt = preference_manager.get_salt()
+    settings_manager = PasswordSettingsManager(preference_manager)
+    settings_manager.load_local_settings(kgk_manager)
+    database = SQLitePreferenceManager(database_file)
+    try:
+        if len(database.get_kgk_block()) == 112:
+            raise ValueError("The database " + database_file + " already contains settings.")
+        kgk_manager.set_preference_manager(database)
+        kgk_manager.store_local_kgk_block()
+        database_settings_manager = PasswordSettingsManager(database)
+        for domain_name in settings_manager.get_domain_list():
+            database_settings_manager.set_setting(settings_manager.get_setting(domain_name))
+        database_settings_manager.frecency = settings_manager.frecency
+        database_settings_manager.tombstones = dict(settings_manager.tombstones)
+        database_settings_manager.sync_manager = settings_manager.sync_manager
+        database_settings_manager.store_local_settings(kgk_manager)
+        return len(database_settings_manager.get_domain_list())
+    finally:
+        database.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate the settings file to a SQLite database.")
+    parser.add_argument('--settings-file', default=PASSWORD_SETTINGS_FILE, help="The settings file.")
+    parser.add_argument('--database', default=PASSWORD_SETTINGS_DATABASE, help="The new database.")
+    args = parser.parse_args()
+    count = migrate_to_database(getpass.getpass("Masterpassword: ").encode('utf-8'),
+                                args.settings_file, args.database)
+    print(str(count) + " settings migrated to " + args.database)
@@ -0,0 +1,808 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+The storages of the PasswordSettingsManager. There is a storage for every container version (see
+settings_container). It loads settings data of its version into the manager, collects the changes for a save and
+writes them.
+
+All storages share a small interface: load, create_write, decode_stored, merge_record, remove_deleted and
+reload_log. The manager loads with the storage of the version in the file and saves with the storage of its own
+container version. The files of the two versions can differ: merge_stored_settings decodes the file with the
+storage of its version and merges the records into a snapshot of this storage.
+"""
+
+from collections import OrderedDict
+from crypter import Crypter
+from frecency_tracker import FrecencyTracker
+from password_setting import PasswordSetting
+from settings_merger import parse_date, datetime_to_timestamp
+from settings_container import encode_settings, decode_settings, encode_container, decode_container, \
+    encrypt_record, decrypt_record, derive_row_keys, create_blind_index, \
+    CONTAINER_VERSION_1, CONTAINER_VERSION_2, CONTAINER_VERSION_3
+from settings_log import SettingsLog
+
+
+class SettingsStorage(object):
+    """
+    Base class of the storages. A storage works on the settings of its manager. Call its methods while holding
+    the lock of the manager. The functions from create_write take the lock themselves because they may run in the
+    thread of a PersistenceWorker.
+
+    :param manager: the manager
+    :type manager: PasswordSettingsManager
+    """
+    container_version = None
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    def load(self, kgk_manager, settings_crypter, encrypted_settings):
+        """
+        Loads settings data of this version into the manager. Settings which are already in memory are updated if
+        they are newer.
+
+        :param kgk_manager: kgk manager
+        :type kgk_manager: KgkManager
+        :param settings_crypter: the settings crypter
+        :type settings_crypter: Crypter
+        :param encrypted_settings: settings data
+        :type encrypted_settings: bytes
+        """
+        raise NotImplementedError
+
+    def create_write(self, kgk_manager):
+        """
+        Collects the changes of the manager for a save and marks them as saved. The returned function writes them.
+        Later changes of the settings do not change what it writes. If the write fails the manager is dirty again.
+
+        :param kgk_manager: kgk manager
+        :type kgk_manager: KgkManager
+        :return: the write
+        :rtype: function
+        """
+        snapshot = self.create_snapshot(kgk_manager)
+        self.manager.mark_clean(snapshot['sync_settings'])
+        return lambda: self.run_write(self.write_snapshot, snapshot)
+
+    def run_write(self, write, job):
+        """
+        Runs a write and reports its result to the manager. A failed write marks the manager as dirty so the next
+        save writes all settings again.
+
+        :param write: write_snapshot or write_log_job
+        :type write: function
+        :param job: the snapshot or the job for the write
+        :type job: dict
+        :return: the result of the write
+        """
+        try:
+            result = write(job)
+        except Exception as e:
+            with self.manager.lock:
+                if self.manager.pending_full_write is job:
+                    self.manager.pending_full_write = None
+            self.manager.write_failed(e)
+            raise
+        self.manager.write_succeeded()
+        return result
+
+    def create_snapshot(self, kgk_manager):
+        """
+        Collects everything which is needed to write the settings file.
+
+        :param kgk_manager: kgk manager
+        :type kgk_manager: KgkManager
+        :return: the snapshot
+        :rtype: dict
+        """
+        if len(kgk_manager.salt) != 32:
+            raise ValueError("The salt has to be 32 bytes.")
+        kgk_manager.prepare_local_encryption()
+        snapshot = {
+            'kgk': kgk_manager.get_kgk(),
+            'kgk_crypter': kgk_manager.kgk_crypter,
+            'salt': kgk_manager.salt,
+            'kgk_block': kgk_manager.get_encrypted_kgk(),
+            'key_check_value': kgk_manager.kgk_crypter.get_key_check_value(),
+            'settings_key': kgk_manager.get_settings_key(),
+            'iv2': kgk_manager.get_iv2(),
+            'sync_settings': self.manager.sync_manager.get_binary_sync_settings()
+        }
+        self.add_records(kgk_manager, snapshot)
+        return snapshot
+
+    def add_records(self, kgk_manager, snapshot):
+        """
+        Adds the settings in the format of this version to the snapshot.
+
+        :param kgk_manager: kgk manager
+        :type kgk_manager: KgkManager
+        :param snapshot: the snapshot
+        :type snapshot: dict
+        """
+        raise NotImplementedError
+
+    def write_snapshot(self, snapshot):
+        """
+        Writes a snapshot. If another process changed the file since it was read its newer records are merged
+        first. The file is then marked as changed so reload_if_changed merges them into the manager too.
+
+        :param snapshot: a snapshot from create_snapshot
+        :type snapshot: dict
+        """
+        raise NotImplementedError
+
+    def decode_stored(self, settings_crypter, encrypted_settings):
+        """
+        Decodes settings data of this version which another process wrote.
+
+        :param settings_crypter: the settings crypter
+        :type settings_crypter: Crypter
+        :param encrypted_settings: settings data
+        :type encrypted_settings: bytes
+        :return: packed sync settings, records key (None if the records are not encrypted), record with
+                 modification date and synced flag by domain and the other settings
+        :rtype: (bytes, bytes, OrderedDict, dict)
+        """
+        raise NotImplementedError
+
+    def merge_record(self, snapshot, domain_name, record, m_date, synced, records_key):
+        """
+        Merges a stored record into a snapshot of this version if it is newer.
+
+        :param snapshot: a snapshot from create_snapshot
+        :type snapshot: dict
+        :param domain_name: the domain
+        :type domain_name: str
+        :param record: the record from decode_stored
+        :type record: dict or bytes
+        :param m_date: the modification date
+        :type m_date: str
+        :param synced: is the record synced?
+        :type synced: bool
+        :param records_key: the records key from decode_stored
+        :type records_key: bytes
+        :return: was the record merged?
+        :rtype: bool
+        """
+        raise NotImplementedError
+
+    def remove_deleted(self, snapshot, domain_name, deletion_date):
+        """
+        Removes the record of a domain from a snapshot of this version if it was not modified after the deletion.
+
+        :param snapshot: a snapshot from create_snapshot
+        :type snapshot: dict
+        :param domain_name: the deleted domain
+        :type domain_name: str
+        :param deletion_date: seconds since the epoch
+        :type deletion_date: int
+        :return: was the record removed?
+        :rtype: bool
+        """
+        raise NotImplementedError
+
+    def reload_log(self):
+        """
+        Applies the changes which another process appended to a log of the settings file. Only version 2 has one.
+
+        :return: were changes applied?
+        :rtype: bool
+        """
+        return False
+
+    def decrypt_stored_settings(self, kgk_crypter, kgk, salt):
+        """
+        Decrypts the settings file which was read by the preference manager with the storage of its version. Only
+        files with the same salt and kgk can be decrypted (see check_stored_kgk).
+
+        :param kgk_crypter: the kgk crypter
+        :type kgk_crypter: Crypter
+        :param kgk: the kgk
+        :type kgk: bytes
+        :param salt: the salt
+        :type salt: bytes
+        :return: the result of decode_stored or None if the file has no settings
+        :rtype: (bytes, bytes, OrderedDict, dict)
+        """
+        preference_manager = self.manager.preference_manager
+        kgk_block = preference_manager.get_kgk_block()
+        encrypted_settings = preference_manager.get_settings_data()
+        if len(kgk_block) != 112 or len(encrypted_settings) < 40:
+            return None
+        decrypted_kgk_block = self.manager.check_stored_kgk(kgk_crypter, kgk, salt)
+        settings_crypter = Crypter(Crypter.create_key(decrypted_kgk_block[48:112], decrypted_kgk_block[:32]) +
+                                   decrypted_kgk_block[32:48])
+        storage = self.manager.get_storage(preference_manager.get_container_version())
+        return storage.decode_stored(settings_crypter, encrypted_settings)
+
+    def merge_stored_settings(self, snapshot):
+        """
+        Merges the records of the settings file which are newer than the records in the snapshot into the
+        snapshot. The newest tombstones win and remove the records which were not modified after the deletion.
+
+        :param snapshot: a snapshot from create_snapshot
+        :type snapshot: dict
+        :return: were records merged?
+        :rtype: bool
+        """
+        stored = self.decrypt_stored_settings(snapshot['kgk_crypter'], snapshot['kgk'], snapshot['salt'])
+        if stored is None:
+            return False
+        sync_settings, stored_records_key, stored_records, stored_settings = stored
+        merged = False
+        settings = snapshot['settings']
+        tombstones = settings.setdefault('tombstones', {})
+        for domain_name, m_date in stored_settings.get('tombstones', {}).items():
+            if domain_name not in tombstones or parse_date(m_date) > parse_date(tombstones[domain_name]):
+                tombstones[domain_name] = m_date
+                merged = self.remove_deleted(snapshot, domain_name, parse_date(m_date)) or merged
+        for domain_name, (record, m_date, synced) in stored_records.items():
+            if domain_name in tombstones and parse_date(m_date) <= parse_date(tombstones[domain_name]):
+                continue
+            merged = self.merge_record(snapshot, domain_name, record, m_date, synced, stored_records_key) or merged
+        if 'frecency' in stored_settings:
+            frecency = FrecencyTracker()
+            frecency.load_from_dict(settings.get('frecency', {}))
+            frecency.load_from_dict(stored_settings['frecency'])
+            settings['frecency'] = frecency.to_dict()
+        if len(tombstones) == 0:
+            del settings['tombstones']
+        if len(snapshot['sync_settings']) == 0 and len(sync_settings) > 0:
+            snapshot['sync_settings'] = sync_settings
+            merged = True
+        return merged
+
+
+class DictStorage(SettingsStorage):
+    """
+    Version 1: the settings data is one encrypted dictionary with all settings. Loaded settings stay parsed
+    dictionaries in lazy_records. A save writes the whole file.
+    """
+    container_version = CONTAINER_VERSION_1
+
+    def load(self, kgk_manager, settings_crypter, encrypted_settings):
+        manager = self.manager
+        sync_settings, saved_settings = decode_settings(settings_crypter, encrypted_settings)
+        manager.load_extras(sync_settings, saved_settings)
+        synced_domains = set(saved_settings['synced'])
+        for domain_name, data_set in saved_settings['settings'].items():
+            if domain_name in manager.settings:
+                setting = manager.settings[domain_name]
+                if parse_date(data_set['mDate']) > datetime_to_timestamp(setting.get_m_date()):
+                    setting.load_from_dict(data_set)
+                    setting.set_synced(domain_name in synced_domains)
+                    setting.set_dirty(False)
+            elif domain_name not in manager.lazy_records:
+                manager.lazy_records[domain_name] = (data_set, data_set['mDate'], domain_name in synced_domains)
+                manager.domain_order[domain_name] = None
+                manager.domain_list = None
+            elif parse_date(data_set['mDate']) > parse_date(manager.lazy_records[domain_name][1]):
+                manager.lazy_records[domain_name] = (data_set, data_set['mDate'], domain_name in synced_domains)
+
+    def add_records(self, kgk_manager, snapshot):
+        snapshot['settings'] = self.manager.get_settings_as_dict()
+
+    def write_snapshot(self, snapshot):
+        preference_manager = self.manager.preference_manager
+        with self.manager.lock:
+            with preference_manager.locked():
+                merged = preference_manager.reload_if_changed() and self.merge_stored_settings(snapshot)
+                settings_crypter = Crypter(snapshot['settings_key'] + snapshot['iv2'])
+                preference_manager.commit(
+                    snapshot['salt'],
+                    snapshot['kgk_block'],
+                    encode_settings(settings_crypter, snapshot['sync_settings'], snapshot['settings']),
+                    snapshot['key_check_value'],
+                    self.container_version)
+                if merged:
+                    preference_manager.file_stat = None
+
+    def decode_stored(self, settings_crypter, encrypted_settings):
+        sync_settings, stored_settings = decode_settings(settings_crypter, encrypted_settings)
+        stored_records = OrderedDict(
+            (domain_name, (data_set, data_set['mDate'], domain_name in stored_settings['synced']))
+            for domain_name, data_set in stored_settings['settings'].items())
+        return sync_settings, None, stored_records, stored_settings
+
+    def merge_record(self, snapshot, domain_name, record, m_date, synced, records_key):
+        settings = snapshot['settings']
+        if domain_name in settings['settings'] and \
+           parse_date(m_date) <= parse_date(settings['settings'][domain_name]['mDate']):
+            return False
+        if records_key is not None:
+            record = decrypt_record(records_key, record)
+        settings['settings'][domain_name] = record
+        if domain_name in settings['synced']:
+            settings['synced'].remove(domain_name)
+        if synced:
+            settings['synced'].append(domain_name)
+        return True
+
+    def remove_deleted(self, snapshot, domain_name, deletion_date):
+        settings = snapshot['settings']
+        if domain_name not in settings['settings'] or \
+           parse_date(settings['settings'][domain_name]['mDate']) > deletion_date:
+            return False
+        del settings['settings'][domain_name]
+        if domain_name in settings['synced']:
+            settings['synced'].remove(domain_name)
+        return True
+
+
+class ContainerStorage(SettingsStorage):
+    """
+    Version 2: only the index is decrypted when the settings are loaded and the records stay encrypted in
+    lazy_records. Records of unchanged settings are not encrypted again when the settings are saved.
+
+    With the settings log of the manager a save appends the changed settings and the deletions to the log instead
+    of writing the whole settings file. The log is replayed when the settings are loaded. Once the log is larger
+    than compaction_size or compaction_ratio times the settings data the next save writes the whole settings file
+    again and empties the log. The persistence worker only runs the last of coalesced writes so the saves do not
+    append to the log while a snapshot of the whole file is in pending_full_write of the manager.
+    """
+    container_version = CONTAINER_VERSION_2
+
+    def load(self, kgk_manager, settings_crypter, encrypted_settings):
+        manager = self.manager
+        sync_settings, records_key, records, index = decode_container(settings_crypter, encrypted_settings)
+        manager.load_extras(sync_settings, index)
+        if manager.records_key != records_key:
+            manager.materialize_all()
+            manager.record_cache = {}
+            manager.records_key = records_key
+        manager.container_version = CONTAINER_VERSION_2
+        for domain_name, record in records.items():
+            encrypted_record, m_date, synced = record
+            if domain_name in manager.settings:
+                setting = manager.settings[domain_name]
+                if parse_date(m_date) > datetime_to_timestamp(setting.get_m_date()):
+                    setting.load_from_dict(decrypt_record(manager.records_key, encrypted_record))
+                    setting.set_synced(synced)
+                    setting.set_dirty(False)
+                    manager.record_cache[domain_name] = encrypted_record
+            elif domain_name not in manager.lazy_records:
+                manager.lazy_records[domain_name] = record
+                manager.domain_order[domain_name] = None
+                manager.domain_list = None
+            elif parse_date(m_date) > parse_date(manager.lazy_records[domain_name][1]):
+                manager.lazy_records[domain_name] = record
+        if manager.settings_log.exists():
+            manager.log_enabled = True
+            self.replay_log()
+
+    def reload_log(self):
+        if self.manager.records_key is None or not self.manager.settings_log.has_changed_on_disk():
+            return False
+        self.replay_log()
+        return True
+
+    def replay_log(self):
+        """
+        Applies the entries of the settings log which belong to the loaded settings file.
+        """
+        manager = self.manager
+        seed = SettingsLog.create_seed(manager.records_key, manager.preference_manager.get_settings_data())
+        for entry in manager.settings_log.read(manager.records_key, seed):
+            self.apply_log_entry(entry)
+
+    def apply_log_entry(self, entry):
+        """
+        Applies an entry of the settings log if it is newer than the setting in memory. Entries which were
+        already applied change nothing.
+
+        :param entry: the entry
+        :type entry: dict
+        """
+        manager = self.manager
+        domain_name = entry['domain']
+        if 'deleted' in entry:
+            if manager.has_setting(domain_name) and \
+               manager.get_record_timestamp(domain_name) <= parse_date(entry['deleted']):
+                manager.settings.pop(domain_name, None)
+                manager.lazy_records.pop(domain_name, None)
+                manager.domain_order.pop(domain_name, None)
+                manager.record_cache.pop(domain_name, None)
+                manager.tombstones[domain_name] = entry['deleted']
+                manager.domain_list = None
+            return
+        m_date = parse_date(entry['record']['mDate'])
+        if domain_name in manager.tombstones and parse_date(manager.tombstones[domain_name]) > m_date:
+            return
+        if manager.has_setting(domain_name) and manager.get_record_timestamp(domain_name) >= m_date:
+            return
+        if domain_name in manager.settings:
+            setting = manager.settings[domain_name]
+            setting.load_from_dict(entry['record'])
+        else:
+            setting = PasswordSetting(domain_name, entry['record'])
+            if manager.lazy_records.pop(domain_name, None) is None:
+                manager.domain_order[domain_name] = None
+                manager.domain_list = None
+            manager.settings[domain_name] = setting
+        setting.set_synced(entry['synced'])
+        setting.set_dirty(False)
+        manager.record_cache.pop(domain_name, None)
+        manager.tombstones.pop(domain_name, None)
+
+    def create_write(self, kgk_manager):
+        """
+        Appends to the settings log if possible. Otherwise the whole settings file is written.
+
+        :param kgk_manager: kgk manager
+        :type kgk_manager: KgkManager
+        :return: the write
+        :rtype: function
+        """
+        if not self.can_append_to_log():
+            return super(ContainerStorage, self).create_write(kgk_manager)
+        job = self.create_log_job(kgk_manager)
+        return lambda: self.run_write(self.write_log_job, job)
+
+    def can_append_to_log(self):
+        """
+        Checks if the next save can append to the settings log. Changes of the sync settings, changes which the log
+        can not express and saves with only frecency changes write the whole settings file. So does a log which is
+        larger than the compaction threshold.
+
+        :return: append?
+        :rtype: bool
+        """
+        manager = self.manager
+        if not manager.log_enabled or manager.needs_compaction or manager.pending_full_write is not None or \
+           manager.preference_manager.get_container_version() != CONTAINER_VERSION_2 or \
+           manager.sync_manager.get_binary_sync_settings() != manager.stored_sync_settings:
+            return False
+        if len(manager.pending_deletions) == 0 and not any(setting.is_dirty() for setting in manager.settings.values()):
+            return False
+        log_size = manager.settings_log.get_size()
+        return log_size < manager.compaction_size and \
+            log_size < manager.compaction_ratio * len(manager.preference_manager.get_settings_data())
+
+    def create_log_job(self, kgk_manager):
+        """
+        Collects the deletions and the changed settings for the settings log and marks them as saved. Entries of
+        earlier jobs which were not written yet are added again because the persistence worker only runs the last
+        of coalesced jobs.
+
+        :param kgk_manager: kgk manager
+        :type kgk_manager: KgkManager
+        :return: the job for write_log_job
+        :rtype: dict
+        """
+        manager = self.manager
+        entries = [{'domain': domain_name, 'deleted': m_date}
+                   for domain_name, m_date in manager.pending_deletions.items()]
+        for domain_name, setting in manager.settings.items():
+            if setting.is_dirty():
+                entries.append({'domain': domain_name, 'record': setting.to_dict(), 'synced': setting.is_synced()})
+                setting.set_dirty(False)
+                manager.record_cache.pop(domain_name, None)
+        manager.pending_deletions = {}
+        manager.dirty = False
+        manager.unwritten_log_entries.extend(entries)
+        entries = list(manager.unwritten_log_entries)
+        return {
+            'kgk': kgk_manager.get_kgk(),
+            'kgk_crypter': kgk_manager.kgk_crypter,
+            'salt': kgk_manager.salt,
+            'records_key': manager.records_key,
+            'entries': entries
+        }
+
+    def write_log_job(self, job):
+        """
+        Appends the entries of a job to the settings log while the settings file is locked. If another process
+        wrote a settings file with another records key the entries can not be appended. The next save then writes
+        the whole settings file.
+
+        :param job: a job from create_log_job
+        :type job: dict
+        :return: were the entries appended?
+        :rtype: bool
+        """
+        manager = self.manager
+        with manager.lock:
+            with manager.preference_manager.locked():
+                if manager.preference_manager.reload_if_changed():
+                    manager.preference_manager.file_stat = None
+                    stored_settings = self.decrypt_stored_settings(job['kgk_crypter'], job['kgk'], job['salt'])
+                    if stored_settings is None or stored_settings[1] != job['records_key']:
+                        manager.needs_compaction = True
+                        manager.dirty = True
+                        return False
+                seed = SettingsLog.create_seed(job['records_key'], manager.preference_manager.get_settings_data())
+                manager.settings_log.append(job['records_key'], seed, job['entries'])
+            written_entries = set(id(entry) for entry in job['entries'])
+            manager.unwritten_log_entries = [entry for entry in manager.unwritten_log_entries
+                                             if id(entry) not in written_entries]
+            return True
+
+    def add_records(self, kgk_manager, snapshot):
+        snapshot['records_key'] = self.manager.records_key
+        snapshot['records'] = self.get_records()
+        snapshot['settings'] = self.manager.get_extras()
+        self.manager.pending_full_write = snapshot
+
+    def get_records(self):
+        """
+        Returns the encrypted records of the manager. Only records of changed settings are encrypted.
+
+        :return: encrypted record, modification date and synced flag by domain
+        :rtype: OrderedDict
+        """
+        manager = self.manager
+        records = OrderedDict()
+        for domain_name in manager.get_domain_list():
+            if domain_name in manager.lazy_records:
+                record, m_date, synced = manager.lazy_records[domain_name]
+                if isinstance(record, dict):
+                    record = encrypt_record(manager.records_key, record)
+                    manager.lazy_records[domain_name] = (record, m_date, synced)
+                records[domain_name] = (record, m_date, synced)
+            else:
+                setting = manager.settings[domain_name]
+                if setting.is_dirty() or domain_name not in manager.record_cache:
+                    manager.record_cache[domain_name] = encrypt_record(manager.records_key, setting.to_dict())
+                records[domain_name] = (manager.record_cache[domain_name], setting.get_modification_date(),
+                                        setting.is_synced())
+        return records
+
+    def write_snapshot(self, snapshot):
+        """
+        Writes the whole settings file. The entries of the settings log are merged into the snapshot and the log is
+        emptied afterwards.
+
+        :param snapshot: a snapshot from create_snapshot
+        :type snapshot: dict
+        """
+        manager = self.manager
+        preference_manager = manager.preference_manager
+        with manager.lock:
+            with preference_manager.locked():
+                merged = preference_manager.reload_if_changed() and self.merge_stored_settings(snapshot)
+                log_used = manager.settings_log.exists()
+                if log_used and preference_manager.get_container_version() == CONTAINER_VERSION_2:
+                    merged = self.merge_log(snapshot) or merged
+                settings_crypter = Crypter(snapshot['settings_key'] + snapshot['iv2'])
+                settings_data = encode_container(settings_crypter, snapshot['sync_settings'],
+                                                 snapshot['records_key'], snapshot['records'], snapshot['settings'])
+                preference_manager.commit(
+                    snapshot['salt'],
+                    snapshot['kgk_block'],
+                    settings_data,
+                    snapshot['key_check_value'],
+                    self.container_version)
+                if log_used:
+                    manager.settings_log.reset(SettingsLog.create_seed(snapshot['records_key'], settings_data))
+                if merged:
+                    preference_manager.file_stat = None
+            if manager.pending_full_write is snapshot:
+                manager.pending_full_write = None
+
+    def merge_log(self, snapshot):
+        """
+        Merges the entries of the settings log which are newer than the records in the snapshot into the snapshot.
+
+        :param snapshot: a snapshot from create_snapshot
+        :type snapshot: dict
+        :return: were records merged?
+        :rtype: bool
+        """
+        seed = SettingsLog.create_seed(snapshot['records_key'], self.manager.preference_manager.get_settings_data())
+        records = snapshot['records']
+        settings = snapshot['settings']
+        merged = False
+        for entry in self.manager.settings_log.read(snapshot['records_key'], seed):
+            domain_name = entry['domain']
+            if 'deleted' in entry:
+                if domain_name in records and parse_date(records[domain_name][1]) <= parse_date(entry['deleted']):
+                    del records[domain_name]
+                    settings.setdefault('tombstones', {})[domain_name] = entry['deleted']
+                    merged = True
+                continue
+            m_date = entry['record']['mDate']
+            tombstones = settings.get('tombstones', {})
+            if domain_name in tombstones and parse_date(tombstones[domain_name]) > parse_date(m_date):
+                continue
+            if domain_name in records and parse_date(records[domain_name][1]) >= parse_date(m_date):
+                continue
+            records[domain_name] = (encrypt_record(snapshot['records_key'], entry['record']), m_date, entry['synced'])
+            tombstones.pop(domain_name, None)
+            merged = True
+        return merged
+
+    def decode_stored(self, settings_crypter, encrypted_settings):
+        return decode_container(settings_crypter, encrypted_settings)
+
+    def merge_record(self, snapshot, domain_name, record, m_date, synced, records_key):
+        records = snapshot['records']
+        if domain_name in records and parse_date(m_date) <= parse_date(records[domain_name][1]):
+            return False
+        if records_key != snapshot['records_key']:
+            if records_key is not None:
+                record = decrypt_record(records_key, record)
+            record = encrypt_record(snapshot['records_key'], record)
+        records[domain_name] = (record, m_date, synced)
+        return True
+
+    def remove_deleted(self, snapshot, domain_name, deletion_date):
+        records = snapshot['records']
+        if domain_name not in records or parse_date(records[domain_name][1]) > deletion_date:
+            return False
+        del records[domain_name]
+        return True
+
+
+class RowStorage(SettingsStorage):
+    """
+    Version 3: every setting is a row of a database (see SQLitePreferenceManager). Only the metadata of the rows is
+    decrypted when the settings are loaded. A save writes only the rows of changed and deleted settings.
+
+    The persistence worker only runs the last of coalesced writes. Therefore the rows and deletions stay in
+    unwritten_rows and unwritten_deleted_rows of the manager until a write of them is done and every snapshot
+    contains all of them. A snapshot which replaces all rows is kept in pending_full_write until it is written so
+    the snapshots taken in the meantime replace all rows too.
+
+    decode_stored does not read the rows of the database so merge_stored_settings only merges the header. Instead
+    write_snapshot skips the rows which another process changed after the snapshot was taken.
+    """
+    container_version = CONTAINER_VERSION_3
+
+    def load(self, kgk_manager, settings_crypter, encrypted_settings):
+        manager = self.manager
+        sync_settings, saved_settings = decode_settings(settings_crypter, encrypted_settings)
+        manager.load_extras(sync_settings, saved_settings)
+        manager.records_key, manager.index_key = derive_row_keys(kgk_manager.get_kgk())
+        for blind_index, meta in manager.preference_manager.get_record_index():
+            meta = decrypt_record(manager.records_key, meta)
+            domain_name = meta['domain']
+            if domain_name in manager.settings:
+                setting = manager.settings[domain_name]
+                if parse_date(meta['mDate']) > datetime_to_timestamp(setting.get_m_date()):
+                    setting.load_from_dict(decrypt_record(manager.records_key,
+                                                          manager.preference_manager.get_record(blind_index)[1]))
+                    setting.set_synced(meta['synced'])
+                    setting.set_dirty(False)
+            elif domain_name not in manager.lazy_records:
+                manager.lazy_records[domain_name] = (None, meta['mDate'], meta['synced'])
+                manager.domain_order[domain_name] = None
+                manager.domain_list = None
+            elif parse_date(meta['mDate']) > parse_date(manager.lazy_records[domain_name][1]):
+                manager.lazy_records[domain_name] = (None, meta['mDate'], meta['synced'])
+
+    def add_records(self, kgk_manager, snapshot):
+        manager = self.manager
+        manager.records_key, manager.index_key = derive_row_keys(kgk_manager.get_kgk())
+        replace_all = manager.needs_compaction or manager.pending_full_write is not None
+        if replace_all:
+            manager.materialize_all()
+            manager.unwritten_rows = OrderedDict()
+        for domain_name, row in self.get_changed_rows(replace_all).items():
+            manager.unwritten_rows[domain_name] = row
+            manager.unwritten_deleted_rows.pop(domain_name, None)
+        for domain_name, m_date in manager.pending_deletions.items():
+            manager.unwritten_deleted_rows[domain_name] = (create_blind_index(manager.index_key, domain_name), m_date)
+            manager.unwritten_rows.pop(domain_name, None)
+        snapshot['records_key'] = manager.records_key
+        snapshot['index_key'] = manager.index_key
+        snapshot['replace_all'] = replace_all
+        snapshot['unwritten_rows'] = OrderedDict(manager.unwritten_rows)
+        snapshot['unwritten_deleted_rows'] = OrderedDict(manager.unwritten_deleted_rows)
+        snapshot['rows'] = list(manager.unwritten_rows.values())
+        snapshot['deleted_rows'] = list(manager.unwritten_deleted_rows.values())
+        snapshot['settings'] = {'settings': {}, 'synced': []}
+        snapshot['settings'].update(manager.get_extras())
+        if replace_all:
+            manager.pending_full_write = snapshot
+
+    def get_changed_rows(self, all_rows=False):
+        """
+        Encrypts the rows of the changed settings.
+
+        :param all_rows: encrypt the rows of all settings in memory?
+        :type all_rows: bool
+        :return: blind index, encrypted metadata, encrypted record and modification date of the row by domain
+        :rtype: OrderedDict
+        """
+        manager = self.manager
+        rows = OrderedDict()
+        for domain_name, setting in manager.settings.items():
+            if all_rows or setting.is_dirty():
+                m_date = setting.get_modification_date()
+                meta = {'domain': domain_name, 'mDate': m_date, 'synced': setting.is_synced()}
+                rows[domain_name] = (create_blind_index(manager.index_key, domain_name),
+                                     encrypt_record(manager.records_key, meta),
+                                     encrypt_record(manager.records_key, setting.to_dict()),
+                                     m_date)
+        return rows
+
+    def forget_written_rows(self, snapshot):
+        """
+        Removes the rows and deletions of a written snapshot from the unwritten ones of the manager. Rows which
+        were changed again after the snapshot was taken stay.
+
+        :param snapshot: a written snapshot from create_snapshot
+        :type snapshot: dict
+        """
+        manager = self.manager
+        for domain_name, row in snapshot['unwritten_rows'].items():
+            if manager.unwritten_rows.get(domain_name) is row:
+                del manager.unwritten_rows[domain_name]
+        for domain_name, deleted_row in snapshot['unwritten_deleted_rows'].items():
+            if manager.unwritten_deleted_rows.get(domain_name) is deleted_row:
+                del manager.unwritten_deleted_rows[domain_name]
+        if manager.pending_full_write is snapshot:
+            manager.pending_full_write = None
+
+    def write_snapshot(self, snapshot):
+        """
+        Writes the header and the changed rows to the database in one transaction. If another process changed the
+        database its newer rows are kept.
+
+        :param snapshot: a snapshot from create_snapshot
+        :type snapshot: dict
+        """
+        preference_manager = self.manager.preference_manager
+        with self.manager.lock:
+            with preference_manager.locked():
+                changed = preference_manager.reload_if_changed()
+                merged = changed and self.merge_stored_settings(snapshot)
+                rows = snapshot['rows']
+                deleted_rows = snapshot['deleted_rows']
+                if snapshot['replace_all']:
+                    blind_indexes = set(row[0] for row in rows)
+                    deleted_rows = deleted_rows + [(blind_index, None) for blind_index, meta in
+                                                   preference_manager.get_record_index()
+                                                   if blind_index not in blind_indexes]
+                if changed:
+                    rows = [row for row in rows if not self.is_stored_row_newer(snapshot, row[0], row[3])]
+                    deleted_rows = [row for row in deleted_rows
+                                    if not self.is_stored_row_newer(snapshot, row[0], row[1])]
+                    merged = merged or len(rows) < len(snapshot['rows'])
+                settings_crypter = Crypter(snapshot['settings_key'] + snapshot['iv2'])
+                preference_manager.commit(
+                    snapshot['salt'],
+                    snapshot['kgk_block'],
+                    encode_settings(settings_crypter, snapshot['sync_settings'], snapshot['settings']),
+                    snapshot['key_check_value'],
+                    self.container_version)
+                preference_manager.store_records([row[:3] for row in rows])
+                preference_manager.delete_records([blind_index for blind_index, m_date in deleted_rows])
+            self.forget_written_rows(snapshot)
+            if merged:
+                preference_manager.file_stat = None
+
+    def is_stored_row_newer(self, snapshot, blind_index, m_date):
+        """
+        Checks if the row in the database is newer than the modification date.
+
+        :param snapshot: a snapshot from create_snapshot
+        :type snapshot: dict
+        :param blind_index: the blind index
+        :type blind_index: bytes
+        :param m_date: the modification date (None is older than every row)
+        :type m_date: str
+        :return: is the stored row newer?
+        :rtype: bool
+        """
+        if m_date is None:
+            return False
+        row = self.manager.preference_manager.get_record(blind_index)
+        return row is not None and \
+            parse_date(decrypt_record(snapshot['records_key'], row[0])['mDate']) > parse_date(m_date)
+
+    def decode_stored(self, settings_crypter, encrypted_settings):
+        sync_settings, stored_settings = decode_settings(settings_crypter, encrypted_settings)
+        return sync_settings, None, OrderedDict(), stored_settings
+
+    def merge_record(self, snapshot, domain_name, record, m_date, synced, records_key):
+        return False
+
+    def remove_deleted(self, snapshot, domain_name, deletion_date):
+        blind_index = create_blind_index(snapshot['index_key'], domain_name)
+        rows = [row for row in snapshot['rows'] if row[0] != blind_index or parse_date(row[3]) > deletion_date]
+        if len(rows) == len(snapshot['rows']):
+            return False
+        snapshot['rows'] = rows
+        return True
@@ -0,0 +1,320 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+A preference manager which stores the settings in a SQLite database instead of the settings file.
+"""
+
+import os
+import sqlite3
+from threading import RLock
+from contextlib import contextmanager
+from preference_manager import PreferenceManager, FOOTER_MAGIC
+from settings_container import CONTAINER_VERSION_3
+
+PASSWORD_SETTINGS_DATABASE = os.path.expanduser('~/.ctSESAM.db')
+
+
+class SQLitePreferenceManager(PreferenceManager):
+    """
+    The salt, the kgk block, the key check value and the encrypted settings data are stored in the table header.
+    Every setting is a row of the table settings with its blind index as primary key so a setting is found without
+    reading the others. The database uses container version 3 (see settings_container).
+
+    The database runs in WAL mode so readers do not block the writer. locked runs its with block in an exclusive
+    transaction. has_changed_on_disk uses the data version of SQLite which changes whenever another connection
+    commits.
+
+    :param database_file: Filename of the database. Defaults to PASSWORD_SETTINGS_DATABASE as defined in the source
+    :type database_file: str
+    """
+    def __init__(self, database_file=PASSWORD_SETTINGS_DATABASE):
+        self.lock = RLock()
+        self.transaction_depth = 0
+        self.header = {}
+        self.connection = sqlite3.connect(database_file, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS header (name TEXT PRIMARY KEY, value BLOB NOT NULL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS settings (blind_index BLOB PRIMARY KEY, ' +
+                                'meta BLOB NOT NULL, record BLOB NOT NULL) WITHOUT ROWID')
+        super(SQLitePreferenceManager, self).__init__(database_file)
+
+    def close(self):
+        """
+        Closes the database connection.
+        """
+        with self.lock:
+            self.connection.close()
+
+    def read_file(self):
+        """
+        Reads the header. The rows are read when they are needed.
+        """
+        with self.lock:
+            self.header = dict(self.connection.execute('SELECT name, value FROM header'))
+            self.file_stat = self.get_data_version()
+
+    def get_data_version(self):
+        """
+        Returns the data version of SQLite.
+
+        :return: the data version
+        :rtype: int
+        """
+        with self.lock:
+            return self.connection.execute('PRAGMA data_version').fetchone()[0]
+
+    def update_file_stat(self):
+        """
+        Remembers the data version after this connection wrote the database.
+        """
+        self.file_stat = self.get_data_version()
+
+    def has_changed_on_disk(self):
+        """
+        Checks if another connection changed the database since it was read or written.
+
+        :return: changed?
+        :rtype: bool
+        """
+        return self.get_data_version() != self.file_stat
+
+    @contextmanager
+    def locked(self):
+        """
+        Runs the with block in an exclusive transaction. Nested calls join the outer transaction. If the block
+        raises an exception the transaction is rolled back.
+        """
+        with self.lock:
+            if self.transaction_depth > 0:
+                self.transaction_depth += 1
+                try:
+                    yield
+                finally:
+                    self.transaction_depth -= 1
+                return
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.transaction_depth = 1
+            try:
+                yield
+            except BaseException:
+                self.transaction_depth = 0
+                self.connection.execute('ROLLBACK')
+                self.read_file()
+                raise
+            self.transaction_depth = 0
+            self.connection.execute('COMMIT')
+            self.update_file_stat()
+
+    def store_header(self, values):
+        """
+        Writes values into the header.
+
+        :param values: values by name
+        :type values: dict
+        """
+        with self.locked():
+            self.connection.executemany('INSERT OR REPLACE INTO header (name, value) VALUES (?, ?)',
+                                        values.items())
+            self.header.update(values)
+
+    def get_salt(self):
+        """
+        Reads the salt.
+
+        :return: the salt
+        :rtype: bytes
+        """
+        return self.header.get('salt', b'')
+
+    def store_salt(self, salt):
+        """
+        Writes the salt.
+
+        :param salt: 32 bytes salt
+        :type salt: bytes
+        """
+        if type(salt) != bytes:
+            raise TypeError("The salt must be bytes.")
+        if len(salt) != 32:
+            raise ValueError("The salt has to be 32 bytes.")
+        self.store_header({'salt': salt})
+
+    def get_kgk_block(self):
+        """
+        Reads the kgk_block.
+
+        :return: 112 bytes of kgk data
+        :rtype: bytes
+        """
+        return self.header.get('kgk_block', b'')
+
+    def store_kgk_block(self, kgk_block):
+        """
+        Writes the kgk_block.
+
+        :param kgk_block: encrypted kgk data
+        :type kgk_block: bytes
+        """
+        if type(kgk_block) != bytes:
+            raise TypeError("The kgk_block must be bytes.")
+        if len(kgk_block) != 112:
+            raise ValueError("The kgk_block has to be 112 bytes.")
+        self.store_header({'kgk_block': kgk_block})
+
+    def has_footer(self):
+        """
+        Checks if there is a key check value.
+
+        :return: is there a key check value?
+        :rtype: bool
+        """
+        return 'key_check_value' in self.header
+
+    def get_footer(self):
+        """
+        Returns a footer like the one of the settings file or an empty bytes object if there is no key check value.
+
+        :return: the footer
+        :rtype: bytes
+        """
+        if self.has_footer():
+            return FOOTER_MAGIC + bytes([CONTAINER_VERSION_3]) + self.header['key_check_value']
+        return b''
+
+    def get_container_version(self):
+        """
+        The database always uses container version 3.
+
+        :return: the version
+        :rtype: int
+        """
+        return CONTAINER_VERSION_3
+
+    def store_key_check_value(self, key_check_value):
+        """
+        Writes the key check value.
+
+        :param key_check_value: 16 bytes key check value
+        :type key_check_value: bytes
+        """
+        if type(key_check_value) != bytes:
+            raise TypeError("The key check value must be bytes.")
+        if len(key_check_value) != 16:
+            raise ValueError("The key check value has to be 16 bytes.")
+        self.store_header({'key_check_value': key_check_value})
+
+    def store_kgk(self, salt, kgk_block, key_check_value):
+        """
+        Writes the salt, the kgk_block and the key check value in one transaction.
+
+        :param salt: 32 bytes salt
+        :type salt: bytes
+        :param kgk_block: 112 bytes encrypted kgk data
+        :type kgk_block: bytes
+        :param key_check_value: 16 bytes key check value
+        :type key_check_value: bytes
+        """
+        if type(salt) != bytes or type(kgk_block) != bytes or type(key_check_value) != bytes:
+            raise TypeError("Salt, kgk_block and key check value must be bytes.")
+        if len(salt) != 32:
+            raise ValueError("The salt has to be 32 bytes.")
+        if len(kgk_block) != 112:
+            raise ValueError("The kgk_block has to be 112 bytes.")
+        if len(key_check_value) != 16:
+            raise ValueError("The key check value has to be 16 bytes.")
+        self.store_header({'salt': salt, 'kgk_block': kgk_block, 'key_check_value': key_check_value})
+
+    def get_settings_data(self):
+        """
+        Reads the settings data.
+
+        :return: encrypted settings
+        :rtype: bytes
+        """
+        return self.header.get('settings_data', b'')
+
+    def store_settings_data(self, settings_data):
+        """
+        Writes the settings data.
+
+        :param settings_data: encrypted settings data
+        :type settings_data: bytes
+        """
+        if type(settings_data) != bytes:
+            raise TypeError("The settings data must be bytes.")
+        self.store_header({'settings_data': settings_data})
+
+    def commit(self, salt, kgk_block, settings_data, key_check_value=None, container_version=CONTAINER_VERSION_3):
+        """
+        Writes the whole header in one transaction. Call it inside locked to write rows in the same transaction.
+
+        :param salt: 32 bytes salt
+        :type salt: bytes
+        :param kgk_block: 112 bytes encrypted kgk data
+        :type kgk_block: bytes
+        :param settings_data: encrypted settings data
+        :type settings_data: bytes
+        :param key_check_value: 16 bytes key check value
+        :type key_check_value: bytes
+        :param container_version: has to be CONTAINER_VERSION_3
+        :type container_version: int
+        """
+        if type(salt) != bytes or type(kgk_block) != bytes or type(settings_data) != bytes:
+            raise TypeError("Salt, kgk_block and settings data must be bytes.")
+        if len(salt) != 32:
+            raise ValueError("The salt has to be 32 bytes.")
+        if len(kgk_block) != 112:
+            raise ValueError("The kgk_block has to be 112 bytes.")
+        if container_version != CONTAINER_VERSION_3:
+            raise ValueError("The database only stores container version 3.")
+        values = {'salt': salt, 'kgk_block': kgk_block, 'settings_data': settings_data}
+        if key_check_value is not None:
+            if len(key_check_value) != 16:
+                raise ValueError("The key check value has to be 16 bytes.")
+            values['key_check_value'] = key_check_value
+        self.store_header(values)
+
+    def get_record_index(self):
+        """
+        Reads the blind index and the encrypted metadata of all rows.
+
+        :return: blind index and metadata of every row
+        :rtype: [(bytes, bytes)]
+        """
+        with self.lock:
+            return self.connection.execute('SELECT blind_index, meta FROM settings').fetchall()
+
+    def get_record(self, blind_index):
+        """
+        Reads one row.
+
+        :param blind_index: the blind index
+        :type blind_index: bytes
+        :return: encrypted metadata and record or None if there is no such row
+        :rtype: (bytes, bytes)
+        """
+        with self.lock:
+            return self.connection.execute('SELECT meta, record FROM settings WHERE blind_index = ?',
+                                           (blind_index,)).fetchone()
+
+    def store_records(self, rows):
+        """
+        Inserts or replaces rows.
+
+        :param rows: blind index, encrypted metadata and encrypted record of every row
+        :type rows: [(bytes, bytes, bytes)]
+        """
+        with self.locked():
+            self.connection.executemany('INSERT OR REPLACE INTO settings (blind_index, meta, record) ' +
+                                        'VALUES (?, ?, ?)', rows)
+
+    def delete_records(self, blind_indexes):
+        """
+        Deletes rows.
+
+        :param blind_indexes: the blind indexes
+        :type blind_indexes: [bytes]
+        """
+        with self.locked():
+            self.connection.executemany('DELETE FROM settings WHERE blind_index = ?',
+                                        [(blind_index,) for blind_index in blind_indexes])
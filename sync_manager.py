@@ -12,7 +12,8 @@ import json
 
 class SyncManager(object):
     """
-    Synchronization manager. This initializes and stores settings and handles the Sync object.
+    Synchronization manager. This initializes and stores settings and handles the Sync object. The packed sync
+    settings are cached until a setting changes.
     """
     def __init__(self):
         self.server_address = ""
@@ -21,6 +22,7 @@ class SyncManager(object):
         self.certificate = ""
         self.certificate_file = None
         self.sync = None
+        self.binary_sync_settings = None
 
     def __del__(self):
         if self.certificate_file:
@@ -34,12 +36,14 @@ class SyncManager(object):
         :rtype: bytes
         """
         if self.sync:
-            return Packer.compress(json.dumps({
-                "server-address": self.server_address,
-                "username": self.username,
-                "password": self.password,
-                "certificate": self.certificate
-            }).encode('utf-8'))
+            if self.binary_sync_settings is None:
+                self.binary_sync_settings = Packer.compress(json.dumps({
+                    "server-address": self.server_address,
+                    "username": self.username,
+                    "password": self.password,
+                    "certificate": self.certificate
+                }).encode('utf-8'))
+            return self.binary_sync_settings
         else:
             return b''
 
@@ -64,6 +68,7 @@ class SyncManager(object):
             self.certificate_file.write(self.certificate.encode('utf-8'))
             self.certificate_file.seek(0)
             self.create_sync()
+            self.binary_sync_settings = data
 
     def ask_for_sync_settings(self):
         """
@@ -93,6 +98,7 @@ class SyncManager(object):
         :type url: str
         """
         self.server_address = url
+        self.binary_sync_settings = None
 
     def set_username(self, username):
         """
@@ -102,6 +108,7 @@ class SyncManager(object):
         :type username: str
         """
         self.username = username
+        self.binary_sync_settings = None
 
     def set_password(self, password):
         """
@@ -111,6 +118,7 @@ class SyncManager(object):
         :type password: str
         """
         self.password = password
+        self.binary_sync_settings = None
 
     def set_certificate(self, certificate):
         """
@@ -120,6 +128,7 @@ class SyncManager(object):
         :type certificate: str
         """
         self.certificate = certificate
+        self.binary_sync_settings = None
         if self.certificate_file:
             self.certificate_file.close()
         self.certificate_file = NamedTemporaryFile()
@@ -130,6 +139,7 @@ class SyncManager(object):
         """
         creates a sync object.
         """
+        self.binary_sync_settings = None
         self.sync = Sync(self.server_address, self.username, self.password, self.certificate_file.name)
 
     def has_settings(self):
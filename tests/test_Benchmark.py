@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import json
+from benchmark import percentile, run_benchmarks, find_regressions, main
+
+
+class TestBenchmark(unittest.TestCase):
+    def tearDown(self):
+        for file in [os.path.expanduser('~/.ctSESAM_benchmark.json'),
+                     os.path.expanduser('~/.ctSESAM_benchmark_baseline.json')]:
+            if os.path.isfile(file):
+                os.remove(file)
+
+    def test_percentile(self):
+        values = [float(i) for i in range(1, 101)]
+        self.assertEqual(50.0, percentile(values, 50))
+        self.assertEqual(99.0, percentile(values, 99))
+        self.assertEqual(3.0, percentile([3.0], 99))
+
+    def test_run_benchmarks(self):
+        results = run_benchmarks(iterations_list=[1, 2], lengths=[4, 36], complexities=[0, 6],
+                                 repetitions=2, generate_repetitions=3, backends=['hashlib'])
+        self.assertIn("CtSesam.__init__/backend=hashlib/iterations=2", results)
+        self.assertIn("Crypter.createIvKey/backend=hashlib/iterations=1", results)
+        self.assertIn("Crypter.create_key/backend=hashlib/iterations=2", results)
+        self.assertIn("CtSesam.generate/length=36/complexity=6", results)
+        self.assertEqual(10, len(results))
+        for summary in results.values():
+            self.assertLessEqual(summary["p50"], summary["p99"])
+            self.assertLess(0, summary["ops_per_second"])
+
+    def test_find_regressions(self):
+        baseline = {"a": {"p50": 1.0}, "b": {"p50": 1.0}}
+        results = {"a": {"p50": 1.1}, "b": {"p50": 1.5}, "c": {"p50": 9.0}}
+        self.assertEqual([("b", 1.0, 1.5)], find_regressions(results, baseline, 0.2))
+
+    def test_main(self):
+        output = os.path.expanduser('~/.ctSESAM_benchmark.json')
+        baseline = os.path.expanduser('~/.ctSESAM_benchmark_baseline.json')
+        self.assertEqual(0, main(['--iterations', '1', '--lengths', '4', '--complexities', '0',
+                                  '--backends', 'hashlib', '-r', '1', '-o', output]))
+        with open(output, 'r') as f:
+            report = json.load(f)
+        self.assertIn("machine", report)
+        self.assertIn("CtSesam.__init__/backend=hashlib/iterations=1", report["results"])
+        for summary in report["results"].values():
+            summary["p50"] = 1e-12
+        with open(baseline, 'w') as f:
+            json.dump(report, f)
+        self.assertEqual(1, main(['--iterations', '1', '--lengths', '4', '--complexities', '0',
+                                  '--backends', 'hashlib', '-r', '1', '-o', output, '-b', baseline, '-t', '0.5']))
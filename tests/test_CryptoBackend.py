@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import crypto_backend
+from crypter import Crypter
+
+
+class TestCryptoBackend(unittest.TestCase):
+    def setUp(self):
+        self.selected = crypto_backend.kdf_backend, crypto_backend.cipher_backend
+
+    def tearDown(self):
+        crypto_backend.kdf_backend, crypto_backend.cipher_backend = self.selected
+
+    def test_hashlib_is_available(self):
+        self.assertIn('hashlib', crypto_backend.get_available_backends())
+
+    def test_identical_kdf(self):
+        for name in crypto_backend.get_available_backends():
+            backend = crypto_backend.get_backend_class(name)
+            if crypto_backend.kdf_works(backend):
+                for hash_name in ['sha256', 'sha384', 'sha512']:
+                    self.assertEqual(hashlib.pbkdf2_hmac(hash_name, b'secret', b'pepper', 17),
+                                     backend.pbkdf2(hash_name, b'secret', b'pepper', 17))
+
+    def test_identical_crypter(self):
+        message = b'Important information with quite some length.'
+        ciphertexts = set()
+        for name in crypto_backend.get_available_backends():
+            crypto_backend.set_backend(name)
+            crypter = Crypter(Crypter.createIvKey(b'secret', b'pepper', iterations=3))
+            ciphertext = crypter.encrypt(message)
+            self.assertEqual(message, crypter.decrypt(ciphertext))
+            ciphertexts.add(ciphertext)
+        self.assertEqual(1, len(ciphertexts))
+
+    def test_set_backend(self):
+        crypto_backend.set_backend('hashlib')
+        self.assertEqual('hashlib', crypto_backend.get_backend_names()[0])
+        self.assertRaises(ValueError, crypto_backend.set_backend, 'rot13')
+
+    def test_named_backend_is_not_measured(self):
+        select_backends = crypto_backend.select_backends
+        crypto_backend.select_backends = None
+        try:
+            crypto_backend.set_backend('hashlib')
+        finally:
+            crypto_backend.select_backends = select_backends
+        self.assertEqual(crypto_backend.HashlibBackend, crypto_backend.kdf_backend)
+
+    def test_concurrent_first_use(self):
+        crypto_backend.kdf_backend, crypto_backend.cipher_backend = None, None
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda i: crypto_backend.pbkdf2('sha256', b'secret', b'pepper', 3),
+                                        range(8)))
+        self.assertEqual(1, len(set(results)))
+        self.assertIsNotNone(crypto_backend.kdf_backend)
+
+
+if __name__ == '__main__':
+    unittest.main()
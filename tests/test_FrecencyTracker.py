@@ -0,0 +1,43 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+from frecency_tracker import FrecencyTracker
+
+
+class TestFrecencyTracker(unittest.TestCase):
+    def test_record(self):
+        tracker = FrecencyTracker(half_life=100)
+        tracker.record('a.de', 1000)
+        tracker.record('a.de', 1100)
+        tracker.record('b.de', 1100)
+        self.assertEqual(2, len(tracker))
+        self.assertAlmostEqual(2.0, tracker.get_score('a.de', 1100))
+        self.assertAlmostEqual(0.5, tracker.get_score('b.de', 1200))
+        self.assertEqual(0.0, tracker.get_score('c.de', 1200))
+
+    def test_top_domains(self):
+        tracker = FrecencyTracker(half_life=100)
+        for _ in range(3):
+            tracker.record('old.de', 0)
+        tracker.record('new.de', 1000)
+        tracker.record('often.de', 950)
+        tracker.record('often.de', 950)
+        self.assertEqual(['often.de', 'new.de'], tracker.get_top_domains(2, 1000))
+        self.assertEqual(['often.de', 'new.de', 'old.de'], tracker.get_top_domains(5, 1000))
+        tracker.remove('often.de')
+        self.assertEqual(['new.de'], tracker.get_top_domains(1, 1000))
+
+    def test_dict(self):
+        tracker = FrecencyTracker()
+        tracker.record('a.de', 1000)
+        tracker.record('a.de', 1001)
+        loaded = FrecencyTracker()
+        loaded.record('b.de', 1002)
+        loaded.load_from_dict(tracker.to_dict())
+        self.assertEqual({'a.de': {'count': 2, 'lastUsed': 1001}, 'b.de': {'count': 1, 'lastUsed': 1002}},
+                         loaded.to_dict())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import iteration_calibrator
+from iteration_calibrator import measure_iterations_per_second, estimate_latency, recommend_iterations
+from iteration_calibrator import exceeds_latency_budget, is_calibrated
+
+
+class TestIterationCalibrator(unittest.TestCase):
+    def setUp(self):
+        iteration_calibrator.measured_speeds = {'sha512': 100000.0, 'sha384': 50000.0}
+
+    def tearDown(self):
+        iteration_calibrator.measured_speeds = {}
+
+    def test_measure(self):
+        iteration_calibrator.measured_speeds = {}
+        speed = measure_iterations_per_second('sha512', min_duration=0.001)
+        self.assertLess(0, speed)
+        self.assertEqual(speed, measure_iterations_per_second('sha512'))
+
+    def test_is_calibrated(self):
+        self.assertTrue(is_calibrated())
+        self.assertFalse(is_calibrated('sha256'))
+        iteration_calibrator.measured_speeds = {}
+        self.assertFalse(is_calibrated())
+
+    def test_estimate_latency(self):
+        self.assertAlmostEqual(0.04096, estimate_latency(4096))
+        self.assertAlmostEqual(0.65536, estimate_latency(32768, 'sha384'))
+
+    def test_recommend_iterations(self):
+        self.assertEqual(19456, recommend_iterations(0.2))
+        self.assertEqual(9216, recommend_iterations(0.2, 'sha384'))
+        self.assertEqual(1024, recommend_iterations(0.001))
+
+    def test_exceeds_latency_budget(self):
+        self.assertFalse(exceeds_latency_budget(4096))
+        self.assertTrue(exceeds_latency_budget(32768, hash_name='sha384'))
+        self.assertTrue(exceeds_latency_budget(4096, latency_budget=0.01))
+
+
+if __name__ == '__main__':
+    unittest.main()
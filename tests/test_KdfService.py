@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+from threading import Event
+from kdf_service import KdfService, DerivedKeyCache
+from kgk_manager import KgkManager
+from crypter import Crypter
+
+
+class TestKdfService(unittest.TestCase):
+    def setUp(self):
+        self.service = KdfService(max_workers=2)
+
+    def tearDown(self):
+        self.service.shutdown()
+
+    def test_create_iv_key(self):
+        self.assertEqual(Crypter.createIvKey(b'xyz', b'pepper', iterations=3),
+                         self.service.create_iv_key(b'xyz', b'pepper', iterations=3).result())
+
+    def test_single_flight(self):
+        started = Event()
+        release = Event()
+        calls = []
+
+        def derive(password, salt, iterations):
+            calls.append(password)
+            started.set()
+            release.wait(5)
+            return password + salt
+
+        future = self.service.submit(derive, 'derive', b'xyz', b'pepper', 3)
+        started.wait(5)
+        self.assertIs(future, self.service.submit(derive, 'derive', b'xyz', b'pepper', 3))
+        other_future = self.service.submit(derive, 'derive', b'xyz', b'salt', 3)
+        self.assertIsNot(future, other_future)
+        release.set()
+        self.assertEqual(b'xyzpepper', future.result())
+        self.assertEqual(b'xyzsalt', other_future.result())
+        self.assertEqual(2, len(calls))
+
+    def test_cancel(self):
+        service = KdfService(max_workers=1)
+        release = Event()
+        calls = []
+
+        def derive(password, salt, iterations):
+            calls.append(password)
+            release.wait(5)
+            return password + salt
+
+        running_future = service.submit(derive, 'derive', b'abc', b'pepper', 3)
+        waiting_future = service.submit(derive, 'derive', b'xyz', b'pepper', 3)
+        self.assertTrue(service.cancel(waiting_future))
+        release.set()
+        self.assertEqual(b'abcpepper', running_future.result())
+        service.shutdown()
+        self.assertEqual([b'abc'], calls)
+        self.assertIsNone(service.cache.get(service.create_key('derive', b'xyz', b'pepper', 3)))
+
+    def test_cache(self):
+        calls = []
+
+        def derive(password, salt, iterations):
+            calls.append(password)
+            return password + salt
+
+        self.assertEqual(b'xyzpepper', self.service.submit(derive, 'derive', b'xyz', b'pepper', 3).result())
+        self.assertEqual(b'xyzpepper', self.service.submit(derive, 'derive', b'xyz', b'pepper', 3).result())
+        self.assertEqual(1, len(calls))
+        self.assertEqual(1, len(self.service.cache))
+        self.service.clear_cache()
+        self.assertEqual(0, len(self.service.cache))
+        self.assertEqual(b'xyzpepper', self.service.submit(derive, 'derive', b'xyz', b'pepper', 3).result())
+        self.assertEqual(2, len(calls))
+
+    def test_cache_ttl(self):
+        cache = DerivedKeyCache(ttl=0)
+        cache.put(b'key', b'\x01'*48)
+        self.assertIsNone(cache.get(b'key'))
+        self.assertEqual(0, len(cache))
+        cache = DerivedKeyCache(ttl=60)
+        cache.put(b'key', b'\x01'*48)
+        entry = cache.entries[b'key'][1]
+        self.assertEqual(b'\x01'*48, cache.get(b'key'))
+        cache.clear()
+        self.assertEqual(bytearray(48), entry)
+
+    def test_kgk_manager(self):
+        kgkm = KgkManager()
+        kgkm.set_kdf_service(self.service)
+        crypter = kgkm.get_kgk_crypter(b'xyz', b'\x01'*32)
+        self.assertEqual(Crypter(Crypter.createIvKey(b'xyz', b'\x01'*32)).key, crypter.key)
+
+
+if __name__ == '__main__':
+    unittest.main()
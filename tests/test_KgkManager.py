@@ -4,6 +4,7 @@
 import unittest
 from kgk_manager import KgkManager
 from crypter import Crypter
+from password_generator import CtSesam, hash_cache
 
 
 class TestKgkManager(unittest.TestCase):
@@ -58,3 +59,45 @@ class TestKgkManager(unittest.TestCase):
         kgkm.fresh_salt2()
         self.assertNotEqual(b"\x3A"*32, kgkm.get_salt2())
         self.assertEqual(32, len(kgkm.get_salt2()))
+
+    def test_reset_clears_hash_cache(self):
+        kgkm = KgkManager()
+        kgkm.create_new_kgk()
+        CtSesam(domain='some.domain', username='', kgk=kgkm.get_kgk(), iterations=3)
+        self.assertLess(0, len(hash_cache))
+        kgkm.reset()
+        self.assertEqual(0, len(hash_cache))
+
+    def test_key_check_value(self):
+        kgkm = KgkManager()
+        kgkm.create_new_kgk()
+        kgkm.kgk_crypter = Crypter(Crypter.createIvKey(b'right', b'pepper', iterations=3))
+        kgk_block = kgkm.get_encrypted_kgk()
+        key_check_value = kgkm.kgk_crypter.get_key_check_value()
+        self.assertEqual(16, len(key_check_value))
+        kgkm2 = KgkManager()
+        with self.assertRaises(PermissionError):
+            kgkm2.decrypt_kgk(kgk_block, Crypter(Crypter.createIvKey(b'wrong', b'pepper', iterations=3)),
+                              key_check_value=key_check_value)
+        self.assertFalse(kgkm2.has_kgk())
+        kgkm2.decrypt_kgk(kgk_block, Crypter(Crypter.createIvKey(b'right', b'pepper', iterations=3)),
+                          key_check_value=key_check_value)
+        self.assertEqual(kgkm.get_kgk(), kgkm2.get_kgk())
+
+    def test_salt2_rotation(self):
+        kgkm = KgkManager(salt2_rotation_interval=2)
+        kgkm.create_new_kgk()
+        kgkm.prepare_local_encryption()
+        salt2 = kgkm.get_salt2()
+        iv2 = kgkm.get_iv2()
+        settings_key = kgkm.get_settings_key()
+        self.assertEqual(Crypter.create_key(kgkm.get_kgk(), salt2), settings_key)
+        kgkm.prepare_local_encryption()
+        self.assertEqual(salt2, kgkm.get_salt2())
+        self.assertNotEqual(iv2, kgkm.get_iv2())
+        self.assertIs(settings_key, kgkm.get_settings_key())
+        kgkm.prepare_local_encryption()
+        self.assertNotEqual(salt2, kgkm.get_salt2())
+        self.assertEqual(Crypter.create_key(kgkm.get_kgk(), kgkm.get_salt2()), kgkm.get_settings_key())
+        kgkm.reset()
+        self.assertIsNone(kgkm.settings_key)
@@ -3,7 +3,10 @@
 Test for CtSESAM class.
 """
 import unittest
-from password_generator import CtSesam
+from threading import Event
+from concurrent.futures import CancelledError
+from password_generator import CtSesam, HashCache, hash_cache, derive_hash, render_password, render_passwords
+from password_generator import generate_passwords
 from password_setting import PasswordSetting
 
 
@@ -37,3 +40,74 @@ class TestCtSesam(unittest.TestCase):
         setting.set_template("Aanoxxxxxxxxxxxxxxxxxxxxxxxxxxxx")
         manager = CtSesam(domain=setting.get_domain(), username=setting.get_username(), kgk='foo'.encode('utf-8'))
         self.assertEqual("Ba0=}#K.X<$/eS0AuGjRm>(\"dnDnvZCx", manager.generate(setting))
+
+    def test_render_many(self):
+        hash_value = derive_hash('some.domain', '', 'foo'.encode('utf-8'), 'pepper'.encode('utf-8'))
+        self.assertEqual("]ew26XW.X<", render_password(hash_value, "xaxnxxAoxx"))
+        self.assertEqual(["]ew26XW.X<", "Ba0=}#K.X<$/eS0AuGjRm>(\"dnDnvZCx", "5#%KiEvUU7"], render_passwords(
+            hash_value, [("xaxnxxAoxx", '#!"§$%&/()[]{}=-_+*<>;:.'),
+                         ("Aanoxxxxxxxxxxxxxxxxxxxxxxxxxxxx", '#!"§$%&/()[]{}=-_+*<>;:.'),
+                         ("oxxxxxxxxx",
+                          'abcdefghijklmnopqrstuvwxyzABCDUFGHJKLMNPQRTEVWXYZ0123456789#!"§$%&/()[]{}=-_+*<>;:.')]))
+
+    def test_strength_matrix(self):
+        manager = CtSesam(domain='some.domain', username='', kgk='foo'.encode('utf-8'), iterations=3)
+        matrix = manager.generate_strength_matrix(4, 36)
+        self.assertEqual(33, len(matrix))
+        for i, line in enumerate(matrix):
+            self.assertEqual(7, len(line))
+            for password in line:
+                self.assertEqual(i + 4, len(password))
+        self.assertTrue(matrix[0][0].isdigit())
+        self.assertTrue(matrix[10][1].islower())
+        self.assertEqual(manager.generate_many(["naAoxxxxxx"])[0], matrix[6][6])
+
+    def test_hash_cache(self):
+        hash_cache.clear()
+        manager = CtSesam(domain='some.domain', username='', kgk='foo'.encode('utf-8'), iterations=3)
+        self.assertEqual(1, len(hash_cache))
+        cached_manager = CtSesam(domain='some.domain', username='', kgk='foo'.encode('utf-8'), iterations=3)
+        self.assertEqual(1, len(hash_cache))
+        self.assertEqual(manager.hash_value, cached_manager.hash_value)
+        CtSesam(domain='some.domain', username='', kgk='foo'.encode('utf-8'), iterations=4)
+        CtSesam(domain='some.domain', username='', kgk='bar'.encode('utf-8'), iterations=3)
+        self.assertEqual(3, len(hash_cache))
+        hash_cache.clear()
+        self.assertEqual(0, len(hash_cache))
+        CtSesam(domain='some.domain', username='', kgk='foo'.encode('utf-8'), iterations=3, use_cache=False)
+        self.assertEqual(0, len(hash_cache))
+
+    def test_hash_cache_eviction(self):
+        cache = HashCache(max_size=2)
+        cache.put(b'a', b'\x01'*64)
+        cache.put(b'b', b'\x02'*64)
+        evicted = cache.entries[b'b']
+        self.assertEqual(b'\x01'*64, cache.get(b'a'))
+        cache.put(b'c', b'\x03'*64)
+        self.assertIsNone(cache.get(b'b'))
+        self.assertEqual(bytearray(64), evicted)
+        self.assertEqual(b'\x01'*64, cache.get(b'a'))
+        self.assertEqual(b'\x03'*64, cache.get(b'c'))
+
+    def test_generate_passwords(self):
+        settings = []
+        for i in range(12):
+            setting = PasswordSetting('domain' + str(i) + '.com')
+            setting.set_iterations(i + 1)
+            settings.append(setting)
+        progress = []
+        passwords = generate_passwords(settings, 'foo'.encode('utf-8'), max_workers=4,
+                                       progress_callback=lambda done, total: progress.append((done, total)))
+        self.assertEqual(12, len(passwords))
+        for setting, password in zip(settings, passwords):
+            manager = CtSesam(setting.get_domain(), setting.get_username(), 'foo'.encode('utf-8'),
+                              setting.get_salt(), setting.get_iterations(), use_cache=False)
+            self.assertEqual(manager.generate(setting), password)
+        self.assertEqual((12, 12), progress[-1])
+
+    def test_generate_passwords_cancelled(self):
+        cancel_event = Event()
+        cancel_event.set()
+        settings = [PasswordSetting('domain' + str(i) + '.com') for i in range(4)]
+        self.assertRaises(CancelledError, generate_passwords, settings, 'foo'.encode('utf-8'),
+                          cancel_event=cancel_event)
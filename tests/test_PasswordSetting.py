@@ -130,6 +130,27 @@ class TestPasswordSetting(unittest.TestCase):
         self.assertEquals("2001-01-01T02:14:12", s.get_creation_date())
         self.assertEquals("2005-01-01T01:14:12", s.get_modification_date())
 
+    def test_load_encoded(self):
+        loaded_setting = {"domain": "unit.test", "username": "testilinius", "iterations": 5341,
+                          "passwordTemplate": "xxxxoxxxxxxxxxxx", "salt": "ZmFzY2luYXRpbmc=",
+                          "cDate": "2001-01-01T02:14:12", "mDate": "2005-01-01T01:14:12"}
+        s = PasswordSetting("unit.test", loaded_setting)
+        self.assertEqual("ZmFzY2luYXRpbmc=", s.encoded_salt)
+        self.assertEqual(("2001-01-01T02:14:12", "2005-01-01T01:14:12"), s.encoded_dates)
+        self.assertEqual("testilinius", s.get_username())
+        self.assertEqual("xxxxoxxxxxxxxxxx", s.get_template())
+        self.assertEqual("fascinating".encode('utf-8'), s.get_salt())
+        self.assertEqual("2001-01-01T02:14:12", s.get_creation_date())
+        self.assertEqual("2005-01-01T01:14:12", s.get_modification_date())
+        self.assertIsNone(s.encoded_dates)
+        loaded = PasswordSetting("unit.test")
+        loaded.load_from_dict(loaded_setting)
+        self.assertEqual(loaded.to_dict(), s.to_dict())
+        s = PasswordSetting("unit.test", {"domain": "unit.test", "mDate": "2005-01-01T01:14:12"})
+        self.assertEqual(32, len(s.get_salt()))
+        self.assertEqual(10, s.get_length())
+        self.assertEqual("2005-01-01T01:14:12", s.get_creation_date())
+
     def test_get_template(self):
         s = PasswordSetting("unit.test")
         s.set_template("xxxaxxxxxxx")
@@ -138,6 +159,36 @@ class TestPasswordSetting(unittest.TestCase):
         self.assertEqual("xxxxxxoxxxnAxxxa", s.get_template())
         self.assertEqual(16, len(s.get_template()))
 
+    def test_template_metadata(self):
+        s = PasswordSetting("unit.test")
+        self.assertFalse(hasattr(s, '__dict__'))
+        s.set_template("xxnxaxxx")
+        self.assertEqual(3, s.get_complexity())
+        self.assertEqual(8, s.get_length())
+        self.assertEqual("0123456789abcdefghijklmnopqrstuvwxyz", s.get_character_set())
+        s.set_template("2;AAxxx")
+        self.assertEqual(2, s.get_complexity())
+        self.assertEqual(5, s.get_length())
+        self.assertEqual("ABCDEFGHIJKLMNOPQRSTUVWXYZ", s.get_character_set())
+        s.set_template("AxoA")
+        self.assertEqual(-1, s.get_complexity())
+        s.set_extra_character_set("#!")
+        self.assertEqual("ABCDEFGHIJKLMNOPQRSTUVWXYZ#!", s.get_character_set())
+        other = PasswordSetting("other.test", {"passwordTemplate": "xAxo", "extras": "".join(["#", "!"])})
+        self.assertIs(s.get_extra_character_set(), other.get_extra_character_set())
+        self.assertIs(s.get_character_set(), other.get_character_set())
+
+    def test_dirty(self):
+        s = PasswordSetting("unit.test")
+        self.assertTrue(s.is_dirty())
+        s.set_dirty(False)
+        s.set_username(None)
+        s.set_iterations(4096)
+        s.set_extra_character_set(None)
+        self.assertFalse(s.is_dirty())
+        s.set_iterations(5000)
+        self.assertTrue(s.is_dirty())
+
 
 if __name__ == '__main__':
     unittest.main()
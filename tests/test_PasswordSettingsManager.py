@@ -97,6 +97,10 @@ class TestPasswordSettingsManager(unittest.TestCase):
             except ImportError:
                 pass
             os.remove(file)
+        if os.path.isfile(os.path.expanduser('~/.ctSESAM_test.pws.lock')):
+            os.remove(os.path.expanduser('~/.ctSESAM_test.pws.lock'))
+        if os.path.isfile(os.path.expanduser('~/.ctSESAM_test.pws.log')):
+            os.remove(os.path.expanduser('~/.ctSESAM_test.pws.log'))
 
     def test_get_setting(self):
         setting = self.manager.get_setting('abc.de')
@@ -119,8 +123,10 @@ class TestPasswordSettingsManager(unittest.TestCase):
         self.manager.store_local_settings(kgk_manager)
         with open(os.path.expanduser('~/.ctSESAM_test.pws'), 'br') as f:
             data = f.read()
+        self.assertEqual(b'CTSK', data[-21:-17])
+        self.assertEqual(kgk_manager.kgk_crypter.get_key_check_value(), data[-16:])
         settings_crypter = PasswordSettingsManager.get_settings_crypter(kgk_manager)
-        decrypted_settings = settings_crypter.decrypt(data[144:])
+        decrypted_settings = settings_crypter.decrypt(data[144:-21])
         sync_settings_len = struct.unpack('!I', decrypted_settings[:4])[0]
         data = json.loads(Packer.decompress(decrypted_settings[4+sync_settings_len:]).decode('utf8'))
         self.assertEqual('abc.de', data['settings']['abc.de']['domain'])
@@ -164,11 +170,15 @@ class TestPasswordSettingsManager(unittest.TestCase):
         self.manager.load_local_settings(kgk_manager)
         self.assertIn('unit.test', self.manager.get_domain_list())
         self.assertIn('some.domain', self.manager.get_domain_list())
+        self.assertEqual(0, len(self.manager.settings))
+        self.assertFalse(self.manager.is_dirty())
         self.assertEqual('xxxxxxxxxxo', self.manager.get_setting('unit.test').get_template())
         self.assertEqual(5000, self.manager.get_setting('unit.test').get_iterations())
         self.assertEqual('Nice note!', self.manager.get_setting('unit.test').get_notes())
         self.assertEqual('oxxx', self.manager.get_setting('some.domain').get_template())
         self.assertEqual('6478593021', self.manager.get_setting('some.domain').get_character_set())
+        self.assertEqual('2014-08-02T10:37:12', self.manager.get_setting('some.domain').get_modification_date())
+        self.assertFalse(self.manager.is_dirty())
 
     def test_set_setting(self):
         setting = self.manager.get_setting('hugo.me')
@@ -211,13 +221,13 @@ class TestPasswordSettingsManager(unittest.TestCase):
             'synced': []
         }
         salt = os.urandom(32)
-        f = open(os.path.expanduser('~/.ctSESAM_test.pws'), 'bw')
         data = json.dumps(settings).encode('utf-8')
         kgk_manager = KgkManager()
         kgk_manager.set_preference_manager(self.preference_manager)
         kgk_manager.create_new_kgk()
         kgk_block = kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', salt, iterations=3)))
         crypter = PasswordSettingsManager.get_settings_crypter(kgk_manager)
+        f = open(os.path.expanduser('~/.ctSESAM_test.pws'), 'bw')
         f.write(salt + kgk_block + crypter.encrypt(struct.pack('!I', 0) + Packer.compress(data)))
         f.close()
         self.preference_manager.read_file()
@@ -335,3 +345,258 @@ class TestPasswordSettingsManager(unittest.TestCase):
             except ImportError:
                 pass
             os.remove(file)
+
+    def test_frequently_used_settings(self):
+        for domain in ['a.de', 'b.de', 'c.de']:
+            self.manager.set_setting(PasswordSetting(domain))
+        self.assertEqual([], self.manager.get_frequently_used_settings(2))
+        self.assertNotIn('frecency', self.manager.get_settings_as_dict())
+        self.manager.frecency.record('c.de')
+        self.manager.frecency.record('c.de')
+        self.manager.frecency.record('a.de')
+        self.assertEqual(['c.de', 'a.de'],
+                         [setting.get_domain() for setting in self.manager.get_frequently_used_settings(2)])
+        self.manager.delete_setting(self.manager.get_setting('c.de'))
+        self.assertEqual(['a.de'],
+                         [setting.get_domain() for setting in self.manager.get_frequently_used_settings(2)])
+        self.assertEqual(['a.de'], list(self.manager.get_settings_as_dict()['frecency'].keys()))
+
+    def test_dirty_tracking(self):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32), iterations=3)))
+        self.assertFalse(self.manager.is_dirty())
+        setting = self.manager.get_setting('abc.de')
+        self.assertTrue(self.manager.is_dirty())
+        self.assertTrue(self.manager.store_local_settings_if_dirty(kgk_manager))
+        self.assertFalse(setting.is_dirty())
+        stored_data = self.preference_manager.get_settings_data()
+        self.manager.set_setting(setting)
+        self.manager.frecency.record('abc.de')
+        self.assertFalse(self.manager.store_local_settings_if_dirty(kgk_manager))
+        self.assertEqual(stored_data, self.preference_manager.get_settings_data())
+        setting.set_username('hugo')
+        self.assertTrue(self.manager.store_local_settings_if_dirty(kgk_manager))
+        self.assertNotEqual(stored_data, self.preference_manager.get_settings_data())
+        manager = PasswordSettingsManager(self.preference_manager)
+        manager.load_local_settings(kgk_manager)
+        self.assertEqual('hugo', manager.get_setting('abc.de').get_username())
+        self.assertFalse(manager.is_dirty())
+        stored_data = self.preference_manager.get_settings_data()
+        self.manager.frecency.record('abc.de')
+        self.manager.flush(kgk_manager)
+        self.assertNotEqual(stored_data, self.preference_manager.get_settings_data())
+        self.assertFalse(self.manager.frecency.dirty)
+        manager = PasswordSettingsManager(self.preference_manager)
+        manager.load_local_settings(kgk_manager)
+        self.assertEqual(['abc.de'], manager.frecency.get_top_domains(1))
+
+    def test_concurrent_processes(self):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32), iterations=3)))
+        self.manager.get_setting('first.de')
+        self.manager.store_local_settings(kgk_manager)
+        other_preference_manager = PreferenceManager(os.path.expanduser('~/.ctSESAM_test.pws'))
+        other_kgk_manager = KgkManager()
+        other_kgk_manager.set_preference_manager(other_preference_manager)
+        other_kgk_manager.decrypt_kgk(other_preference_manager.get_kgk_block(), kgk_manager.kgk_crypter)
+        other_kgk_manager.salt = other_preference_manager.get_salt()
+        other_manager = PasswordSettingsManager(other_preference_manager)
+        other_manager.load_local_settings(other_kgk_manager)
+        self.assertFalse(other_manager.reload_if_changed(other_kgk_manager))
+        self.manager.get_setting('second.de')
+        self.manager.store_local_settings(kgk_manager)
+        other_manager.get_setting('third.de')
+        other_manager.store_local_settings(other_kgk_manager)
+        self.assertTrue(self.manager.reload_if_changed(kgk_manager))
+        self.assertEqual(['first.de', 'second.de', 'third.de'], sorted(self.manager.get_domain_list()))
+        self.assertFalse(self.manager.reload_if_changed(kgk_manager))
+        self.assertTrue(other_manager.reload_if_changed(other_kgk_manager))
+        self.assertEqual(['first.de', 'second.de', 'third.de'], sorted(other_manager.get_domain_list()))
+
+    def test_concurrent_deletion(self):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32), iterations=3)))
+        self.manager.get_setting('x.de').set_modification_date("2020-01-01T00:00:00")
+        self.manager.get_setting('y.de').set_modification_date("2020-01-01T00:00:00")
+        self.manager.store_local_settings(kgk_manager)
+        other_preference_manager = PreferenceManager(os.path.expanduser('~/.ctSESAM_test.pws'))
+        other_kgk_manager = KgkManager()
+        other_kgk_manager.set_preference_manager(other_preference_manager)
+        other_kgk_manager.decrypt_kgk(other_preference_manager.get_kgk_block(), kgk_manager.kgk_crypter)
+        other_kgk_manager.salt = other_preference_manager.get_salt()
+        other_manager = PasswordSettingsManager(other_preference_manager)
+        other_manager.load_local_settings(other_kgk_manager)
+        self.manager.delete_setting(self.manager.get_setting('x.de'))
+        self.manager.store_local_settings(kgk_manager)
+        other_manager.get_setting('z.de')
+        other_manager.store_local_settings(other_kgk_manager)
+        self.assertTrue(self.manager.reload_if_changed(kgk_manager))
+        self.assertEqual(['y.de', 'z.de'], sorted(self.manager.get_domain_list()))
+        self.assertTrue(other_manager.reload_if_changed(other_kgk_manager))
+        self.assertEqual(['y.de', 'z.de'], sorted(other_manager.get_domain_list()))
+        other_manager.get_setting('y.de').set_modification_date("2030-01-01T00:00:00")
+        other_manager.store_local_settings(other_kgk_manager)
+        self.manager.delete_setting(self.manager.get_setting('y.de'))
+        self.manager.store_local_settings(kgk_manager)
+        self.assertTrue(other_manager.reload_if_changed(other_kgk_manager))
+        self.assertEqual(['y.de', 'z.de'], sorted(other_manager.get_domain_list()))
+
+    def test_failed_write(self):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32), iterations=3)))
+        errors = []
+        self.manager.set_write_error_callback(errors.append)
+        self.manager.get_setting('a.de')
+        commit = self.preference_manager.commit
+
+        def failing_commit(*args, **kwargs):
+            raise OSError("disk full")
+        self.preference_manager.commit = failing_commit
+        self.assertRaises(OSError, self.manager.store_local_settings, kgk_manager)
+        self.assertTrue(self.manager.is_dirty())
+        self.assertIsInstance(errors[0], OSError)
+        self.preference_manager.commit = commit
+        self.assertTrue(self.manager.store_local_settings_if_dirty(kgk_manager))
+        self.assertFalse(self.manager.is_dirty())
+        self.assertEqual([None], errors[1:])
+        manager = PasswordSettingsManager(self.preference_manager)
+        manager.load_local_settings(kgk_manager)
+        self.assertEqual(['a.de'], manager.get_domain_list())
+
+    def test_reload_foreign_settings(self):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32), iterations=3)))
+        self.manager.get_setting('first.de')
+        self.manager.store_local_settings(kgk_manager)
+        other_preference_manager = PreferenceManager(os.path.expanduser('~/.ctSESAM_test.pws'))
+        other_kgk_manager = KgkManager()
+        other_kgk_manager.set_preference_manager(other_preference_manager)
+        other_kgk_manager.create_new_kgk()
+        other_kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'abc', os.urandom(32),
+                                                                                    iterations=3)))
+        other_manager = PasswordSettingsManager(other_preference_manager)
+        other_manager.get_setting('foreign.de')
+        other_manager.store_local_settings(other_kgk_manager)
+        self.manager.get_setting('second.de')
+        self.assertRaises(ValueError, self.manager.store_local_settings, kgk_manager)
+        self.assertTrue(self.manager.is_dirty())
+        self.assertRaises(ValueError, self.manager.reload_if_changed, kgk_manager)
+        self.assertRaises(ValueError, self.manager.reload_if_changed, kgk_manager)
+        self.assertRaises(ValueError, self.manager.store_local_settings_if_dirty, kgk_manager)
+        self.assertTrue(self.manager.is_dirty())
+        self.assertEqual(['first.de', 'second.de'], self.manager.get_domain_list())
+        foreign_manager = PasswordSettingsManager(PreferenceManager(os.path.expanduser('~/.ctSESAM_test.pws')))
+        foreign_manager.load_local_settings(other_kgk_manager)
+        self.assertEqual(['foreign.de'], foreign_manager.get_domain_list())
+
+    def test_has_setting(self):
+        self.assertFalse(self.manager.has_setting('a.de'))
+        self.manager.get_setting('a.de')
+        self.manager.get_setting('b.de')
+        self.assertTrue(self.manager.has_setting('a.de'))
+        domain_list = self.manager.get_domain_list()
+        self.assertEqual(['a.de', 'b.de'], domain_list)
+        self.assertIs(domain_list, self.manager.get_domain_list())
+        new_setting = PasswordSetting('a.de')
+        self.manager.set_setting(new_setting)
+        self.assertEqual(['b.de', 'a.de'], self.manager.get_domain_list())
+        self.assertIs(new_setting, self.manager.get_setting('a.de'))
+        self.manager.delete_setting(new_setting)
+        self.assertFalse(self.manager.has_setting('a.de'))
+        self.assertEqual(['b.de'], self.manager.get_domain_list())
+
+    def test_container_version_2(self):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32), iterations=3)))
+        self.manager.set_container_version(2)
+        self.manager.get_setting('first.de').set_notes('first note')
+        self.manager.get_setting('second.de').set_notes('second note')
+        self.manager.store_local_settings(kgk_manager)
+        self.assertEqual(2, self.preference_manager.get_container_version())
+        first_record = self.manager.record_cache['first.de']
+        self.assertIn(first_record, self.preference_manager.get_settings_data())
+        other_preference_manager = PreferenceManager(os.path.expanduser('~/.ctSESAM_test.pws'))
+        other_kgk_manager = KgkManager()
+        other_kgk_manager.set_preference_manager(other_preference_manager)
+        other_kgk_manager.decrypt_kgk(other_preference_manager.get_kgk_block(), kgk_manager.kgk_crypter,
+                                      key_check_value=other_preference_manager.get_key_check_value())
+        other_kgk_manager.salt = other_preference_manager.get_salt()
+        other_manager = PasswordSettingsManager(other_preference_manager)
+        other_manager.load_local_settings(other_kgk_manager)
+        self.assertEqual(2, other_manager.container_version)
+        self.assertEqual(0, len(other_manager.settings))
+        self.assertEqual(['first.de', 'second.de'], other_manager.get_domain_list())
+        self.assertTrue(other_manager.has_setting('second.de'))
+        self.assertEqual('second note', other_manager.get_setting('second.de').get_notes())
+        self.assertEqual(['second.de'], list(other_manager.settings.keys()))
+        self.assertEqual(['first.de', 'second.de'], other_manager.get_domain_list())
+        self.assertFalse(other_manager.is_dirty())
+        other_manager.get_setting('third.de').set_notes('third note')
+        other_manager.get_setting('first.de')
+        self.assertEqual(['first.de', 'second.de', 'third.de'], other_manager.get_domain_list())
+        other_manager.store_local_settings(other_kgk_manager)
+        self.assertIn(first_record, other_preference_manager.get_settings_data())
+        self.assertTrue(self.manager.reload_if_changed(kgk_manager))
+        self.assertEqual(['first.de', 'second.de', 'third.de'], self.manager.get_domain_list())
+        self.assertEqual('third note', self.manager.get_setting('third.de').get_notes())
+        settings = self.manager.get_settings_as_dict()['settings']
+        self.assertEqual('first note', settings['first.de']['notes'])
+        self.assertEqual(0, len(self.manager.lazy_records))
+
+    def test_settings_log(self):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32), iterations=3)))
+        self.manager.enable_log()
+        self.manager.get_setting('first.de').set_notes('first note')
+        self.manager.store_local_settings(kgk_manager)
+        self.assertFalse(self.manager.settings_log.exists())
+        with open(os.path.expanduser('~/.ctSESAM_test.pws'), 'rb') as f:
+            settings_file_data = f.read()
+        self.manager.get_setting('second.de').set_notes('second note')
+        self.manager.store_local_settings(kgk_manager)
+        self.manager.delete_setting(self.manager.get_setting('first.de'))
+        self.manager.store_local_settings(kgk_manager)
+        self.assertFalse(self.manager.is_dirty())
+        self.assertTrue(self.manager.settings_log.get_size() > 0)
+        with open(os.path.expanduser('~/.ctSESAM_test.pws'), 'rb') as f:
+            self.assertEqual(settings_file_data, f.read())
+        other_preference_manager = PreferenceManager(os.path.expanduser('~/.ctSESAM_test.pws'))
+        other_kgk_manager = KgkManager()
+        other_kgk_manager.set_preference_manager(other_preference_manager)
+        other_kgk_manager.decrypt_kgk(other_preference_manager.get_kgk_block(), kgk_manager.kgk_crypter,
+                                      key_check_value=other_preference_manager.get_key_check_value())
+        other_kgk_manager.salt = other_preference_manager.get_salt()
+        other_manager = PasswordSettingsManager(other_preference_manager)
+        other_manager.load_local_settings(other_kgk_manager)
+        self.assertTrue(other_manager.log_enabled)
+        self.assertEqual(['second.de'], other_manager.get_domain_list())
+        self.assertEqual('second note', other_manager.get_setting('second.de').get_notes())
+        self.assertIn('first.de', other_manager.tombstones)
+        other_manager.get_setting('third.de').set_notes('third note')
+        other_manager.store_local_settings(other_kgk_manager)
+        self.assertTrue(self.manager.reload_if_changed(kgk_manager))
+        self.assertEqual(['second.de', 'third.de'], self.manager.get_domain_list())
+        self.assertEqual('third note', self.manager.get_setting('third.de').get_notes())
+        self.assertFalse(self.manager.reload_if_changed(kgk_manager))
+        self.manager.compaction_ratio = 0
+        self.manager.get_setting('third.de').set_notes('changed note')
+        self.manager.get_setting('third.de').set_modification_date("2030-01-01T00:00:00")
+        self.manager.store_local_settings(kgk_manager)
+        self.assertEqual(0, self.manager.settings_log.get_size())
+        self.assertTrue(other_manager.reload_if_changed(other_kgk_manager))
+        self.assertEqual(['second.de', 'third.de'], sorted(other_manager.get_domain_list()))
+        self.assertEqual('changed note', other_manager.get_setting('third.de').get_notes())
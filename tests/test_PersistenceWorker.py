@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import time
+from threading import Event
+from persistence_worker import PersistenceWorker
+from preference_manager import PreferenceManager
+from sqlite_preference_manager import SQLitePreferenceManager
+from password_settings_manager import PasswordSettingsManager
+from kgk_manager import KgkManager
+from crypter import Crypter
+
+
+class TestPersistenceWorker(unittest.TestCase):
+    def setUp(self):
+        self.worker = PersistenceWorker(coalescing_window=0.05)
+
+    def tearDown(self):
+        self.worker.close()
+        file = os.path.expanduser('~/.ctSESAM_test.pws')
+        if os.path.isfile(file):
+            os.remove(file)
+        if os.path.isfile(os.path.expanduser('~/.ctSESAM_test.pws.lock')):
+            os.remove(os.path.expanduser('~/.ctSESAM_test.pws.lock'))
+        for file in ['~/.ctSESAM_test.pws.log', '~/.ctSESAM_test.db', '~/.ctSESAM_test.db-wal',
+                     '~/.ctSESAM_test.db-shm']:
+            if os.path.isfile(os.path.expanduser(file)):
+                os.remove(os.path.expanduser(file))
+
+    def test_coalescing(self):
+        writes = []
+        futures = [self.worker.submit(lambda i=i: writes.append(i) or i) for i in range(10)]
+        self.worker.flush()
+        self.assertEqual([9], writes)
+        self.assertEqual([9]*10, [future.result(timeout=1) for future in futures])
+        self.assertFalse(self.worker.has_pending_write())
+
+    def test_write_during_write(self):
+        started = Event()
+        proceed = Event()
+        writes = []
+
+        def slow_write():
+            started.set()
+            proceed.wait(1)
+            writes.append('slow')
+        self.worker.submit(slow_write)
+        started.wait(1)
+        future = self.worker.submit(lambda: writes.append('next'))
+        proceed.set()
+        future.result(timeout=1)
+        self.assertEqual(['slow', 'next'], writes)
+
+    def test_exception(self):
+        def failing_write():
+            raise IOError("disk full")
+        future = self.worker.submit(failing_write)
+        self.worker.flush()
+        self.assertIsInstance(future.exception(timeout=1), IOError)
+
+    def test_closed(self):
+        self.worker.close()
+        self.worker.close()
+        self.assertRaises(RuntimeError, self.worker.submit, lambda: None)
+
+    def test_settings_manager(self):
+        preference_manager = PreferenceManager(os.path.expanduser('~/.ctSESAM_test.pws'))
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32),
+                                                                              iterations=3)))
+        manager = PasswordSettingsManager(preference_manager)
+        manager.set_persistence_worker(self.worker)
+        setting = manager.get_setting('abc.de')
+        futures = []
+        for length in range(10, 20):
+            setting.set_template('x'*length)
+            futures.append(manager.store_local_settings(kgk_manager))
+        manager.flush()
+        self.assertTrue(all(future.done() for future in futures))
+        loaded_manager = PasswordSettingsManager(PreferenceManager(os.path.expanduser('~/.ctSESAM_test.pws')))
+        loaded_manager.load_local_settings(kgk_manager)
+        self.assertEqual(19, loaded_manager.get_setting('abc.de').get_length())
+
+    def test_settings_manager_lock(self):
+        preference_manager = PreferenceManager(os.path.expanduser('~/.ctSESAM_test.pws'))
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32),
+                                                                              iterations=3)))
+        manager = PasswordSettingsManager(preference_manager)
+        manager.set_persistence_worker(self.worker)
+        manager.get_setting('abc.de')
+        with manager.lock:
+            future = manager.store_local_settings(kgk_manager)
+            time.sleep(0.2)
+            self.assertFalse(future.done())
+        future.result(timeout=5)
+        self.assertFalse(manager.is_dirty())
+
+
+    def test_settings_manager_failed_write(self):
+        preference_manager = PreferenceManager(os.path.expanduser('~/.ctSESAM_test.pws'))
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32),
+                                                                              iterations=3)))
+        manager = PasswordSettingsManager(preference_manager)
+        manager.set_persistence_worker(self.worker)
+        manager.get_setting('abc.de')
+
+        def failing_commit(*args, **kwargs):
+            raise OSError("disk full")
+        preference_manager.commit = failing_commit
+        future = manager.store_local_settings(kgk_manager)
+        manager.flush()
+        self.assertIsInstance(future.exception(timeout=1), OSError)
+        self.assertIsInstance(manager.write_error, OSError)
+        self.assertTrue(manager.is_dirty())
+
+    def test_coalesced_rows(self):
+        database = SQLitePreferenceManager(os.path.expanduser('~/.ctSESAM_test.db'))
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(database)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32),
+                                                                              iterations=3)))
+        manager = PasswordSettingsManager(database)
+        manager.set_persistence_worker(PersistenceWorker(coalescing_window=1.0))
+        manager.get_setting('a.de')
+        first_future = manager.store_local_settings(kgk_manager)
+        manager.get_setting('b.de')
+        manager.get_setting('c.de')
+        manager.store_local_settings(kgk_manager)
+        manager.delete_setting(manager.get_setting('c.de'))
+        manager.store_local_settings(kgk_manager)
+        manager.flush()
+        manager.persistence_worker.close()
+        self.assertTrue(first_future.done())
+        self.assertEqual(2, len(database.get_record_index()))
+        self.assertFalse(manager.is_dirty())
+        self.assertEqual(0, len(manager.unwritten_rows))
+        self.assertEqual(0, len(manager.unwritten_deleted_rows))
+        database.close()
+
+
+    def test_coalesced_log(self):
+        preference_manager = PreferenceManager(os.path.expanduser('~/.ctSESAM_test.pws'))
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32),
+                                                                              iterations=3)))
+        manager = PasswordSettingsManager(preference_manager)
+        manager.enable_log()
+        manager.get_setting('base.de')
+        manager.get_setting('x.de')
+        manager.store_local_settings(kgk_manager)
+        manager.set_persistence_worker(PersistenceWorker(coalescing_window=1.0))
+        compaction_size = manager.compaction_size
+        manager.compaction_size = 0
+        manager.delete_setting(manager.get_setting('x.de'))
+        manager.get_setting('b.de')
+        manager.store_local_settings(kgk_manager)
+        manager.compaction_size = compaction_size
+        manager.get_setting('a.de')
+        manager.store_local_settings(kgk_manager)
+        manager.flush()
+        manager.persistence_worker.close()
+        self.assertIsNone(manager.pending_full_write)
+        loaded_manager = PasswordSettingsManager(PreferenceManager(os.path.expanduser('~/.ctSESAM_test.pws')))
+        loaded_manager.load_local_settings(kgk_manager)
+        self.assertEqual(['a.de', 'b.de', 'base.de'], sorted(loaded_manager.get_domain_list()))
+
+
+if __name__ == '__main__':
+    unittest.main()
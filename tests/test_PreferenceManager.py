@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+from preference_manager import PreferenceManager
+
+
+class TestPreferenceManager(unittest.TestCase):
+    def setUp(self):
+        self.settings_file = os.path.expanduser('~/.ctSESAM_test.pws')
+        if os.path.isfile(self.settings_file):
+            os.remove(self.settings_file)
+        self.preference_manager = PreferenceManager(self.settings_file)
+
+    def tearDown(self):
+        if os.path.isfile(self.settings_file):
+            try:
+                import win32con
+                import win32api
+                win32api.SetFileAttributes(self.settings_file, win32con.FILE_ATTRIBUTE_NORMAL)
+            except ImportError:
+                pass
+            os.remove(self.settings_file)
+
+    def test_file_without_footer(self):
+        with open(self.settings_file, 'wb') as f:
+            f.write(b'\x01'*32 + b'\x02'*112 + b'\x03'*48)
+        preference_manager = PreferenceManager(self.settings_file)
+        self.assertFalse(preference_manager.has_footer())
+        self.assertEqual(b'', preference_manager.get_key_check_value())
+        self.assertEqual(b'\x03'*48, preference_manager.get_settings_data())
+
+    def test_key_check_value(self):
+        self.preference_manager.store_salt(b'\x01'*32)
+        self.preference_manager.store_kgk_block(b'\x02'*112)
+        self.preference_manager.store_settings_data(b'\x03'*48)
+        self.preference_manager.store_key_check_value(b'\x04'*16)
+        self.assertEqual(b'\x04'*16, self.preference_manager.get_key_check_value())
+        self.preference_manager.store_settings_data(b'\x05'*32)
+        preference_manager = PreferenceManager(self.settings_file)
+        self.assertEqual(b'\x01'*32, preference_manager.get_salt())
+        self.assertEqual(b'\x02'*112, preference_manager.get_kgk_block())
+        self.assertEqual(b'\x05'*32, preference_manager.get_settings_data())
+        self.assertEqual(b'\x04'*16, preference_manager.get_key_check_value())
+        self.assertEqual(144 + 32 + 21, os.path.getsize(self.settings_file))
+
+    def test_commit(self):
+        self.preference_manager.store_salt(b'\x09'*32)
+        self.preference_manager.commit(b'\x01'*32, b'\x02'*112, b'\x03'*32, b'\x04'*16)
+        self.assertEqual(b'\x03'*32, self.preference_manager.get_settings_data())
+        preference_manager = PreferenceManager(self.settings_file)
+        self.assertEqual(b'\x01'*32, preference_manager.get_salt())
+        self.assertEqual(b'\x02'*112, preference_manager.get_kgk_block())
+        self.assertEqual(b'\x03'*32, preference_manager.get_settings_data())
+        self.assertEqual(b'\x04'*16, preference_manager.get_key_check_value())
+        self.assertEqual([], [name for name in os.listdir(os.path.dirname(self.settings_file))
+                              if name.startswith('.ctSESAM') and name.endswith('.tmp')])
+        self.assertRaises(ValueError, self.preference_manager.commit, b'\x01'*31, b'\x02'*112, b'')
+
+    def test_store_kgk(self):
+        self.preference_manager.commit(b'\x01'*32, b'\x02'*112, b'\x03'*32, b'\x04'*16, 2)
+        self.preference_manager.store_kgk(b'\x05'*32, b'\x06'*112, b'\x07'*16)
+        preference_manager = PreferenceManager(self.settings_file)
+        self.assertEqual(b'\x05'*32, preference_manager.get_salt())
+        self.assertEqual(b'\x06'*112, preference_manager.get_kgk_block())
+        self.assertEqual(b'\x03'*32, preference_manager.get_settings_data())
+        self.assertEqual(b'\x07'*16, preference_manager.get_key_check_value())
+        self.assertEqual(2, preference_manager.get_container_version())
+        self.assertRaises(ValueError, self.preference_manager.store_kgk, b'\x05'*32, b'\x06'*112, b'\x07'*15)
+        self.assertEqual(b'\x05'*32, PreferenceManager(self.settings_file).get_salt())
+
+    def test_container_version(self):
+        self.assertEqual(1, self.preference_manager.get_container_version())
+        self.preference_manager.commit(b'\x01'*32, b'\x02'*112, b'\x03'*32, b'\x04'*16, 2)
+        self.assertEqual(2, PreferenceManager(self.settings_file).get_container_version())
+        self.preference_manager.store_key_check_value(b'\x05'*16)
+        self.assertEqual(2, PreferenceManager(self.settings_file).get_container_version())
+        self.assertRaises(ValueError, self.preference_manager.commit, b'\x01'*32, b'\x02'*112, b'', None, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+from crypter import Crypter
+from kgk_manager import KgkManager
+from preference_manager import PreferenceManager
+from sqlite_preference_manager import SQLitePreferenceManager
+from password_settings_manager import PasswordSettingsManager
+from settings_migration import migrate_to_database
+
+
+class TestSQLitePreferenceManager(unittest.TestCase):
+    def setUp(self):
+        self.settings_file = os.path.expanduser('~/.ctSESAM_test.pws')
+        self.database_file = os.path.expanduser('~/.ctSESAM_test.db')
+        self.remove_files()
+        self.database = SQLitePreferenceManager(self.database_file)
+
+    def tearDown(self):
+        self.database.close()
+        self.remove_files()
+
+    def remove_files(self):
+        for file in [self.settings_file, self.settings_file + '.lock', self.database_file,
+                     self.database_file + '-wal', self.database_file + '-shm']:
+            if os.path.isfile(file):
+                os.remove(file)
+
+    def open_kgk_manager(self, database, kgk_crypter):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(database)
+        kgk_manager.decrypt_kgk(database.get_kgk_block(), kgk_crypter,
+                                key_check_value=database.get_key_check_value())
+        kgk_manager.salt = database.get_salt()
+        return kgk_manager
+
+    def test_header(self):
+        self.assertEqual('wal', self.database.connection.execute('PRAGMA journal_mode').fetchone()[0])
+        self.database.store_salt(b'\x01'*32)
+        self.database.store_kgk_block(b'\x02'*112)
+        self.database.store_key_check_value(b'\x03'*16)
+        self.database.store_settings_data(b'\x04'*32)
+        other_database = SQLitePreferenceManager(self.database_file)
+        self.assertEqual(b'\x01'*32, other_database.get_salt())
+        self.assertEqual(b'\x02'*112, other_database.get_kgk_block())
+        self.assertEqual(b'\x03'*16, other_database.get_key_check_value())
+        self.assertEqual(b'\x04'*32, other_database.get_settings_data())
+        self.assertEqual(3, other_database.get_container_version())
+        self.assertFalse(other_database.has_changed_on_disk())
+        self.database.store_records([(b'\x05'*32, b'meta', b'record')])
+        self.assertTrue(other_database.reload_if_changed())
+        self.assertEqual((b'meta', b'record'), other_database.get_record(b'\x05'*32))
+        self.assertIsNone(other_database.get_record(b'\x06'*32))
+        with self.database.locked():
+            self.database.store_salt(b'\x07'*32)
+            self.database.delete_records([b'\x05'*32])
+            self.assertEqual((b'meta', b'record'), other_database.get_record(b'\x05'*32))
+        self.assertEqual([], other_database.get_record_index())
+        self.assertRaises(ValueError, self.database.commit, b'\x01'*32, b'\x02'*112, b'', b'\x03'*16, 2)
+        other_database.close()
+
+    def test_settings(self):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.database)
+        kgk_manager.create_new_kgk()
+        kgk_crypter = Crypter(Crypter.createIvKey(b'xyz', os.urandom(32), iterations=3))
+        kgk_manager.create_and_save_new_kgk_block(kgk_crypter)
+        manager = PasswordSettingsManager(self.database)
+        self.assertRaises(ValueError, manager.set_container_version, 2)
+        manager.get_setting('first.de').set_notes('first note')
+        manager.get_setting('second.de').set_notes('second note')
+        manager.store_local_settings(kgk_manager)
+        self.assertEqual(2, len(self.database.get_record_index()))
+        other_database = SQLitePreferenceManager(self.database_file)
+        other_kgk_manager = self.open_kgk_manager(other_database, kgk_crypter)
+        other_manager = PasswordSettingsManager(other_database)
+        other_manager.load_local_settings(other_kgk_manager)
+        self.assertEqual(['first.de', 'second.de'], sorted(other_manager.get_domain_list()))
+        self.assertEqual(0, len(other_manager.settings))
+        self.assertEqual('second note', other_manager.get_setting('second.de').get_notes())
+        other_manager.delete_setting(other_manager.get_setting('first.de'))
+        other_manager.get_setting('third.de').set_notes('third note')
+        other_manager.store_local_settings(other_kgk_manager)
+        self.assertEqual(2, len(self.database.get_record_index()))
+        self.assertTrue(manager.reload_if_changed(kgk_manager))
+        self.assertEqual('third note', manager.get_setting('third.de').get_notes())
+        manager.get_setting('second.de').set_notes('changed note')
+        manager.get_setting('second.de').set_modification_date("2030-01-01T00:00:00")
+        manager.store_local_settings(kgk_manager)
+        self.assertTrue(other_manager.reload_if_changed(other_kgk_manager))
+        self.assertEqual('changed note', other_manager.get_setting('second.de').get_notes())
+        self.assertEqual(['second.de', 'third.de'], sorted(other_manager.get_domain_list()))
+        self.assertEqual(2, len(self.database.get_record_index()))
+        other_database.close()
+
+    def test_migration(self):
+        preference_manager = PreferenceManager(self.settings_file)
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_crypter = kgk_manager.get_kgk_crypter(b'xyz', Crypter.createSalt())
+        kgk_manager.store_local_kgk_block()
+        manager = PasswordSettingsManager(preference_manager)
+        manager.get_setting('first.de').set_notes('first note')
+        manager.get_setting('second.de')
+        manager.frecency.record('first.de')
+        manager.store_local_settings(kgk_manager)
+        self.assertRaises(PermissionError, migrate_to_database, b'wrong', self.settings_file, self.database_file)
+        self.assertEqual(2, migrate_to_database(b'xyz', self.settings_file, self.database_file))
+        self.assertRaises(ValueError, migrate_to_database, b'xyz', self.settings_file, self.database_file)
+        self.database.read_file()
+        database_kgk_manager = self.open_kgk_manager(self.database, kgk_crypter)
+        self.assertEqual(kgk_manager.get_kgk(), database_kgk_manager.get_kgk())
+        database_manager = PasswordSettingsManager(self.database)
+        database_manager.load_local_settings(database_kgk_manager)
+        self.assertEqual(['first.de', 'second.de'], sorted(database_manager.get_domain_list()))
+        self.assertEqual('first note', database_manager.get_setting('first.de').get_notes())
+        self.assertEqual(['first.de'], database_manager.frecency.get_top_domains(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
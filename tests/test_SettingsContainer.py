@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+from collections import OrderedDict
+from crypter import Crypter
+from settings_container import encode_settings, decode_settings, encode_container, decode_container, \
+    encrypt_record, decrypt_record, create_records_key
+
+
+class TestSettingsContainer(unittest.TestCase):
+    def setUp(self):
+        self.settings_crypter = Crypter(b'\x01'*32 + b'\x02'*16)
+
+    def test_settings(self):
+        data = {'settings': {'a.de': {'domain': 'a.de'}}, 'synced': []}
+        sync_settings, decoded_data = decode_settings(self.settings_crypter,
+                                                      encode_settings(self.settings_crypter, b'sync', data))
+        self.assertEqual(b'sync', sync_settings)
+        self.assertEqual(data, decoded_data)
+
+    def test_record(self):
+        records_key = create_records_key()
+        data_set = {'domain': 'a.de', 'length': 10}
+        encrypted_record = encrypt_record(records_key, data_set)
+        self.assertNotEqual(encrypted_record, encrypt_record(records_key, data_set))
+        self.assertEqual(0, len(encrypted_record) % 16)
+        self.assertEqual(data_set, decrypt_record(records_key, encrypted_record))
+
+    def test_container(self):
+        records_key = create_records_key()
+        records = OrderedDict()
+        records['a.de'] = (encrypt_record(records_key, {'domain': 'a.de'}), '2015-01-01T00:00:00', True)
+        records['b.de'] = (encrypt_record(records_key, {'domain': 'b.de'}), '2015-02-01T00:00:00', False)
+        extras = {'tombstones': {'c.de': '2015-03-01T00:00:00'}}
+        settings_data = encode_container(self.settings_crypter, b'', records_key, records, extras)
+        self.assertEqual(0, len(settings_data) % 16)
+        sync_settings, decoded_records_key, decoded_records, index = decode_container(self.settings_crypter,
+                                                                                      settings_data)
+        self.assertEqual(b'', sync_settings)
+        self.assertEqual(records_key, decoded_records_key)
+        self.assertEqual(records, decoded_records)
+        self.assertEqual(['a.de', 'b.de'], list(decoded_records.keys()))
+        self.assertEqual(extras, index)
+        self.assertEqual({'domain': 'b.de'}, decrypt_record(records_key, decoded_records['b.de'][0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+from hashlib import sha256
+import hmac
+import struct
+from settings_container import decrypt_record
+from settings_log import SettingsLog, derive_log_keys
+
+
+class TestSettingsLog(unittest.TestCase):
+    def setUp(self):
+        self.log_file = os.path.expanduser('~/.ctSESAM_test.pws.log')
+        if os.path.isfile(self.log_file):
+            os.remove(self.log_file)
+        self.records_key = b'\x01'*32
+        self.seed = SettingsLog.create_seed(self.records_key, b'\x02'*64)
+        self.settings_log = SettingsLog(self.log_file)
+
+    def tearDown(self):
+        if os.path.isfile(self.log_file):
+            os.remove(self.log_file)
+
+    def test_append_and_read(self):
+        self.assertFalse(self.settings_log.exists())
+        self.settings_log.append(self.records_key, self.seed, [{'domain': 'a.de'}])
+        self.settings_log.append(self.records_key, self.seed, [{'domain': 'b.de'}, {'domain': 'c.de'}])
+        self.assertFalse(self.settings_log.has_changed_on_disk())
+        other_log = SettingsLog(self.log_file)
+        self.assertEqual([{'domain': 'a.de'}, {'domain': 'b.de'}, {'domain': 'c.de'}],
+                         other_log.read(self.records_key, self.seed))
+        other_log.append(self.records_key, self.seed, [{'domain': 'd.de'}])
+        self.assertTrue(self.settings_log.has_changed_on_disk())
+        self.settings_log.append(self.records_key, self.seed, [{'domain': 'e.de'}])
+        self.assertEqual(['a.de', 'b.de', 'c.de', 'd.de', 'e.de'],
+                         [entry['domain'] for entry in other_log.read(self.records_key, self.seed)])
+
+    def test_invalid_data(self):
+        self.settings_log.append(self.records_key, self.seed, [{'domain': 'a.de'}, {'domain': 'b.de'}])
+        size = self.settings_log.get_size()
+        with open(self.log_file, 'ab') as f:
+            f.write(b'\x00\x00\x00\x30' + b'\x03'*20)
+        self.assertEqual(2, len(self.settings_log.read(self.records_key, self.seed)))
+        self.settings_log.append(self.records_key, self.seed, [{'domain': 'c.de'}])
+        self.assertEqual(3, len(SettingsLog(self.log_file).read(self.records_key, self.seed)))
+        self.assertTrue(self.settings_log.get_size() > size)
+        other_seed = SettingsLog.create_seed(self.records_key, b'\x04'*64)
+        self.assertEqual([], self.settings_log.read(self.records_key, other_seed))
+        self.assertEqual([], self.settings_log.read(b'\x05'*32, self.seed))
+        self.settings_log.reset(other_seed)
+        self.assertTrue(self.settings_log.exists())
+        self.assertEqual(0, self.settings_log.get_size())
+
+    def test_separate_keys(self):
+        encryption_key, mac_key = derive_log_keys(self.records_key)
+        self.assertEqual(3, len({self.records_key, encryption_key, mac_key}))
+        self.settings_log.append(self.records_key, self.seed, [{'domain': 'a.de'}])
+        with open(self.log_file, 'rb') as f:
+            data = f.read()
+        length = struct.unpack('!I', data[:4])[0]
+        encrypted_entry = data[4:4+length]
+        self.assertEqual(hmac.new(mac_key, self.seed + encrypted_entry, sha256).digest(), data[4+length:])
+        self.assertEqual({'domain': 'a.de'}, decrypt_record(encryption_key, encrypted_entry))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+from datetime import datetime
+from settings_merger import parse_date, datetime_to_timestamp, merge, create_export_data
+
+
+class TestSettingsMerger(unittest.TestCase):
+    def test_parse_date(self):
+        self.assertEqual(0, parse_date("1970-01-01T00:00:00"))
+        self.assertEqual(1373640371, parse_date("2013-07-12T14:46:11"))
+        self.assertEqual(datetime_to_timestamp(datetime(2013, 7, 12, 14, 46, 11)), parse_date("2013-07-12T14:46:11"))
+        self.assertRaises(ValueError, parse_date, "12.07.2013")
+
+    def test_merge(self):
+        local_dates = {
+            'same.de': parse_date("2015-01-01T00:00:00"),
+            'older.de': parse_date("2015-01-01T00:00:00"),
+            'newer.de': parse_date("2015-01-01T00:00:00"),
+            'deleted.de': parse_date("2015-01-01T00:00:00")
+        }
+        remote_data = {
+            'same.de': {'mDate': "2015-01-01T00:00:00"},
+            'older.de': {'mDate': "2016-01-01T00:00:00"},
+            'newer.de': {'mDate': "2014-01-01T00:00:00"},
+            'deleted.de': {'mDate': "2016-01-01T00:00:00", 'deleted': True},
+            'new.de': {'mDate': "2014-01-01T00:00:00"},
+            'gone.de': {'mDate': "2014-01-01T00:00:00", 'deleted': True}
+        }
+        delta = merge(local_dates, remote_data)
+        self.assertEqual(['new.de'], delta.added)
+        self.assertEqual(['older.de'], delta.updated)
+        self.assertEqual(['deleted.de'], delta.deleted)
+        self.assertTrue(delta.needs_push)
+        self.assertTrue(delta.has_local_changes())
+
+    def test_merge_without_changes(self):
+        delta = merge({'same.de': parse_date("2015-01-01T00:00:00")}, {'same.de': {'mDate': "2015-01-01T00:00:00"}})
+        self.assertFalse(delta.has_local_changes())
+        self.assertFalse(delta.needs_push)
+        self.assertTrue(merge({'same.de': parse_date("2015-01-01T00:00:00")},
+                              {'same.de': {'mDate': "2015-01-01T00:00:00"}}, ['same.de']).needs_push)
+        self.assertTrue(merge({'local.de': 0}, {}).needs_push)
+
+    def test_merge_local_tombstone(self):
+        remote_data = {'deleted.de': {'mDate': "2015-01-01T00:00:00"}}
+        delta = merge({}, remote_data, tombstones={'deleted.de': "2016-01-01T00:00:00"})
+        self.assertEqual([], delta.added)
+        self.assertTrue(delta.needs_push)
+        delta = merge({}, remote_data, tombstones={'deleted.de': "2014-01-01T00:00:00"})
+        self.assertEqual(['deleted.de'], delta.added)
+
+    def test_create_export_data(self):
+        local_data = {
+            'local.de': {'domain': 'local.de', 'mDate': "2015-01-01T00:00:00"},
+            'deleted.de': {'domain': 'deleted.de', 'mDate': "2015-01-01T00:00:00"}
+        }
+        remote_data = {
+            'deleted.de': {'mDate': "2016-01-01T00:00:00", 'deleted': True},
+            'locally.deleted.de': {'domain': 'locally.deleted.de', 'mDate': "2014-01-01T00:00:00"}
+        }
+        export_data = create_export_data(local_data, remote_data, {'locally.deleted.de': "2015-06-01T00:00:00",
+                                                                   'other.de': "2015-06-01T00:00:00"})
+        self.assertEqual(local_data['local.de'], export_data['local.de'])
+        self.assertEqual(remote_data['deleted.de'], export_data['deleted.de'])
+        self.assertEqual({'mDate': "2015-06-01T00:00:00", 'deleted': True}, export_data['locally.deleted.de'])
+        self.assertEqual({'mDate': "2015-06-01T00:00:00", 'deleted': True}, export_data['other.de'])
+        self.assertNotIn('deleted', local_data['deleted.de'])
+
+
+if __name__ == '__main__':
+    unittest.main()
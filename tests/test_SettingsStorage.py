@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+from collections import OrderedDict
+from crypter import Crypter
+from kgk_manager import KgkManager
+from preference_manager import PreferenceManager
+from password_settings_manager import PasswordSettingsManager
+from settings_container import encode_settings, encode_container, encrypt_record, decrypt_record, \
+    create_records_key, create_blind_index, CONTAINER_VERSION_1, CONTAINER_VERSION_2, CONTAINER_VERSION_3
+from settings_merger import parse_date
+
+
+class TestSettingsStorage(unittest.TestCase):
+    def setUp(self):
+        self.settings_file = os.path.expanduser('~/.ctSESAM_test.pws')
+        self.preference_manager = PreferenceManager(self.settings_file)
+        self.manager = PasswordSettingsManager(self.preference_manager)
+        self.settings_crypter = Crypter(b'\x01'*32 + b'\x02'*16)
+
+    def tearDown(self):
+        for file in [self.settings_file, self.settings_file + '.lock', self.settings_file + '.log']:
+            if os.path.isfile(file):
+                os.remove(file)
+
+    def test_get_storage(self):
+        self.assertEqual(CONTAINER_VERSION_1, self.manager.get_storage().container_version)
+        self.assertEqual(CONTAINER_VERSION_2, self.manager.get_storage(CONTAINER_VERSION_2).container_version)
+        self.assertEqual(CONTAINER_VERSION_1, self.manager.get_storage(7).container_version)
+        self.manager.set_container_version(CONTAINER_VERSION_2)
+        self.assertEqual(CONTAINER_VERSION_2, self.manager.get_storage().container_version)
+
+    def test_write_and_load(self):
+        kgk_manager = KgkManager()
+        kgk_manager.set_preference_manager(self.preference_manager)
+        kgk_manager.create_new_kgk()
+        kgk_manager.create_and_save_new_kgk_block(Crypter(Crypter.createIvKey(b'xyz', os.urandom(32), iterations=3)))
+        for container_version in [CONTAINER_VERSION_1, CONTAINER_VERSION_2]:
+            self.manager.set_container_version(container_version)
+            self.manager.get_setting('a.de').set_notes('note ' + str(container_version))
+            self.manager.get_storage().create_write(kgk_manager)()
+            self.assertFalse(self.manager.is_dirty())
+            self.assertEqual(container_version, self.preference_manager.get_container_version())
+            manager = PasswordSettingsManager(self.preference_manager)
+            manager.get_storage(container_version).load(
+                kgk_manager, PasswordSettingsManager.get_settings_crypter(kgk_manager),
+                self.preference_manager.get_settings_data())
+            self.assertEqual(['a.de'], manager.get_domain_list())
+            self.assertEqual(0, len(manager.settings))
+            self.assertEqual('note ' + str(container_version), manager.get_setting('a.de').get_notes())
+
+    def test_dict_storage(self):
+        storage = self.manager.get_storage(CONTAINER_VERSION_1)
+        data = {'settings': {'a.de': {'domain': 'a.de', 'mDate': '2020-01-01T00:00:00'}}, 'synced': ['a.de']}
+        sync_settings, records_key, records, stored_settings = storage.decode_stored(
+            self.settings_crypter, encode_settings(self.settings_crypter, b'sync', data))
+        self.assertEqual(b'sync', sync_settings)
+        self.assertIsNone(records_key)
+        self.assertEqual(({'domain': 'a.de', 'mDate': '2020-01-01T00:00:00'}, '2020-01-01T00:00:00', True),
+                         records['a.de'])
+        snapshot = {'settings': {'settings': {'a.de': {'domain': 'a.de', 'mDate': '2021-01-01T00:00:00'}},
+                                 'synced': []}}
+        self.assertFalse(storage.merge_record(snapshot, 'a.de', *records['a.de'], records_key=None))
+        self.assertTrue(storage.merge_record(snapshot, 'b.de', {'domain': 'b.de', 'mDate': '2020-01-01T00:00:00'},
+                                             '2020-01-01T00:00:00', True, None))
+        self.assertEqual(['b.de'], snapshot['settings']['synced'])
+        self.assertFalse(storage.remove_deleted(snapshot, 'a.de', parse_date('2020-06-01T00:00:00')))
+        self.assertTrue(storage.remove_deleted(snapshot, 'b.de', parse_date('2020-06-01T00:00:00')))
+        self.assertEqual(['a.de'], list(snapshot['settings']['settings'].keys()))
+        self.assertEqual([], snapshot['settings']['synced'])
+
+    def test_container_storage(self):
+        storage = self.manager.get_storage(CONTAINER_VERSION_2)
+        stored_key = create_records_key()
+        stored_records = OrderedDict()
+        stored_records['a.de'] = (encrypt_record(stored_key, {'domain': 'a.de'}), '2021-01-01T00:00:00', False)
+        sync_settings, records_key, records, index = storage.decode_stored(
+            self.settings_crypter, encode_container(self.settings_crypter, b'', stored_key, stored_records, {}))
+        self.assertEqual(stored_key, records_key)
+        snapshot = {'records_key': create_records_key(), 'records': OrderedDict()}
+        snapshot['records']['a.de'] = (b'old', '2020-01-01T00:00:00', True)
+        self.assertTrue(storage.merge_record(snapshot, 'a.de', *records['a.de'], records_key=records_key))
+        self.assertEqual({'domain': 'a.de'}, decrypt_record(snapshot['records_key'], snapshot['records']['a.de'][0]))
+        self.assertFalse(storage.merge_record(snapshot, 'a.de', {'domain': 'a.de'}, '2020-01-01T00:00:00', True,
+                                              None))
+        self.assertFalse(storage.remove_deleted(snapshot, 'a.de', parse_date('2020-06-01T00:00:00')))
+        self.assertTrue(storage.remove_deleted(snapshot, 'a.de', parse_date('2021-01-01T00:00:00')))
+        self.assertEqual(0, len(snapshot['records']))
+
+    def test_row_storage(self):
+        storage = self.manager.get_storage(CONTAINER_VERSION_3)
+        index_key = b'\x03'*32
+        snapshot = {'index_key': index_key, 'rows': [
+            (create_blind_index(index_key, 'a.de'), b'meta', b'record', '2021-01-01T00:00:00'),
+            (create_blind_index(index_key, 'b.de'), b'meta', b'record', '2020-01-01T00:00:00')]}
+        self.assertFalse(storage.merge_record(snapshot, 'c.de', {'domain': 'c.de'}, '2020-01-01T00:00:00', True,
+                                              None))
+        self.assertFalse(storage.remove_deleted(snapshot, 'a.de', parse_date('2020-06-01T00:00:00')))
+        self.assertTrue(storage.remove_deleted(snapshot, 'b.de', parse_date('2020-06-01T00:00:00')))
+        self.assertEqual([create_blind_index(index_key, 'a.de')], [row[0] for row in snapshot['rows']])
+
+
+if __name__ == '__main__':
+    unittest.main()